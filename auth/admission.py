@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Admission control
+-----------------
+
+Limits the number of requests each worker handles at once, so an overloaded
+worker rejects requests straight away (503 with a Retry-After header)
+instead of letting latency grow without bound.
+
+Requests are grouped into classes, e.g. "verify" & "token", each with a limit
+on its in-flight requests. The worker also has a total capacity, of which
+`reserved` requests can only be used by the priority classes, so cheap
+/verify requests are still admitted while /token requests are rejected.
+"""
+from koi.exceptions import HTTPError
+from tornado.options import options
+
+from . import metrics
+
+PRIORITY = ('verify',)
+
+_controller = None
+
+
+class Overloaded(HTTPError):
+    """The worker is handling too many requests"""
+
+    def __init__(self, retry_after):
+        super(Overloaded, self).__init__(503, 'Service overloaded')
+        self.retry_after = retry_after
+
+
+class AdmissionController(object):
+    """
+    :param capacity: maximum requests in flight, 0 for no limit
+    :param limits: dict of class name -> maximum requests in flight for the
+        class
+    :param reserved: part of the capacity only used by priority classes
+    :param priority: the priority classes' names
+    """
+
+    def __init__(self, capacity, limits, reserved=0, priority=PRIORITY):
+        self.capacity = capacity
+        self.limits = limits
+        self.reserved = reserved
+        self.priority = priority
+        self.in_flight = dict.fromkeys(limits, 0)
+
+    @property
+    def total(self):
+        return sum(self.in_flight.values())
+
+    def admit(self, name, queue_time=0):
+        """
+        Admit a request if there's capacity
+
+        :param name: the request's class
+        :param queue_time: seconds the request waited before reaching the
+            handler
+        :returns: True if admitted, otherwise False
+        """
+        capacity = self.capacity
+        if capacity and name not in self.priority:
+            capacity -= self.reserved
+
+        limit = self.limits.get(name)
+        in_flight = self.in_flight.get(name, 0)
+        if ((capacity and self.total >= capacity) or
+                (limit and in_flight >= limit)):
+            metrics.increment('admission.{}.rejected'.format(name))
+            return False
+
+        self.in_flight[name] = in_flight + 1
+        metrics.increment('admission.{}.admitted'.format(name))
+        metrics.increment('admission.{}.queue_time_ms'.format(name),
+                          queue_time * 1000)
+        return True
+
+    def release(self, name):
+        """Release an admitted request's capacity"""
+        self.in_flight[name] -= 1
+
+
+def get_controller():
+    """The worker's admission controller"""
+    global _controller
+
+    if _controller is None:
+        _controller = AdmissionController(
+            int(getattr(options, 'admission_capacity', 0)),
+            {'verify': int(getattr(options, 'admission_verify_limit', 0)),
+             'token': int(getattr(options, 'admission_token_limit', 0))},
+            int(getattr(options, 'admission_reserved', 0)))
+
+    return _controller
+
+
+def retry_after():
+    """Seconds a rejected client should wait before retrying"""
+    return int(getattr(options, 'admission_retry_after', 1))
@@ -15,8 +15,11 @@ import koi
 import tornado.ioloop
 from tornado.options import options
 
-from . import __version__
-from .controllers import root_handler, authorize
+from . import (__version__, backends, cache, capture, fairqueue, histograms,
+               memory, metrics, pool, profiler, snapshot, supervisor, tracing,
+               warmup)
+from .controllers import root_handler, admin, authorize, ready
+from .controllers.metrics import MetricsHandler
 
 # directory containing the config files
 CONF_DIR = os.path.join(os.path.dirname(__file__), '../config')
@@ -25,6 +28,10 @@ APPLICATION_URLS = [
     (r"", root_handler.RootHandler, {'version': __version__}),
     (r"/verify", authorize.VerifyHandler),
     (r"/token", authorize.TokenHandler),
+    (r"/ready", ready.ReadyHandler),
+    (r"/metrics", MetricsHandler),
+    (r"/admin/profile", admin.ProfileHandler),
+    (r"/admin/memory", admin.MemoryHandler),
 ]
 
 
@@ -51,11 +58,41 @@ def main():
         __version__,
         options.service_type,
         APPLICATION_URLS)
-    server = koi.make_server(app, CONF_DIR)
+    supervised = getattr(options, 'supervisor', False)
+    if supervised:
+        # the workers bind the port themselves using SO_REUSEPORT
+        supervisor.configure_logging()
+    else:
+        server = koi.make_server(app, CONF_DIR)
+
+    # Create the caches, histograms & counters, and load the registry backend &
+    # snapshot before forking so that they are shared by the workers
+    cache.configure(int(options.processes))
+    histograms.configure(int(options.processes), supervised)
+    metrics.configure(int(options.processes), supervised)
+    memory.configure(int(options.processes), supervised)
+    fairqueue.configure(int(options.processes), supervised)
+    pool.configure()
+    capture.configure()
+    tracing.configure()
+    backends.configure()
+    snapshot.preload()
+
+    if supervised:
+        supervisor.run(app, CONF_DIR)
+        return
 
     # Forks multiple sub-processes, one for each core
     server.start(int(options.processes))
 
+    snapshot.follow()
+    profiler.install_signal_handler()
+    memory.start_rss_gauge()
+    fairqueue.start()
+    capture.start()
+    tracing.start()
+    warmup.start()
+
     tornado.ioloop.IOLoop.instance().start()
 
 if __name__ == '__main__':      # pragma: no cover
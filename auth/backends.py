@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Registry backends
+-----------------
+
+By default registry lookups are made to CouchDB, through perch or the read
+replicas. The `registry_backend` option selects a different backend:
+
+    - "couch": the registry database (the default)
+    - "local": documents loaded from the `registry_fixture` file into memory,
+      so the service can be benchmarked & profiled without a CouchDB
+    - the dotted path of a class, e.g. "mypackage.backends.RedisBackend"
+
+A backend is created by calling its class's `from_options` method, and
+implements coroutines that match the perch lookups used by the registry:
+
+    - authenticate(client_id, client_secret): like Service.authenticate
+    - get(cls, resource_id): like Service.get & Repository.get
+    - get_resource(resource_id): the service or repository from the
+      service_and_repository view
+    - get_by_location(location): like Service.get_by_location
+
+The lookups return services & repositories implementing the same interface
+as perch's, and raise perch.exceptions.NotFound for missing resources.
+
+The fixture file contains a JSON list of registry documents, i.e.
+organisations (including their services & repositories) and
+oauth_client_credentials. A CouchDB _all_docs response (with include_docs)
+or _changes response from a registry can also be used.
+"""
+import importlib
+import json
+import logging
+
+from perch import exceptions, Service
+from tornado.gen import coroutine, Return
+from tornado.options import options
+
+from . import snapshot
+
+SECRET_TYPE = 'oauth_client_credentials'
+
+_backend = None
+
+
+def read_fixture(path):
+    """
+    Read the registry documents from a fixture file
+
+    :returns: list of documents
+    """
+    with open(path) as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        rows = data.get('rows', data.get('results', []))
+        return [x['doc'] for x in rows
+                if 'doc' in x and not x['id'].startswith('_design/')]
+
+    return data
+
+
+class LocalBackend(object):
+    """
+    Registry documents held in memory
+
+    :param docs: registry documents
+    """
+
+    def __init__(self, docs):
+        self.snapshot = snapshot.Snapshot()
+        self.secrets = set()
+        for doc in docs:
+            if doc.get('type') == SECRET_TYPE:
+                self.secrets.add((doc['_id'], doc['client_id']))
+            else:
+                self.snapshot.add_document(doc)
+
+    @classmethod
+    def from_options(cls):
+        path = options.registry_fixture
+        backend = cls(read_fixture(path))
+        logging.info('Loaded %s resources from %s', len(backend.snapshot),
+                     path)
+
+        return backend
+
+    def _get(self, resource_id, resource_type=None):
+        record = self.snapshot.get(resource_id, resource_type)
+        if record is None:
+            raise exceptions.NotFound()
+
+        return record
+
+    @coroutine
+    def authenticate(self, client_id, client_secret):
+        if (client_secret, client_id) not in self.secrets:
+            raise Return(None)
+
+        raise Return(self._get(client_id, Service.resource_type))
+
+    @coroutine
+    def get(self, cls, resource_id):
+        raise Return(self._get(resource_id, cls.resource_type))
+
+    @coroutine
+    def get_resource(self, resource_id):
+        raise Return(self._get(resource_id))
+
+    @coroutine
+    def get_by_location(self, location):
+        record = self.snapshot.get_by_location(location)
+        if record is None:
+            raise exceptions.NotFound()
+
+        raise Return(record)
+
+
+BACKENDS = {
+    'local': LocalBackend,
+}
+
+
+def _backend_class(name):
+    """The backend class for a name or dotted path"""
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        pass
+
+    module_name, _, class_name = name.rpartition('.')
+    if not module_name:
+        raise ValueError('Unknown registry backend "{}"'.format(name))
+
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def configure():
+    """
+    Create the configured backend. Should be called before forking, so the
+    backend's data is shared copy-on-write by the workers
+    """
+    global _backend
+
+    name = getattr(options, 'registry_backend', 'couch') or 'couch'
+    if name == 'couch':
+        _backend = None
+    else:
+        _backend = _backend_class(name).from_options()
+
+
+def get_backend():
+    """The registry backend, None if the registry is CouchDB"""
+    return _backend
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Circuit breaker
+
+After `threshold` consecutive failures the circuit opens and calls are not
+allowed until `reset_timeout` seconds have passed. The circuit is then
+"half open": one trial call is allowed, closing the circuit if it succeeds
+or opening it again if it fails. If the trial call's result is never
+recorded, e.g. the caller gave up waiting, another trial is allowed after
+`reset_timeout` seconds.
+"""
+import logging
+import time
+
+from . import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker(object):
+    """
+    :param name: the name used for logging & metrics
+    :param threshold: number of consecutive failures that open the circuit
+    :param reset_timeout: seconds until a trial call is allowed
+    """
+
+    def __init__(self, name, threshold=5, reset_timeout=30):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+        elif time.time() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        else:
+            return OPEN
+
+    def allow(self):
+        """Is a call allowed"""
+        state = self.state
+        if state == CLOSED:
+            return True
+
+        now = time.time()
+        if state == HALF_OPEN and (self._trial is None or
+                                   now - self._trial >= self.reset_timeout):
+            self._trial = now
+            return True
+
+        metrics.increment('{}.breaker_rejected'.format(self.name))
+        return False
+
+    def success(self):
+        """Record a successful call"""
+        if self.opened_at is not None:
+            logging.info('%s circuit closed', self.name)
+            metrics.increment('{}.breaker_closed'.format(self.name))
+
+        self.failures = 0
+        self.opened_at = None
+        self._trial = None
+
+    def failure(self):
+        """Record a failed call"""
+        self.failures += 1
+        self._trial = None
+
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.state != OPEN:
+                logging.warning('%s circuit opened after %s failures',
+                                self.name, self.failures)
+                metrics.increment('{}.breaker_opened'.format(self.name))
+            self.opened_at = time.time()
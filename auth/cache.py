@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Caches
+------
+
+Small TTL caches used on the request path:
+
+    - tokens: decoded JSON Web Token payloads, keyed by the token
+    - credentials: client IDs & secrets that have been authenticated
+    - decisions: the result of authorizing a client's access to a resource
+
+When the service forks a worker per core the caches are created in shared
+memory before forking, so that all workers share one copy. The shared cache
+is a fixed size hash table in an anonymous mmap. Each key hashes to a slot
+within a stripe of slots; writers take the stripe's lock, readers do not take
+any locks and instead use a per-slot sequence number (a "seqlock") to detect
+and retry torn reads.
+
+A pure Python cache is used when running a single process.
+
+Values must be JSON serialisable, a copy of the value is returned by `get`.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import multiprocessing
+import struct
+import time
+from collections import OrderedDict
+
+from tornado.options import options
+
+from . import request_context
+
+CACHES = ('tokens', 'credentials', 'decisions')
+
+# slot header: sequence number, expiry time, key digest & value length
+_SEQUENCE = struct.Struct('<I')
+_HEADER = struct.Struct('<Id16sH')
+_READ_RETRIES = 8
+
+_caches = {}
+
+
+def _digest(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return hashlib.md5(key).digest()
+
+
+class NullCache(object):
+    """Used when caching is disabled"""
+    enabled = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        return False
+
+    def delete(self, key):
+        pass
+
+
+class BaseCache(object):
+    """Counts the request's cache hits & misses"""
+    enabled = True
+
+    def get(self, key):
+        value = self._get(key)
+        request_context.increment(
+            'cache.misses' if value is None else 'cache.hits')
+
+        return value
+
+
+class LocalCache(BaseCache):
+    """
+    A pure Python cache for a single process
+
+    :param ttl: default time to live in seconds
+    :param max_size: maximum number of entries, the oldest entry is evicted
+        when full
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        try:
+            expires, data = self._entries[key]
+        except KeyError:
+            return None
+
+        if expires < time.time():
+            del self._entries[key]
+            return None
+
+        return json.loads(data)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return False
+
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+
+        self._entries[key] = (time.time() + ttl, json.dumps(value))
+        return True
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+
+class SharedCache(BaseCache):
+    """
+    A fixed size hash table in shared memory
+
+    Must be created before the worker processes are forked.
+
+    :param ttl: default time to live in seconds
+    :param slots: number of slots in the table
+    :param slot_size: size of each slot in bytes, including the header.
+        Values that do not fit are not cached
+    :param stripes: number of write locks
+    :param probes: number of slots checked for a key
+    """
+
+    def __init__(self, ttl, slots, slot_size=512, stripes=16, probes=4):
+        if slot_size <= _HEADER.size:
+            raise ValueError('slot_size must be greater than {}'
+                             .format(_HEADER.size))
+
+        self.ttl = ttl
+        self.slot_size = slot_size
+        self.stripe_size = max(slots // stripes, 1)
+        self.slots = self.stripe_size * stripes
+        self.probes = min(probes, self.stripe_size)
+        self._locks = [multiprocessing.Lock() for _ in range(stripes)]
+        # anonymous mmaps are MAP_SHARED, so are shared with forked children
+        self._mmap = mmap.mmap(-1, self.slots * slot_size)
+
+    @property
+    def max_value_size(self):
+        return self.slot_size - _HEADER.size
+
+    def _stripe(self, digest):
+        home = struct.unpack_from('<Q', digest)[0] % self.slots
+        return home // self.stripe_size, home % self.stripe_size
+
+    def _offsets(self, digest):
+        """The slot offsets that may contain the key"""
+        stripe, start = self._stripe(digest)
+        base = stripe * self.stripe_size
+        for i in range(self.probes):
+            slot = base + (start + i) % self.stripe_size
+            yield slot * self.slot_size
+
+    def _read(self, offset, digest):
+        """
+        Read a slot without locking
+
+        :returns: (found, expires, data). Found is None if the slot could
+            not be read consistently
+        """
+        for _ in range(_READ_RETRIES):
+            sequence, expires, slot_digest, length = _HEADER.unpack_from(
+                self._mmap, offset)
+            if sequence & 1:
+                # a write is in progress
+                continue
+
+            data = None
+            if slot_digest == digest:
+                start = offset + _HEADER.size
+                data = self._mmap[start:start + length]
+
+            if _SEQUENCE.unpack_from(self._mmap, offset)[0] == sequence:
+                return slot_digest == digest, expires, data
+
+        return None, 0, None
+
+    def _get(self, key):
+        digest = _digest(key)
+        for offset in self._offsets(digest):
+            found, expires, data = self._read(offset, digest)
+            if found is None:
+                # contended, treat as a miss rather than wait
+                return None
+            if found:
+                if expires < time.time():
+                    return None
+                return json.loads(data)
+
+        return None
+
+    def _write(self, offset, expires, digest, data):
+        """Write a slot. The caller must hold the stripe's lock"""
+        sequence = _SEQUENCE.unpack_from(self._mmap, offset)[0]
+        _SEQUENCE.pack_into(self._mmap, offset, (sequence + 1) & 0xffffffff)
+        _HEADER.pack_into(self._mmap, offset, (sequence + 1) & 0xffffffff,
+                          expires, digest, len(data))
+        start = offset + _HEADER.size
+        self._mmap[start:start + len(data)] = data
+        _SEQUENCE.pack_into(self._mmap, offset, (sequence + 2) & 0xffffffff)
+
+    def _choose_slot(self, digest):
+        """
+        Choose the slot for a key: the slot already containing the key,
+        otherwise the slot expiring soonest (empty slots have expired)
+        """
+        candidate = None
+        candidate_expires = None
+        for offset in self._offsets(digest):
+            _, expires, slot_digest, _ = _HEADER.unpack_from(self._mmap, offset)
+            if slot_digest == digest:
+                return offset
+            if candidate is None or expires < candidate_expires:
+                candidate = offset
+                candidate_expires = expires
+
+        return candidate
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        data = json.dumps(value)
+        if ttl <= 0 or len(data) > self.max_value_size:
+            return False
+
+        digest = _digest(key)
+        stripe, _ = self._stripe(digest)
+        now = time.time()
+        with self._locks[stripe]:
+            offset = self._choose_slot(digest)
+            self._write(offset, now + ttl, digest, data)
+
+        return True
+
+    def delete(self, key):
+        digest = _digest(key)
+        stripe, _ = self._stripe(digest)
+        with self._locks[stripe]:
+            for offset in self._offsets(digest):
+                _, _, slot_digest, _ = _HEADER.unpack_from(self._mmap, offset)
+                if slot_digest == digest:
+                    self._write(offset, 0, '\0' * 16, '')
+
+
+def configure(processes=None):
+    """
+    Create the caches from the service's options
+
+    Must be called before forking for the caches to be shared by the workers.
+    Caching is disabled if the `cache_ttl` option is not set.
+
+    :param processes: the number of processes that will be started
+    """
+    ttl = getattr(options, 'cache_ttl', 0)
+    slots = getattr(options, 'cache_slots', 16384)
+    shared = getattr(options, 'cache_shared', True) and processes != 1
+
+    _caches.clear()
+    if not ttl:
+        return
+
+    for name in CACHES:
+        if shared:
+            _caches[name] = SharedCache(
+                ttl, slots,
+                slot_size=getattr(options, 'cache_slot_size', 512))
+        else:
+            _caches[name] = LocalCache(ttl, slots)
+
+    logging.info('Configured %s %s caches with a %ss TTL',
+                 'shared' if shared else 'local', ', '.join(CACHES), ttl)
+
+
+def get_cache(name):
+    """
+    Get a cache
+
+    :param name: one of CACHES
+    :returns: a cache, or a NullCache if caching is disabled
+    """
+    return _caches.get(name, _null_cache)
+
+
+_null_cache = NullCache()
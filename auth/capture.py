@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Traffic capture
+---------------
+
+Records the shape & timing of /token & /verify requests, so real traffic can
+be replayed against another build (see commands/replay.py).
+
+Capturing is enabled by setting the `capture_file` option. A share of the
+authenticated requests (`capture_sample`) is appended to the file, one JSON
+object per line, e.g.
+
+    {"client": "5c0e1a9b3f2d4e61", "endpoint": "token",
+     "grant_type": "client_credentials", "ms": 4.2,
+     "scope": "read[9a1f0c2b7d3e4f58]", "status": 200, "t": 1476873600.25}
+
+Client secrets, tokens & assertions are not recorded. IDs (the client,
+delegates, resources & the IDs in scopes) are replaced by a keyed hash, so
+an ID has the same pseudonym throughout a capture but can't be recovered
+without the key. Tokens & assertions are recorded as their grant type,
+client, subject & scope.
+
+Each worker buffers its records & appends them to the file every
+FLUSH_INTERVAL seconds, using a single write so lines from different workers
+aren't interleaved. Supervised workers write their remaining records when
+they stop, otherwise up to FLUSH_INTERVAL seconds of records may be lost
+when the service is stopped.
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import time
+
+import jwt
+from tornado.ioloop import PeriodicCallback
+from tornado.options import options
+
+from . import secrets
+
+# seconds between writing the buffered records
+FLUSH_INTERVAL = 1
+# maximum records buffered before writing
+FLUSH_SIZE = 1000
+# the IDs in a scope, e.g. "delegate[id1]:write[id2]"
+SCOPE_ID = re.compile(r'\[([^\]]*)\]')
+# request arguments recorded as they are
+ARGUMENTS = ('grant_type', 'requested_access')
+
+_capture = None
+
+
+class Capture(object):
+    """
+    Records requests to a file
+
+    :param path: the capture file
+    :param key: the key used to create pseudonyms
+    :param sample: (optional) the share of requests recorded
+    """
+
+    def __init__(self, path, key, sample=1.0, rand=random):
+        self.path = path
+        self.key = key
+        self.sample = sample
+        self.rand = rand
+        self.records = []
+
+    def pseudonym(self, value):
+        """A pseudonym for an ID"""
+        if value is None:
+            return None
+
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+
+        return hmac.new(self.key, value, hashlib.sha256).hexdigest()[:16]
+
+    def scope(self, scope):
+        """A scope with its IDs replaced by pseudonyms"""
+        return SCOPE_ID.sub(
+            lambda match: '[{}]'.format(self.pseudonym(match.group(1))),
+            scope)
+
+    def token(self, token):
+        """
+        The shape of a token or assertion
+
+        :returns: dict, or None if the token can't be decoded
+        """
+        try:
+            # the handler has already verified the token
+            decoded = jwt.decode(token, verify=False)
+            return {'grant_type': decoded['grant_type'],
+                    'client': self.pseudonym(decoded['client']['id']),
+                    'sub': self.pseudonym(decoded['sub']),
+                    'scope': self.scope(decoded['scope'])}
+        except (jwt.InvalidTokenError, KeyError, TypeError):
+            return None
+
+    def record(self, endpoint, request, status, seconds):
+        """
+        Record a request, if it's sampled
+
+        :param endpoint: "token" or "verify"
+        :param request: the authenticated HTTP request
+        :param status: the response's status code
+        :param seconds: time taken to handle the request
+        """
+        if self.sample < 1 and self.rand.random() >= self.sample:
+            return
+
+        arguments = {k: v[0] for k, v in request.body_arguments.items() if v}
+        record = {
+            't': round(time.time() - seconds, 3),
+            'endpoint': endpoint,
+            'client': self.pseudonym(request.client_id),
+            'status': status,
+            'ms': round(seconds * 1000, 3),
+        }
+        for name in ARGUMENTS:
+            if name in arguments:
+                record[name] = arguments[name]
+        if 'scope' in arguments:
+            record['scope'] = self.scope(arguments['scope'])
+        if 'resource_id' in arguments:
+            record['resource_id'] = self.pseudonym(arguments['resource_id'])
+        for name in ('assertion', 'token'):
+            if name in arguments:
+                record[name] = self.token(arguments[name])
+
+        self.records.append(record)
+        if len(self.records) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered records to the file"""
+        if not self.records:
+            return
+
+        data = ''.join(json.dumps(x, sort_keys=True) + '\n'
+                       for x in self.records)
+        self.records = []
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def configure():
+    """
+    Create the capture if `capture_file` is set. Should be called before
+    forking, so the workers use the same key for pseudonyms
+    """
+    global _capture
+
+    path = getattr(options, 'capture_file', '')
+    if not path:
+        _capture = None
+        return
+
+    # without a key the pseudonyms differ between captures
+    key = secrets.read('capture_key') or os.urandom(32)
+    _capture = Capture(path, key, float(getattr(options, 'capture_sample', 1)))
+
+
+def get_capture():
+    """The capture, None if requests are not captured"""
+    return _capture
+
+
+def flush():
+    """Write the worker's buffered records, e.g. before exiting"""
+    if _capture is not None:
+        _capture.flush()
+
+
+def start():
+    """Write the worker's records periodically"""
+    if _capture is not None:
+        PeriodicCallback(_capture.flush, FLUSH_INTERVAL * 1000).start()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Benchmark authorizing a client to access a resource with a cold cache,
+comparing fetching the resource & its parent with a single query of the
+auth_resource_access view
+"""
+import time
+from functools import partial
+
+import click
+from perch import Service
+from tornado.gen import coroutine, Return
+from tornado.ioloop import IOLoop
+
+from auth import registry
+
+
+@coroutine
+def multi_fetch(client, resource_id, access):
+    """Authorize the client using the resource & parent documents"""
+    resource = yield registry.get_resource(resource_id)
+    yield resource.get_parent()
+    raise Return(client.authorized(access, resource))
+
+
+@coroutine
+def single_query(client, resource_id, access):
+    """Authorize the client using the auth_resource_access view"""
+    resource = yield registry.get_with_view(client, resource_id)
+    raise Return(client.authorized(access, resource))
+
+
+@coroutine
+def measure(func, iterations):
+    """
+    Call func repeatedly
+
+    :returns: (list of durations in ms, set of results)
+    """
+    durations = []
+    results = set()
+    for _ in range(iterations):
+        start = time.time()
+        result = yield func()
+        durations.append((time.time() - start) * 1000)
+        results.add(result)
+
+    raise Return((durations, results))
+
+
+def summary(durations):
+    durations = sorted(durations)
+    n = len(durations)
+    return ('mean {:.2f}ms  p50 {:.2f}ms  p95 {:.2f}ms  max {:.2f}ms'
+            .format(sum(durations) / n,
+                    durations[n // 2],
+                    durations[min(int(n * 0.95), n - 1)],
+                    durations[-1]))
+
+
+@coroutine
+def benchmark(client_id, resource_id, access, iterations):
+    client = yield Service.get(client_id)
+    paths = [('multi-fetch', multi_fetch), ('single query', single_query)]
+    decisions = set()
+
+    for name, func in paths:
+        func = partial(func, client, resource_id, access)
+        # warm up the view index & connections
+        yield func()
+        durations, results = yield measure(func, iterations)
+        decisions.update(results)
+        click.echo('{:<14}{}'.format(name, summary(durations)))
+
+    if len(decisions) > 1:
+        raise click.ClickException('The lookups returned different decisions')
+
+
+@click.command(help='Compare authorization lookups with a cold cache')
+@click.argument('client_id')
+@click.argument('resource_id')
+@click.option('--access', default='r', help='The requested access')
+@click.option('--iterations', default=100, help='Number of lookups')
+def cli(client_id, resource_id, access, iterations):
+    IOLoop.current().run_sync(
+        partial(benchmark, client_id, resource_id, access, iterations))
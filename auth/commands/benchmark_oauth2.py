@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Micro-benchmarks for the oauth2 hot paths, compared with a baseline
+
+Each benchmark is timed in-process without CouchDB, taking the fastest of
+several repeats. The results are written as JSON (microseconds per call) &
+compared with the committed baseline, failing if a benchmark is slower than
+the baseline by more than the tolerance:
+
+    python auth benchmark_oauth2 --output results.json
+
+The times depend on the machine, so the baseline records the machine & the
+Python version it was saved with, and the results are only compared if they
+match. Otherwise the results are written without failing. The baseline
+should be saved with --save-baseline on the machine running the comparison,
+e.g. the CI runner, & again after an intentional change in performance.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import timeit
+from functools import partial
+
+import click
+import perch
+
+import auth
+from auth import cache
+from auth.oauth2 import grants, token
+from auth.oauth2.scope import Scope
+
+# commands are run by koi without __file__
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(auth.__file__)),
+                        '..', 'benchmarks', 'oauth2_baseline.json')
+# number of resources in the scopes used by the scope benchmarks
+SCOPE_SIZES = (1, 10, 100)
+
+CLIENT = perch.Service(id='client1', service_type='external',
+                       organisation_id='org1', location='https://client1')
+
+
+def scope_string(size):
+    return ' '.join('write[resource{}]'.format(i) for i in range(size))
+
+
+class Request(object):
+    """The parts of a request from CLIENT used by the grants"""
+    client = CLIENT
+    client_id = CLIENT.id
+    grant_type = 'client_credentials'
+
+    def __init__(self, **arguments):
+        self.body_arguments = {k: [v] for k, v in arguments.items()}
+
+
+def benchmarks():
+    """
+    The benchmarks
+
+    :returns: list of (name, function to time)
+    """
+    cases = []
+    for size in SCOPE_SIZES:
+        cases.append(('scope_parse[{}]'.format(size),
+                      partial(Scope, scope_string(size))))
+
+    for size in SCOPE_SIZES:
+        scope = Scope(scope_string(size))
+        resource_id = 'resource{}'.format(size - 1)
+        cases.append(('within_scope[{}]'.format(size),
+                      partial(scope.within_scope, 'w', resource_id)))
+
+    encoded, _ = token.generate_token(CLIENT, 'read', 'client_credentials')
+    verify_request = Request(requested_access='r')
+    grant = grants.get_grant(verify_request, token=encoded)
+    read_scope = Scope('read')
+
+    cases.extend([
+        ('generate_token', partial(token.generate_token, CLIENT, 'read',
+                                   'client_credentials')),
+        ('decode_token', partial(token.decode_token, encoded)),
+        ('get_grant', partial(grants.get_grant, Request())),
+        ('get_grant[token]', partial(grants.get_grant, verify_request,
+                                     token=encoded)),
+        ('verify_scope', partial(grant.verify_scope, read_scope)),
+    ])
+
+    return cases
+
+
+def time_call(func, repeat=5, min_time=0.2):
+    """
+    Time a function
+
+    :returns: the fastest time per call in microseconds
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time / repeat:
+        number *= 10
+
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def run(names=None, repeat=5, min_time=0.2):
+    """
+    Run the benchmarks
+
+    :param names: (optional) names of the benchmarks to run, default all
+    :returns: dict of name -> microseconds per call
+    """
+    # measure the uncached paths
+    cache._caches.clear()
+
+    return {name: round(time_call(func, repeat, min_time), 3)
+            for name, func in benchmarks()
+            if names is None or name in names}
+
+
+def cpu_model():
+    """The CPU's model name, or the processor reported by platform"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+
+    return platform.processor()
+
+
+def environment():
+    """The machine & Python version the benchmarks are run on"""
+    return {'python': '{} {}'.format(platform.python_implementation(),
+                                     platform.python_version()),
+            'machine': platform.machine(),
+            'cpu': cpu_model(),
+            'cpus': multiprocessing.cpu_count()}
+
+
+def write_json(results, f):
+    json.dump(results, f, indent=2, separators=(',', ': '), sort_keys=True)
+    f.write('\n')
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with the baseline
+
+    :param tolerance: allowed slow down, e.g. 0.25 for 25%
+    :returns: list of (name, result, baseline, ratio, regressed) for the
+        benchmarks in the baseline
+    """
+    rows = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        ratio = results[name] / baseline[name]
+        rows.append((name, results[name], baseline[name], ratio,
+                     ratio > 1 + tolerance))
+
+    return rows
+
+
+@click.command(help='Benchmark the oauth2 hot paths')
+@click.option('--output', type=click.File('w'),
+              help='Write the results as JSON to a file')
+@click.option('--baseline', default=BASELINE, type=click.Path(),
+              help='The baseline results')
+@click.option('--tolerance', default=0.5,
+              help='Allowed slow down compared with the baseline')
+@click.option('--save-baseline', is_flag=True,
+              help='Save the results as the baseline')
+@click.option('--benchmark', 'names', multiple=True,
+              help='Run a benchmark, default all')
+def cli(output, baseline, tolerance, save_baseline, names):
+    results = run(names or None)
+    if output:
+        write_json(results, output)
+
+    if save_baseline:
+        with open(baseline, 'w') as f:
+            write_json({'environment': environment(), 'results': results}, f)
+        click.echo('Saved baseline to {}'.format(baseline))
+        return
+
+    with open(baseline) as f:
+        saved = json.load(f)
+
+    current = environment()
+    if saved.get('environment') != current:
+        click.echo('Not comparing with the baseline, it was saved on another '
+                   'machine or Python version:\n  baseline: {}\n  current: '
+                   '{}\nSave a baseline here with --save-baseline'.format(
+                       json.dumps(saved.get('environment'), sort_keys=True),
+                       json.dumps(current, sort_keys=True)))
+        return
+
+    rows = compare(results, saved['results'], tolerance)
+
+    for name, result, expected, ratio, regressed in rows:
+        click.echo('{:<20}{:>12.2f}us{:>12.2f}us{:>8.2f}x{}'.format(
+            name, result, expected, ratio, '  REGRESSED' if regressed else ''))
+
+    regressions = [x[0] for x in rows if x[-1]]
+    if regressions:
+        raise click.ClickException('Slower than the baseline: {}'.format(
+            ', '.join(regressions)))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Generate a registry for benchmarks
+
+Writes a fixture file of registry documents, for the "local" registry
+backend or a FakeCouch (see load_test --fixture), e.g.
+
+    python auth generate_registry registry.json --services 10000 \\
+        --repositories 1000000
+
+Like the real registry, a few organisations own most of the services &
+repositories, most services are external clients, and resources grant
+access to their own organisation, some partner organisations & service
+types, with some readable by all or denying an organisation.
+
+The load test's organisation is included, so the registry can be used by
+load_test & scaling_report. Every organisation with repositories hosts them
+on its own repository services, unless there are fewer services than
+organisations with repositories, in which case the remaining organisations'
+repositories are hosted by the load test's repository service.
+"""
+import random
+from itertools import chain
+
+import click
+from perch.organisation import SERVICE_TYPES
+
+from auth.commands import load_test
+
+# the share of services of each type, the rest are external
+HOSTING_TYPES = {'repository': 0.1, 'index': 0.02, 'identity': 0.01,
+                 'onboarding': 0.01, 'query': 0.01, 'resolution': 0.01,
+                 'transformation': 0.01}
+GRANTED_TYPES = sorted(SERVICE_TYPES)
+# probability that a resource is readable by all
+READ_ALL = 0.2
+# probability that a resource denies an organisation
+DENY = 0.05
+
+
+def split(total, weights):
+    """
+    Split a total in proportion to weights
+
+    :returns: list of integers adding up to the total
+    """
+    weight_sum = float(sum(weights))
+    counts = [int(total * x / weight_sum) for x in weights]
+    for i in range(total - sum(counts)):
+        counts[i % len(counts)] += 1
+
+    return counts
+
+
+def give_hosts(service_counts, repository_counts):
+    """
+    Move services to the organisations with repositories but no services,
+    from the organisations with the most services, while there are services
+    to spare
+
+    :param service_counts: number of services of each organisation, updated
+    :param repository_counts: number of repositories of each organisation
+    """
+    for index, repositories in enumerate(repository_counts):
+        if not repositories or service_counts[index]:
+            continue
+
+        donor = max(range(len(service_counts)),
+                    key=lambda i: service_counts[i])
+        # an organisation with repositories keeps one service to host them
+        if service_counts[donor] <= (1 if repository_counts[donor] else 0):
+            return
+        service_counts[donor] -= 1
+        service_counts[index] += 1
+
+
+def service_type(rand):
+    point = rand.random()
+    for name, share in sorted(HOSTING_TYPES.items()):
+        point -= share
+        if point < 0:
+            return name
+
+    return 'external'
+
+
+def permissions(rand, organisation_id, organisations, partners):
+    """
+    Permissions for a resource owned by an organisation
+
+    :param organisations: number of organisations in the registry
+    :param partners: maximum number of partner organisations granted access
+    :returns: list of permissions
+    """
+    result = [{'type': 'organisation_id', 'value': organisation_id,
+               'permission': 'rw'}]
+    for _ in range(rand.randint(0, partners)):
+        result.append({'type': 'organisation_id',
+                       'value': 'org{}'.format(rand.randrange(organisations)),
+                       'permission': rand.choice(['r', 'w', 'rw'])})
+
+    if rand.random() < 0.5:
+        result.append({'type': 'service_type',
+                       'value': rand.choice(GRANTED_TYPES),
+                       'permission': rand.choice(['r', 'rw'])})
+    if rand.random() < READ_ALL:
+        result.append({'type': 'all', 'value': None, 'permission': 'r'})
+    if rand.random() < DENY:
+        result.append({'type': 'organisation_id',
+                       'value': 'org{}'.format(rand.randrange(organisations)),
+                       'permission': '-'})
+
+    return result
+
+
+def organisation(rand, index, service_ids, repository_ids, organisations,
+                 partners):
+    """
+    An organisation document & its services' secrets. Repositories are
+    hosted by the load test's repository service if the organisation has no
+    services
+
+    :returns: list of documents
+    """
+    organisation_id = 'org{}'.format(index)
+    services = {}
+    hosts = []
+    for i, service_id in enumerate(service_ids):
+        if i == 0 and repository_ids:
+            # organisations with repositories host at least one
+            kind = 'repository'
+        else:
+            kind = service_type(rand)
+        services[service_id] = {
+            'name': service_id,
+            'service_type': kind,
+            'state': 'approved',
+            'permissions': permissions(rand, organisation_id,
+                                       organisations, partners)}
+        if kind != 'external':
+            services[service_id]['location'] = 'https://{}.test'.format(
+                service_id)
+        if kind == 'repository':
+            hosts.append(service_id)
+
+    repositories = {}
+    for repository_id in repository_ids:
+        repositories[repository_id] = {
+            'name': repository_id,
+            'service_id': (rand.choice(hosts) if hosts else
+                           load_test.RESOURCE_ID),
+            'state': 'approved',
+            'permissions': permissions(rand, organisation_id,
+                                       organisations, partners)}
+
+    docs = [{'_id': organisation_id,
+             'type': 'organisation',
+             'name': organisation_id,
+             'state': 'approved',
+             'created_by': 'generate_registry',
+             'services': services,
+             'repositories': repositories}]
+    docs.extend({'_id': load_test.secret(x),
+                 'type': 'oauth_client_credentials',
+                 'client_id': x} for x in service_ids)
+
+    return docs
+
+
+def generate(organisations=100, services=1000, repositories=10000,
+             partners=3, seed=0, clients=10, scope_size=500):
+    """
+    Generate a registry, one organisation at a time, so large registries
+    are not held in memory
+
+    :param organisations: number of organisations
+    :param services: number of services
+    :param repositories: number of repositories
+    :param partners: maximum number of partner organisations granted access
+        to each resource
+    :param seed: seed for the random generator
+    :param clients: number of load test clients
+    :param scope_size: number of load test repositories, the largest scope
+        size the registry can be used for
+    :returns: generator of lists of documents
+    """
+    rand = random.Random(seed)
+    # a long tail of organisations
+    weights = [rand.paretovariate(1.2) for _ in range(organisations)]
+    service_counts = split(services, weights)
+    repository_counts = split(repositories, weights)
+    give_hosts(service_counts, repository_counts)
+
+    yield load_test.fixture(clients, scope_size)
+    first_service = first_repository = 0
+    for index in range(organisations):
+        service_ids = ['service{}'.format(x) for x in range(
+            first_service, first_service + service_counts[index])]
+        repository_ids = ['repo{}'.format(x) for x in range(
+            first_repository, first_repository + repository_counts[index])]
+        first_service += len(service_ids)
+        first_repository += len(repository_ids)
+
+        yield organisation(rand, index, service_ids, repository_ids,
+                           organisations, partners)
+
+
+def documents(**kwargs):
+    """The documents of a generated registry, see generate"""
+    return chain.from_iterable(generate(**kwargs))
+
+
+@click.command(help='Generate a registry for benchmarks')
+@click.argument('output', type=click.File('w'))
+@click.option('--organisations', default=100,
+              help='Number of organisations')
+@click.option('--services', default=1000, help='Number of services')
+@click.option('--repositories', default=10000,
+              help='Number of repositories')
+@click.option('--partners', default=3,
+              help='Maximum partner organisations granted access to each '
+                   'resource')
+@click.option('--clients', default=10, help='Number of load test clients')
+@click.option('--scope-size', default=500,
+              help='Number of load test repositories, the largest scope '
+                   'size the registry can be load tested with')
+@click.option('--seed', default=0, help='Seed for the random generator')
+def cli(output, organisations, services, repositories, partners, clients,
+        scope_size, seed):
+    if organisations < 1:
+        raise click.BadParameter('At least one organisation is required')
+
+    load_test.write_fixture(documents(
+        organisations=organisations, services=services,
+        repositories=repositories, partners=partners, seed=seed,
+        clients=clients, scope_size=scope_size), output)
@@ -9,15 +9,148 @@
 
 """
 design doc loader
+
+Only design docs that differ from the installed version are saved. The view
+indexes are then built before the command finishes, so the service is not
+queried against a cold index after a deploy.
 """
+import json
+import time
+from urllib import urlencode
+
 import click
-from perch.views import load_design_docs
+import couch
+from perch.views import _views
+from tornado.httpclient import HTTPClient
+from tornado.options import options
+
+# register the auth service's views
+import auth.views
+
+DESIGN_DOC_FIELDS = ('language', 'views')
+
+
+def db_url():
+    return ':'.join([options.url_registry_db, str(options.db_port)])
+
+
+def changed_design_docs(db, docs):
+    """
+    Get the design docs that are missing or differ from the installed docs
+
+    :param db: a couch.BlockingCouch instance
+    :param docs: the registered design docs
+    :returns: list of docs to save, including the installed _rev
+    """
+    changed = []
+    for doc in docs:
+        doc = dict(doc)
+        try:
+            current = db.get_doc(doc['_id'])
+        except couch.NotFound:
+            changed.append(doc)
+            continue
+
+        if any(doc.get(x) != current.get(x) for x in DESIGN_DOC_FIELDS):
+            doc['_rev'] = current['_rev']
+            changed.append(doc)
+
+    return changed
+
+
+def view_url(db_name, doc, **query):
+    """The URL for querying a design doc's first view"""
+    name = doc['_id'].split('/', 1)[1]
+    view_name = sorted(doc['views'])[0]
+    query['limit'] = 0
+
+    return '{}/{}/_design/{}/_view/{}?{}'.format(
+        db_url(), db_name, name, view_name, urlencode(query))
+
+
+def trigger_index(http_client, db_name, doc):
+    """Start building a design doc's index, without waiting for it"""
+    http_client.fetch(view_url(db_name, doc, stale='update_after'))
+
+
+def indexer_progress(http_client, db_name, doc_ids):
+    """
+    Get the progress of the active indexer tasks for the design docs
+
+    :returns: dict of design doc ID -> progress (percentage)
+    """
+    response = http_client.fetch('{}/_active_tasks'.format(db_url()))
+    progress = {}
+
+    for task in json.loads(response.body):
+        # CouchDB 2 reports a shard name for the database, e.g.
+        # "shards/00000000-1fffffff/registry.1458731946"
+        database = task.get('database', '').split('/')[-1].split('.')[0]
+        if (task.get('type') == 'indexer' and database == db_name and
+                task.get('design_document') in doc_ids):
+            doc_id = task['design_document']
+            progress[doc_id] = min(progress.get(doc_id, 100),
+                                   task.get('progress', 0))
+
+    return progress
+
+
+def wait_for_indexes(http_client, db_name, docs, timeout, interval):
+    """
+    Trigger building the design docs' indexes and wait until they are built
+
+    :raises: click.ClickException if the indexes are not built before the
+        timeout
+    """
+    deadline = time.time() + timeout
+    doc_ids = {doc['_id'] for doc in docs}
+
+    for doc in docs:
+        trigger_index(http_client, db_name, doc)
+
+    while True:
+        progress = indexer_progress(http_client, db_name, doc_ids)
+        if not progress:
+            break
+
+        for doc_id, percent in sorted(progress.items()):
+            print '  {} {}: {}%'.format(db_name, doc_id, percent)
+
+        if time.time() + interval > deadline:
+            raise click.ClickException('Timed out building view indexes')
+
+        time.sleep(interval)
+
+    # query the views without "stale", which returns once each index is
+    # up to date
+    for doc in docs:
+        remaining = max(deadline - time.time(), 1)
+        http_client.fetch(view_url(db_name, doc), request_timeout=remaining)
 
 
 @click.command(help='load design docs')
 @click.argument('files', nargs=-1, type=click.File('rb'))
-def cli(files):
+@click.option('--warm/--no-warm', default=True,
+              help='Build the view indexes before finishing')
+@click.option('--timeout', default=600,
+              help='Seconds to wait for the view indexes to build')
+@click.option('--interval', default=2.0,
+              help='Seconds between checking the indexing progress')
+def cli(files, warm, timeout, interval):
     print 'loading design docs'
-    load_design_docs()
-    print 'design docs successfully loaded'
+    http_client = HTTPClient()
 
+    for db_name, docs in _views.items():
+        db = couch.BlockingCouch(db_name=db_name, couch_url=db_url())
+        changed = changed_design_docs(db, docs)
+
+        if changed:
+            db.save_docs(changed)
+        print '{}: {} of {} design docs updated'.format(
+            db_name, len(changed), len(docs))
+
+        if warm:
+            print '{}: building view indexes'.format(db_name)
+            wait_for_indexes(http_client, db_name, docs, timeout, interval)
+
+    print 'design docs successfully loaded'
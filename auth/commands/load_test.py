@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Load test the /token & /verify endpoints without a CouchDB
+
+Starts a FakeCouch serving a generated registry in a child process, then
+starts the service with N workers using the fake as the registry database.
+With --backend local the service uses the "local" registry backend instead,
+loading the generated registry into memory, so only the service's CPU time
+is measured. A larger registry made by generate_registry can be used with
+--fixture.
+
+Requests are sent using a mix of traffic types, e.g.
+
+    python auth load_test --processes 4 --mix client_credentials=5,verify=5
+
+The traffic types are:
+
+    - client_credentials: a client requests a token for the default scope
+    - jwt_bearer: a delegate exchanges an assertion for a token to write to
+      a repository
+    - verify: a service verifies a token has read access to it
+
+Requests per second & latency percentiles are reported for each type.
+"""
+import base64
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+import click
+from tornado.gen import coroutine, Return, sleep
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+
+import auth
+from auth import backends
+from auth.fakecouch import FakeCouch
+
+# commands are run by koi without __file__
+AUTH_DIR = os.path.dirname(os.path.abspath(auth.__file__))
+TRAFFIC_TYPES = ('client_credentials', 'jwt_bearer', 'verify')
+DEFAULT_MIX = 'client_credentials=5,jwt_bearer=1,verify=4'
+JWT_BEARER = 'urn:ietf:params:oauth:grant-type:jwt-bearer'
+
+ORGANISATION_ID = 'loadtest'
+DELEGATE_ID = 'loadtest-delegate'
+RESOURCE_ID = 'loadtest-resource'
+ALL_ACCESS = [{'type': 'all', 'permission': 'rw', 'value': None}]
+
+
+def secret(client_id):
+    return 'secret-' + client_id
+
+
+def client_ids(clients):
+    return ['loadtest-client{}'.format(i) for i in range(clients)]
+
+
+def repository_ids(repositories):
+    return ['loadtest-repository{}'.format(i) for i in range(repositories)]
+
+
+REPOSITORY_ID = repository_ids(1)[0]
+
+
+def scope(size):
+    """A scope reading `size` of the load test's repositories"""
+    return ' '.join('read[{}]'.format(x) for x in repository_ids(size))
+
+
+def fixture(clients=10, repositories=1):
+    """
+    A registry with an organisation owning the clients, a delegate, a
+    repository service & its repositories, all of which can access each
+    other
+
+    :param clients: number of clients requesting tokens
+    :param repositories: number of repositories, at least the largest scope
+        size used
+    :returns: list of registry documents
+    """
+    services = {}
+    for client_id in client_ids(clients) + [DELEGATE_ID]:
+        services[client_id] = {'service_type': 'external',
+                               'name': client_id,
+                               'state': 'approved',
+                               'permissions': ALL_ACCESS}
+
+    services[RESOURCE_ID] = {'service_type': 'repository',
+                             'name': RESOURCE_ID,
+                             'location': 'https://localhost:8004',
+                             'state': 'approved',
+                             'permissions': ALL_ACCESS}
+
+    docs = [{'_id': ORGANISATION_ID,
+             'type': 'organisation',
+             'name': 'Load Test',
+             'state': 'approved',
+             'created_by': 'loadtest',
+             'services': services,
+             'repositories': {x: {'service_id': RESOURCE_ID,
+                                  'name': x,
+                                  'state': 'approved',
+                                  'permissions': ALL_ACCESS}
+                              for x in repository_ids(max(repositories, 1))}}]
+    docs.extend({'_id': secret(x), 'type': 'oauth_client_credentials',
+                 'client_id': x} for x in services)
+
+    return docs
+
+
+def parse_mix(value):
+    """
+    Parse a traffic mix, e.g. "client_credentials=3,verify=1"
+
+    :returns: list of (traffic type, weight)
+    """
+    mix = []
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in TRAFFIC_TYPES:
+            raise click.BadParameter('Unknown traffic type "{}", expected one '
+                                     'of {}'.format(name,
+                                                    ', '.join(TRAFFIC_TYPES)))
+        try:
+            weight = float(weight or 1)
+        except ValueError:
+            raise click.BadParameter('Invalid weight for "{}"'.format(name))
+        if weight > 0:
+            mix.append((name, weight))
+
+    if not mix:
+        raise click.BadParameter('The mix has no traffic')
+
+    return mix
+
+
+def choose(mix, rand=random):
+    """Choose a traffic type from the weighted mix"""
+    point = rand.uniform(0, sum(weight for _, weight in mix))
+    for name, weight in mix:
+        point -= weight
+        if point <= 0:
+            return name
+
+    return mix[-1][0]
+
+
+def percentile(durations, p):
+    """The p-th percentile of a sorted list"""
+    return durations[min(int(len(durations) * p / 100.0),
+                         len(durations) - 1)]
+
+
+def summarise(results, elapsed):
+    """
+    Summarise the results for each traffic type
+
+    :param results: dict of traffic type -> list of (ms, status code)
+    :param elapsed: duration of the test in seconds
+    :returns: dict of traffic type -> summary
+    """
+    summaries = {}
+    for name, samples in sorted(results.items()):
+        durations = sorted(ms for ms, _ in samples)
+        statuses = defaultdict(int)
+        for _, code in samples:
+            statuses[str(code)] += 1
+
+        summaries[name] = {
+            'requests': len(samples),
+            'errors': sum(1 for _, code in samples if code != 200),
+            'statuses': dict(statuses),
+            'rps': round(len(samples) / elapsed, 1),
+            'p50_ms': round(percentile(durations, 50), 2),
+            'p95_ms': round(percentile(durations, 95), 2),
+            'p99_ms': round(percentile(durations, 99), 2),
+        }
+
+    return summaries
+
+
+def write_fixture(docs, f):
+    """
+    Write registry documents to a fixture file, one at a time so large
+    registries don't need to be held in memory
+
+    :param docs: iterable of documents
+    :param f: a file object
+    """
+    f.write('[')
+    for i, doc in enumerate(docs):
+        if i:
+            f.write(',\n')
+        # dumps uses the C encoder, dump doesn't
+        f.write(json.dumps(doc, separators=(',', ':')))
+    f.write(']\n')
+
+
+def post(url, client_id, **arguments):
+    """A form encoded POST authenticated as a client"""
+    credentials = base64.b64encode('{}:{}'.format(client_id,
+                                                  secret(client_id)))
+    return HTTPRequest(
+        url, method='POST', body=urllib.urlencode(arguments),
+        headers={'Authorization': 'Basic ' + credentials,
+                 'Content-Type': 'application/x-www-form-urlencoded'},
+        validate_cert=False)
+
+
+class Traffic(object):
+    """
+    Creates the requests for each traffic type
+
+    :param url: the service's URL
+    :param clients: the IDs of the clients requesting tokens
+    :param scope_size: (optional) number of repositories in the scope of
+        client_credentials requests & the verified token, the default scope
+        is used if 0
+    """
+
+    def __init__(self, url, clients, scope_size=0, rand=random):
+        self.url = url
+        self.clients = clients
+        self.scope = None
+        self.resource_id = None
+        if scope_size:
+            self.scope = scope(scope_size)
+            # verify access to the last repository in the scope
+            self.resource_id = repository_ids(scope_size)[-1]
+        self.rand = rand
+        self.token = None
+        self.assertion = None
+
+    def _scoped(self, **arguments):
+        if self.scope:
+            arguments['scope'] = self.scope
+        return arguments
+
+    @coroutine
+    def _token(self, http_client, **arguments):
+        response = yield http_client.fetch(
+            post(self.url + '/token', self.clients[0],
+                 grant_type='client_credentials', **arguments),
+            raise_error=False)
+        if response.code != 200:
+            raise click.ClickException('Unable to get a token, HTTP {}: {}'
+                                       .format(response.code, response.body))
+
+        raise Return(json.loads(response.body)['access_token'])
+
+    @coroutine
+    def setup(self, http_client):
+        """Get the token verified by verify & the jwt_bearer assertion"""
+        self.token = yield self._token(http_client, **self._scoped())
+        self.assertion = yield self._token(
+            http_client, scope='delegate[{}]:write[{}]'.format(
+                DELEGATE_ID, REPOSITORY_ID))
+
+    def request(self, name):
+        if name == 'client_credentials':
+            return post(self.url + '/token', self.rand.choice(self.clients),
+                        **self._scoped(grant_type='client_credentials'))
+        elif name == 'jwt_bearer':
+            return post(self.url + '/token', DELEGATE_ID,
+                        grant_type=JWT_BEARER, assertion=self.assertion,
+                        scope='write[{}]'.format(REPOSITORY_ID))
+        elif self.resource_id:
+            return post(self.url + '/verify', RESOURCE_ID, token=self.token,
+                        requested_access='r', resource_id=self.resource_id)
+        else:
+            return post(self.url + '/verify', RESOURCE_ID, token=self.token,
+                        requested_access='r')
+
+
+@coroutine
+def drive(http_client, traffic, mix, concurrency, duration):
+    """
+    Send requests from concurrent callers for a duration
+
+    :returns: (dict of traffic type -> list of (ms, status code), seconds)
+    """
+    results = defaultdict(list)
+    start = time.time()
+    stop_at = start + duration
+
+    @coroutine
+    def caller():
+        while time.time() < stop_at:
+            name = choose(mix, traffic.rand)
+            sent = time.time()
+            response = yield http_client.fetch(traffic.request(name),
+                                               raise_error=False)
+            results[name].append(((time.time() - sent) * 1000,
+                                  response.code))
+
+    yield [caller() for _ in range(concurrency)]
+
+    raise Return((dict(results), time.time() - start))
+
+
+def start_fake_couch(docs):
+    """
+    Serve the documents from a FakeCouch in a child process
+
+    :returns: (pid, port)
+    """
+    sock, port = bind_unused_port()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            io_loop = IOLoop()
+            io_loop.make_current()
+            fake = FakeCouch()
+            for doc in docs:
+                fake.add('registry', doc)
+            fake.start(sockets=[sock])
+            io_loop.start()
+        except Exception:
+            code = 1
+        finally:
+            os._exit(code)
+
+    sock.close()
+    return pid, port
+
+
+def service_url(port):
+    """The URL of the service's endpoints, which koi prefixes by version"""
+    return 'http://127.0.0.1:{}/v{}/auth'.format(
+        port, auth.__version__.split('.')[0])
+
+
+def start_service(port, processes, registry_args, log_file):
+    """
+    Start the service
+
+    :param registry_args: command line options configuring the registry
+    """
+    args = [sys.executable, AUTH_DIR,
+            '--port={}'.format(port),
+            '--processes={}'.format(processes),
+            '--use_ssl=false',
+            '--snapshot=false',
+            '--log_file_prefix=',
+            '--logging=warning'] + registry_args
+
+    # a new session, so the workers can be stopped with the service
+    return subprocess.Popen(args, stdout=log_file, stderr=log_file,
+                            preexec_fn=os.setsid)
+
+
+def _stop(pid, group=False):
+    try:
+        if group:
+            os.killpg(pid, signal.SIGTERM)
+        else:
+            os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except OSError:
+        pass
+
+
+@contextmanager
+def registry(backend, fixture_path):
+    """
+    Provide the registry in a fixture file to the service
+
+    :param backend: "local" to load the fixture into the service, or
+        "fakecouch" to serve it from a FakeCouch
+    :returns: the service's command line options configuring the registry
+    """
+    if backend == 'local':
+        yield ['--registry_backend=local',
+               '--registry_fixture={}'.format(os.path.abspath(fixture_path))]
+        return
+
+    pid, port = start_fake_couch(backends.read_fixture(fixture_path))
+    try:
+        yield ['--url_registry_db=http://127.0.0.1',
+               '--db_port={}'.format(port)]
+    finally:
+        _stop(pid)
+
+
+@contextmanager
+def running_service(processes, registry_args, log_path=os.devnull):
+    """
+    Run the service
+
+    :returns: the service's URL
+    """
+    sock, port = bind_unused_port()
+    sock.close()
+
+    with open(log_path, 'a') as log_file:
+        service = start_service(port, processes, registry_args, log_file)
+    try:
+        yield service_url(port)
+    finally:
+        _stop(service.pid, group=True)
+
+
+@coroutine
+def wait_ready(http_client, url, timeout):
+    """Wait for /ready to return 200"""
+    stop_at = time.time() + timeout
+    while time.time() < stop_at:
+        response = yield http_client.fetch(url + '/ready', raise_error=False)
+        if response.code == 200:
+            return
+        yield sleep(0.2)
+
+    raise click.ClickException('The service was not ready after {}s'
+                               .format(timeout))
+
+
+@coroutine
+def load_test(url, clients, mix, concurrency, duration, startup_timeout,
+              scope_size=0):
+    """
+    Wait for the service to be ready, then send requests
+
+    :returns: dict of traffic type -> summary
+    """
+    http_client = AsyncHTTPClient(force_instance=True,
+                                  max_clients=concurrency)
+    yield wait_ready(http_client, url, startup_timeout)
+
+    traffic = Traffic(url, clients, scope_size)
+    yield traffic.setup(http_client)
+    results, elapsed = yield drive(http_client, traffic, mix, concurrency,
+                                   duration)
+
+    raise Return(summarise(results, elapsed))
+
+
+@click.command(help='Load test /token & /verify against a fake registry')
+@click.option('--processes', default=1, help='Number of service workers')
+@click.option('--concurrency', default=20, help='Concurrent requests')
+@click.option('--duration', default=30.0, help='Seconds to send requests')
+@click.option('--mix', default=DEFAULT_MIX, help='Weighted traffic types')
+@click.option('--clients', default=10, help='Number of clients')
+@click.option('--scope-size', default=0,
+              help='Number of repositories in the requested scopes, 0 for '
+                   'the default scope')
+@click.option('--backend', type=click.Choice(['fakecouch', 'local']),
+              default='fakecouch', help='The registry used by the service')
+@click.option('--fixture', 'fixture_path', type=click.Path(exists=True),
+              help='A registry from generate_registry, instead of a minimal '
+                   'registry')
+@click.option('--startup-timeout', default=60.0,
+              help='Seconds to wait for the service to be ready')
+@click.option('--output', type=click.File('w'),
+              help='Write the results as JSON to a file')
+@click.option('--log', 'log_path', default=os.devnull,
+              help="File for the service's log")
+def cli(processes, concurrency, duration, mix, clients, scope_size, backend,
+        fixture_path, startup_timeout, output, log_path):
+    mix = parse_mix(mix)
+
+    temporary = fixture_path is None
+    if temporary:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            write_fixture(fixture(clients, scope_size), f)
+        fixture_path = f.name
+
+    try:
+        with registry(backend, fixture_path) as registry_args, \
+                running_service(processes, registry_args, log_path) as url:
+            summaries = IOLoop.current().run_sync(partial(
+                load_test, url, client_ids(clients), mix, concurrency,
+                duration, startup_timeout, scope_size))
+    finally:
+        if temporary:
+            os.remove(fixture_path)
+
+    click.echo('{:<20}{:>9}{:>8}{:>9}{:>10}{:>10}{:>10}'.format(
+        'traffic', 'requests', 'errors', 'rps', 'p50 ms', 'p95 ms',
+        'p99 ms'))
+    for name, summary in sorted(summaries.items()):
+        click.echo('{:<20}{requests:>9}{errors:>8}{rps:>9.1f}{p50_ms:>10.2f}'
+                   '{p95_ms:>10.2f}{p99_ms:>10.2f}'.format(name, **summary))
+
+    if output:
+        json.dump(summaries, output, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+        output.write('\n')
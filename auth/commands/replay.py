@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Replay captured traffic & compare the latencies of two builds
+
+A capture (see auth/capture.py) only contains pseudonyms, so it's replayed
+against a service using a registry made from the capture, containing every
+client & resource in the capture with access to each other:
+
+    python auth replay fixture capture.jsonl registry.json
+    python auth --registry_backend=local --registry_fixture=registry.json
+
+Then the capture is replayed against each build, keeping the requests'
+original spacing divided by --speed, and the latency distributions compared:
+
+    python auth replay run capture.jsonl https://localhost:8007/v1/auth \\
+        --speed 2 --output baseline.json
+    python auth replay run capture.jsonl https://localhost:8007/v1/auth \\
+        --speed 2 --output candidate.json
+    python auth replay compare baseline.json candidate.json
+
+As every client has access, requests that were refused when captured are
+granted when replayed. The tokens & assertions used by the captured requests
+are requested before replaying.
+"""
+import json
+import re
+import time
+from bisect import bisect_right
+from collections import defaultdict
+
+import click
+from tornado.gen import coroutine, Return, sleep
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+
+from auth import capture
+from auth.commands import load_test
+
+ORGANISATION_ID = 'replay'
+# hosts the repositories that aren't hosted by a captured service
+HOST_ID = 'replay-host'
+INVALID_TOKEN = 'invalid'
+DELEGATE = re.compile(r'delegate\[([^\]]*)\]')
+# request arguments replayed as they were captured
+ARGUMENTS = ('grant_type', 'scope', 'requested_access', 'resource_id')
+PERCENTILES = (50, 95, 99)
+
+
+def read_capture(f):
+    """
+    Read the records in a capture
+
+    :returns: list of records, in the order the requests were received
+    """
+    records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda x: x['t'])
+
+    return records
+
+
+def _shapes(record):
+    """The shapes of the tokens & assertions used by a request"""
+    return [record[x] for x in ('assertion', 'token') if record.get(x)]
+
+
+def registry_documents(records):
+    """
+    A registry containing the clients & resources in a capture
+
+    :returns: list of documents
+    """
+    services = set()
+    resources = set()
+    hosts = {}
+
+    def add_scope(scope):
+        if not scope:
+            return
+        delegates = DELEGATE.findall(scope)
+        services.update(delegates)
+        resources.update(x for x in capture.SCOPE_ID.findall(scope)
+                         if x not in delegates)
+
+    for record in records:
+        services.add(record['client'])
+        add_scope(record.get('scope'))
+        for shape in _shapes(record):
+            services.update([shape['client'], shape['sub']])
+            add_scope(shape['scope'])
+
+        resource_id = record.get('resource_id')
+        if resource_id and resource_id != record['client']:
+            hosts[resource_id] = record['client']
+
+    repositories = (resources | set(hosts)) - services
+    if any(x not in hosts for x in repositories):
+        services.add(HOST_ID)
+    hosting = set(hosts.values()) | {HOST_ID}
+
+    organisation = {
+        '_id': ORGANISATION_ID,
+        'type': 'organisation',
+        'name': ORGANISATION_ID,
+        'state': 'approved',
+        'created_by': 'replay',
+        'services': {},
+        'repositories': {},
+    }
+    for service_id in sorted(services):
+        service = {'name': service_id,
+                   'service_type': 'external',
+                   'state': 'approved',
+                   'permissions': load_test.ALL_ACCESS}
+        if service_id in hosting:
+            service['service_type'] = 'repository'
+            service['location'] = 'https://{}.replay'.format(service_id)
+        organisation['services'][service_id] = service
+
+    for repository_id in sorted(repositories):
+        organisation['repositories'][repository_id] = {
+            'name': repository_id,
+            'service_id': hosts.get(repository_id, HOST_ID),
+            'state': 'approved',
+            'permissions': load_test.ALL_ACCESS}
+
+    return [organisation] + [{'_id': load_test.secret(x),
+                              'type': 'oauth_client_credentials',
+                              'client_id': x} for x in sorted(services)]
+
+
+def _key(shape):
+    return (shape['grant_type'], shape['client'], shape['sub'],
+            shape['scope'])
+
+
+class Requests(object):
+    """
+    Creates the requests replaying a capture
+
+    :param url: the service's URL
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.tokens = {}
+        self.failures = 0
+
+    @coroutine
+    def _token(self, http_client, client_id, **arguments):
+        response = yield http_client.fetch(
+            load_test.post(self.url + '/token', client_id, **arguments),
+            raise_error=False)
+        if response.code != 200:
+            self.failures += 1
+            raise Return(None)
+
+        raise Return(json.loads(response.body)['access_token'])
+
+    @coroutine
+    def get_token(self, http_client, shape):
+        """Get a token with the shape of a captured token"""
+        key = _key(shape)
+        if key in self.tokens:
+            return
+
+        if shape['grant_type'] == load_test.JWT_BEARER:
+            # the client's assertion authorising the delegate
+            assertion_shape = {
+                'grant_type': 'client_credentials',
+                'client': shape['client'],
+                'sub': shape['client'],
+                'scope': 'delegate[{}]:{}'.format(shape['sub'],
+                                                  shape['scope'])}
+            yield self.get_token(http_client, assertion_shape)
+            assertion = self.tokens[_key(assertion_shape)]
+            token = None
+            if assertion:
+                token = yield self._token(
+                    http_client, shape['sub'], grant_type=shape['grant_type'],
+                    assertion=assertion, scope=shape['scope'])
+        else:
+            token = yield self._token(
+                http_client, shape['client'], grant_type='client_credentials',
+                scope=shape['scope'])
+
+        self.tokens[key] = token
+
+    @coroutine
+    def setup(self, http_client, records):
+        """Get the tokens & assertions used by the captured requests"""
+        for record in records:
+            for shape in _shapes(record):
+                yield self.get_token(http_client, shape)
+
+    def request(self, record):
+        """The request replaying a captured request"""
+        arguments = {x: record[x] for x in ARGUMENTS if record.get(x)}
+        for name in ('assertion', 'token'):
+            if name in record:
+                shape = record[name]
+                token = self.tokens.get(_key(shape)) if shape else None
+                arguments[name] = token or INVALID_TOKEN
+
+        return load_test.post('{}/{}'.format(self.url, record['endpoint']),
+                              record['client'], **arguments)
+
+
+@coroutine
+def replay(http_client, records, requests, speed=1.0, concurrency=100):
+    """
+    Send the requests, keeping their captured spacing divided by the speed
+
+    :param concurrency: maximum requests in flight, requests are sent late
+        if the service can't keep up
+    :returns: (dict of endpoint -> list of (ms, status code), seconds,
+        the most seconds a request was sent late)
+    """
+    semaphore = Semaphore(concurrency)
+    results = defaultdict(list)
+    first = records[0]['t'] if records else 0
+    start = time.time()
+    lag = 0
+
+    @coroutine
+    def send(endpoint, request):
+        sent = time.time()
+        try:
+            response = yield http_client.fetch(request, raise_error=False)
+            results[endpoint].append(((time.time() - sent) * 1000,
+                                      response.code))
+        finally:
+            semaphore.release()
+
+    for record in records:
+        due = start + (record['t'] - first) / speed
+        if due > time.time():
+            yield sleep(due - time.time())
+        yield semaphore.acquire()
+        lag = max(lag, time.time() - due)
+        send(record['endpoint'], requests.request(record))
+
+    # wait for the requests in flight
+    for _ in range(concurrency):
+        yield semaphore.acquire()
+
+    raise Return((dict(results), time.time() - start, lag))
+
+
+def captured(records):
+    """The captured latencies, summarised like the replayed latencies"""
+    results = defaultdict(list)
+    for record in records:
+        results[record['endpoint']].append((record['ms'], record['status']))
+    elapsed = records[-1]['t'] - records[0]['t'] if records else 0
+
+    return load_test.summarise(results, elapsed or 1)
+
+
+def ks_statistic(a, b):
+    """
+    The Kolmogorov-Smirnov statistic of two samples, the largest difference
+    between their cumulative distributions
+
+    :param a: sorted list
+    :param b: sorted list
+    """
+    if not a or not b:
+        return None
+
+    return max(abs(bisect_right(a, x) / float(len(a)) -
+                   bisect_right(b, x) / float(len(b)))
+               for x in a + b)
+
+
+def compare(baseline, candidate, tolerance):
+    """
+    Compare the latencies of two replays
+
+    :param tolerance: allowed slow down, e.g. 0.1 for 10%
+    :returns: list of (endpoint, statistic, baseline, candidate, ratio,
+        regressed), the statistics are the percentiles & the KS statistic
+    """
+    rows = []
+    for endpoint in sorted(set(baseline['latencies']) &
+                           set(candidate['latencies'])):
+        before = baseline['latencies'][endpoint]
+        after = candidate['latencies'][endpoint]
+        if not before or not after:
+            continue
+
+        for p in PERCENTILES:
+            old = load_test.percentile(before, p)
+            new = load_test.percentile(after, p)
+            ratio = new / old if old else None
+            rows.append((endpoint, 'p{}_ms'.format(p), old, new, ratio,
+                         ratio is not None and ratio > 1 + tolerance))
+
+        rows.append((endpoint, 'ks', None, ks_statistic(before, after), None,
+                     False))
+
+    return rows
+
+
+@click.group(help='Replay captured traffic & compare latencies')
+def cli():
+    pass
+
+
+@cli.command(help='Write a registry for replaying a capture')
+@click.argument('capture_file', type=click.File())
+@click.argument('output', type=click.File('w'))
+def fixture(capture_file, output):
+    load_test.write_fixture(
+        registry_documents(read_capture(capture_file)), output)
+
+
+@cli.command(help='Replay a capture against a running service')
+@click.argument('capture_file', type=click.File())
+@click.argument('url')
+@click.option('--speed', default=1.0,
+              help='Multiple of the captured request rate')
+@click.option('--concurrency', default=100,
+              help='Maximum requests in flight')
+@click.option('--output', type=click.File('w'),
+              help='Write the results as JSON to a file')
+def run(capture_file, url, speed, concurrency, output):
+    records = read_capture(capture_file)
+    if not records:
+        raise click.ClickException('The capture is empty')
+
+    url = url.rstrip('/')
+    requests = Requests(url)
+    http_client = AsyncHTTPClient(force_instance=True,
+                                  max_clients=concurrency)
+
+    @coroutine
+    def setup_and_replay():
+        yield requests.setup(http_client, records)
+        result = yield replay(http_client, records, requests, speed,
+                              concurrency)
+        raise Return(result)
+
+    results, elapsed, lag = IOLoop.current().run_sync(setup_and_replay)
+    if requests.failures:
+        click.echo('Unable to get {} tokens, their requests were replayed '
+                   'with an invalid token'.format(requests.failures))
+    if lag > 1:
+        click.echo('The replay fell {:.1f}s behind the capture, try a lower '
+                   '--speed or higher --concurrency'.format(lag))
+
+    summaries = load_test.summarise(results, elapsed)
+    for endpoint, summary in sorted(summaries.items()):
+        click.echo('/{:<8}{requests:>8} requests{errors:>6} errors{rps:>8} '
+                   'rps  p50 {p50_ms}ms  p95 {p95_ms}ms  p99 {p99_ms}ms'
+                   .format(endpoint, **summary))
+
+    if output:
+        json.dump({'url': url,
+                   'speed': speed,
+                   'elapsed_s': round(elapsed, 3),
+                   'max_lag_s': round(lag, 3),
+                   'token_failures': requests.failures,
+                   'summary': summaries,
+                   'captured': captured(records),
+                   'latencies': {k: sorted(round(ms, 3) for ms, _ in v)
+                                 for k, v in results.items()}},
+                  output, sort_keys=True)
+        output.write('\n')
+
+
+@cli.command('compare', help='Compare the latencies of two replays')
+@click.argument('baseline', type=click.File())
+@click.argument('candidate', type=click.File())
+@click.option('--tolerance', default=0.1,
+              help='Allowed slow down of each percentile')
+def compare_replays(baseline, candidate, tolerance):
+    rows = compare(json.load(baseline), json.load(candidate), tolerance)
+
+    for endpoint, statistic, old, new, ratio, regressed in rows:
+        if statistic == 'ks':
+            click.echo('/{:<8}{:<8}{:>26.3f}'.format(endpoint, statistic, new))
+        else:
+            click.echo('/{:<8}{:<8}{:>12.2f}{:>12.2f}ms{:>8.2f}x{}'.format(
+                endpoint, statistic, old, new, ratio or 0,
+                '  REGRESSED' if regressed else ''))
+
+    regressions = ['/{} {}'.format(x[0], x[1]) for x in rows if x[-1]]
+    if regressions:
+        raise click.ClickException('Slower than the baseline: {}'.format(
+            ', '.join(regressions)))
+
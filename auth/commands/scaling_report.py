@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Report how /token & /verify latency and memory scale with the registry
+
+Each dimension (organisations, services, repositories & scope size) is
+varied in turn, keeping the others at their base size. For each size a
+registry is generated (see generate_registry), the service is started with
+it & load tested (see load_test), then the latency percentiles & the largest
+worker RSS are recorded, e.g.
+
+    python auth scaling_report --sizes services=100,1000,10000 \\
+        --sizes repositories=1000,100000,1000000 --sizes scope_size=1,50,500 \\
+        --output scaling.json --plot scaling.png
+
+Plotting requires matplotlib. Worker RSS is read from /metrics, which the
+workers update every 10 seconds, so use a --duration of at least 10 seconds
+for the RSS to include the memory used while handling requests.
+"""
+import json
+import os
+import tempfile
+
+import click
+from tornado.gen import coroutine, Return
+from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+
+from auth import memory
+from auth.commands import generate_registry, load_test
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot
+except ImportError:
+    pyplot = None
+
+BASE = {'organisations': 100, 'services': 1000, 'repositories': 10000,
+        'scope_size': 1}
+DEFAULT_SIZES = {'organisations': [10, 100, 1000],
+                 'services': [100, 1000, 10000],
+                 'repositories': [1000, 10000, 100000],
+                 'scope_size': [1, 50, 500]}
+DEFAULT_MIX = 'client_credentials=1,verify=1'
+# the endpoint reported for each traffic type
+ENDPOINTS = {'client_credentials': '/token', 'verify': '/verify'}
+
+
+def parse_sizes(values):
+    """
+    Parse the sizes of each dimension, e.g. ["services=100,1000"]
+
+    :returns: dict of dimension -> list of sizes
+    """
+    sizes = {}
+    for value in values:
+        name, _, numbers = value.partition('=')
+        if name not in BASE:
+            raise click.BadParameter(
+                'Unknown dimension "{}", expected one of {}'.format(
+                    name, ', '.join(sorted(BASE))))
+        try:
+            sizes[name] = sorted(int(x) for x in numbers.split(','))
+        except ValueError:
+            raise click.BadParameter('Invalid sizes for "{}"'.format(name))
+
+    return sizes
+
+
+def points(sizes, base=BASE):
+    """
+    The registries to measure
+
+    :returns: list of (dimension, dict of dimension -> size)
+    """
+    result = []
+    for dimension in sorted(sizes):
+        for size in sizes[dimension]:
+            result.append((dimension, dict(base, **{dimension: size})))
+
+    return result
+
+
+def parse_rss(exposition):
+    """The largest worker RSS in a /metrics response, in bytes"""
+    values = [float(line.rsplit(' ', 1)[1])
+              for line in exposition.splitlines()
+              if line.startswith(memory.RSS_NAME + '{')]
+
+    return max(values) if values else None
+
+
+@coroutine
+def fetch_rss(url):
+    response = yield AsyncHTTPClient().fetch(url + '/metrics')
+    raise Return(parse_rss(response.body))
+
+
+def measure(point, backend, processes, concurrency, duration, mix,
+            startup_timeout, log_path):
+    """
+    Generate a registry & load test the service using it
+
+    :param point: dict of dimension -> size
+    :returns: (dict of traffic type -> summary, RSS in bytes)
+    """
+    clients = 10
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        load_test.write_fixture(generate_registry.documents(
+            organisations=point['organisations'],
+            services=point['services'],
+            repositories=point['repositories'],
+            clients=clients,
+            scope_size=point['scope_size']), f)
+
+    io_loop = IOLoop.current()
+    try:
+        with load_test.registry(backend, f.name) as registry_args, \
+                load_test.running_service(processes, registry_args,
+                                          log_path) as url:
+            summaries = io_loop.run_sync(lambda: load_test.load_test(
+                url, load_test.client_ids(clients), mix, concurrency,
+                duration, startup_timeout, point['scope_size']))
+            rss = io_loop.run_sync(lambda: fetch_rss(url))
+    finally:
+        os.remove(f.name)
+
+    return summaries, rss
+
+
+def plot(results, path):
+    """Plot latency & RSS against each dimension"""
+    dimensions = sorted(set(x['dimension'] for x in results))
+    figure, axes = pyplot.subplots(len(dimensions), 2, squeeze=False,
+                                   figsize=(12, 4 * len(dimensions)))
+
+    for row, dimension in zip(axes, dimensions):
+        measured = [x for x in results if x['dimension'] == dimension]
+        sizes = [x['size'] for x in measured]
+        latency, rss = row
+
+        for name, endpoint in sorted(ENDPOINTS.items()):
+            for percentile in ['p50_ms', 'p99_ms']:
+                values = [x['traffic'].get(name, {}).get(percentile)
+                          for x in measured]
+                latency.plot(sizes, values, marker='o', label='{} {}'.format(
+                    endpoint, percentile[:3]))
+        latency.set_xscale('log')
+        latency.set_xlabel(dimension)
+        latency.set_ylabel('latency (ms)')
+        latency.legend()
+
+        rss.plot(sizes, [(x['rss_bytes'] or 0) / 2.0 ** 20 for x in measured],
+                 marker='o')
+        rss.set_xscale('log')
+        rss.set_xlabel(dimension)
+        rss.set_ylabel('worker RSS (MiB)')
+
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def table(results):
+    """The results as text"""
+    lines = ['{:<14}{:>9}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+        'dimension', 'size', 'endpoint', 'rps', 'p50 ms', 'p99 ms',
+        'RSS MiB')]
+    for result in results:
+        for name, endpoint in sorted(ENDPOINTS.items()):
+            summary = result['traffic'].get(name)
+            if summary is None:
+                continue
+            lines.append(
+                '{:<14}{:>9}{:>10}{rps:>10.1f}{p50_ms:>10.2f}{p99_ms:>10.2f}'
+                '{:>10.1f}'.format(result['dimension'], result['size'],
+                                   endpoint,
+                                   (result['rss_bytes'] or 0) / 2.0 ** 20,
+                                   **summary))
+
+    return '\n'.join(lines)
+
+
+@click.command(help='Report how latency & memory scale with the registry')
+@click.option('--sizes', 'size_values', multiple=True,
+              help='Sizes of a dimension, e.g. services=100,1000,10000')
+@click.option('--backend', type=click.Choice(['local', 'fakecouch']),
+              default='local', help='The registry used by the service')
+@click.option('--processes', default=1, help='Number of service workers')
+@click.option('--concurrency', default=10, help='Concurrent requests')
+@click.option('--duration', default=10.0,
+              help='Seconds to send requests for each size')
+@click.option('--mix', default=DEFAULT_MIX, help='Weighted traffic types')
+@click.option('--startup-timeout', default=300.0,
+              help='Seconds to wait for the service to load the registry')
+@click.option('--output', type=click.File('w'),
+              help='Write the results as JSON to a file')
+@click.option('--plot', 'plot_path', help='Plot the results to an image')
+@click.option('--log', 'log_path', default=os.devnull,
+              help="File for the service's log")
+def cli(size_values, backend, processes, concurrency, duration, mix,
+        startup_timeout, output, plot_path, log_path):
+    if plot_path and pyplot is None:
+        raise click.ClickException('Plotting requires matplotlib')
+
+    mix = load_test.parse_mix(mix)
+    sizes = parse_sizes(size_values) if size_values else DEFAULT_SIZES
+
+    results = []
+    for dimension, point in points(sizes):
+        click.echo('Measuring {}={}'.format(dimension, point[dimension]))
+        summaries, rss = measure(point, backend, processes, concurrency,
+                                 duration, mix, startup_timeout, log_path)
+        results.append({'dimension': dimension,
+                        'size': point[dimension],
+                        'registry': point,
+                        'traffic': summaries,
+                        'rss_bytes': rss})
+
+    click.echo(table(results))
+
+    if output:
+        json.dump(results, output, indent=2, separators=(',', ': '),
+                  sort_keys=True)
+        output.write('\n')
+
+    if plot_path:
+        plot(results, plot_path)
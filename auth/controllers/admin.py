@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""Admin handlers for diagnosing the worker handling the request
+
+The handlers are disabled unless an admin token is set, read from the file
+named by the `admin_token_file` option, and the token must be sent in the
+X-Admin-Token header.
+"""
+import hmac
+import os
+
+from koi import exceptions
+from koi.base import JsonHandler
+
+from .. import memory, profiler, secrets
+
+HEADER = 'X-Admin-Token'
+# maximum seconds to profile for
+MAX_PROFILE_SECONDS = 300
+# default seconds between memory snapshots
+DEFAULT_MEMORY_INTERVAL = 60
+
+
+class AdminHandler(JsonHandler):
+    def number_argument(self, name, default):
+        try:
+            value = float(self.get_argument(name, default))
+        except ValueError:
+            raise exceptions.HTTPError(400, '{} must be a number'.format(name))
+        if value < 0:
+            raise exceptions.HTTPError(400, '{} must be positive'.format(name))
+
+        return value
+
+    def prepare(self):
+        admin_token = secrets.read('admin_token')
+        if not admin_token:
+            raise exceptions.HTTPError(404, 'Not found')
+
+        token = self.request.headers.get(HEADER, '')
+        if not hmac.compare_digest(str(token), str(admin_token)):
+            raise exceptions.HTTPError(403, 'Forbidden')
+
+
+class ProfileHandler(AdminHandler):
+    """Profiles the worker for a number of seconds"""
+
+    def post(self):
+        seconds = self.number_argument('seconds', 0)
+        if seconds > MAX_PROFILE_SECONDS:
+            raise exceptions.HTTPError(
+                400, 'seconds must be at most {}'.format(MAX_PROFILE_SECONDS))
+
+        path = profiler.start(seconds)
+        if path is None:
+            raise exceptions.HTTPError(409, 'Already profiling')
+
+        self.finish({
+            'status': 200,
+            'data': {'pid': os.getpid(), 'path': path}
+        })
+
+
+class MemoryHandler(AdminHandler):
+    """Reports the worker's memory growth"""
+
+    def get(self):
+        self.finish({'status': 200, 'data': memory.report()})
+
+    def post(self):
+        """Start taking snapshots every `interval` seconds"""
+        interval = self.number_argument('interval', DEFAULT_MEMORY_INTERVAL)
+        limit = int(self.number_argument('limit', 20))
+        if not interval:
+            raise exceptions.HTTPError(400, 'interval must be positive')
+        if not memory.start(interval, limit):
+            raise exceptions.HTTPError(409, 'Already tracking memory')
+
+        self.finish({'status': 200, 'data': memory.report()})
+
+    def delete(self):
+        """Stop taking snapshots"""
+        memory.stop()
+        self.finish({'status': 200, 'data': memory.report()})
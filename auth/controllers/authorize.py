@@ -15,11 +15,14 @@ from koi import exceptions
 from tornado.gen import coroutine
 
 from .base import AuthBaseHandler
-from .. import oauth2
+from .. import deadline, fairqueue, oauth2, tracing
 
 
 class VerifyHandler(AuthBaseHandler):
     """Responsible for verifying an OAuth token"""
+    deadline_option = 'verify_deadline'
+    admission_class = 'verify'
+    capture_endpoint = 'verify'
 
     @coroutine
     def post(self):
@@ -30,8 +33,11 @@ class VerifyHandler(AuthBaseHandler):
             raise exceptions.HTTPError(400, 'Token is required')
 
         try:
-            grant = oauth2.get_grant(self.request, token=token)
-            yield grant.verify_access(token)
+            with tracing.span('grant') as span:
+                grant = oauth2.get_grant(self.request, token=token,
+                                         deadline=self.deadline)
+                span.tag(grant_type=grant.grant_type)
+                yield grant.verify_access(token)
             self.finish({'status': 200, 'has_access': True})
         except oauth2.BadRequest as exc:
             raise exceptions.HTTPError(400, exc.args[0])
@@ -45,16 +51,44 @@ class VerifyHandler(AuthBaseHandler):
 
 class TokenHandler(AuthBaseHandler):
     """Responsible for generating JSON web tokens"""
+    deadline_option = 'token_deadline'
+    admission_class = 'token'
+    capture_endpoint = 'token'
+    _turn = None
+
+    @coroutine
+    def wait_turn(self):
+        """Wait for the client's organisation's turn to generate a token"""
+        scheduler = fairqueue.get_scheduler()
+        if scheduler is None:
+            return
+
+        self._turn = scheduler.acquire(self.request.client.organisation_id)
+        with tracing.span('fair_queue', leaf=True):
+            yield deadline.wait(self.deadline, 'fair_queue',
+                                self._turn.future)
+
+    def on_finish(self):
+        if self._turn is not None:
+            fairqueue.get_scheduler().release(self._turn)
+            self._turn = None
+
+        super(TokenHandler, self).on_finish()
+
     @coroutine
     def post(self):
         """Return a token"""
         try:
-            grant = oauth2.get_grant(self.request)
+            grant = oauth2.get_grant(self.request, deadline=self.deadline)
         except oauth2.InvalidGrantType:
             raise exceptions.HTTPError(400, 'invalid_grant')
 
+        yield self.wait_turn()
+
         try:
-            token, expiry = yield grant.generate_token()
+            with tracing.span('grant') as span:
+                span.tag(grant_type=grant.grant_type)
+                token, expiry = yield grant.generate_token()
         except (oauth2.InvalidScope, jwt.InvalidTokenError, ValueError) as exc:
             raise exceptions.HTTPError(400, exc.args[0])
         except oauth2.Unauthorized as exc:
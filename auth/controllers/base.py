@@ -8,35 +8,167 @@
 # See the License for the specific language governing permissions and limitations under the License.
 
 import base64
+import json
+import logging
 from urllib import unquote_plus
 
 from koi import exceptions
 from koi.base import JsonHandler, CorsHandler
-from perch import Service
 from tornado.gen import coroutine
+from tornado.options import options
+
+from .. import (admission, capture, deadline, histograms, metrics, registry,
+               request_context, tracing)
 
 
 class AuthBaseHandler(JsonHandler, CorsHandler):
     client_organisation = None
+    # the option with the endpoint's deadline in seconds
+    deadline_option = None
+    # the endpoint's admission control class, None if not limited
+    admission_class = None
+    # the endpoint's name in traffic captures, None if not captured
+    capture_endpoint = None
+    _admitted = False
+    context = None
+
+    def _execute(self, transforms, *args, **kwargs):
+        """Handle the request within a request context"""
+        self.context = request_context.RequestContext()
+        self.context.trace = tracing.start_trace(self.request)
+        with request_context.activate(self.context):
+            return super(AuthBaseHandler, self)._execute(
+                transforms, *args, **kwargs)
+
+    def finish(self, chunk=None):
+        """
+        Flag the response when the service is degraded, i.e. may have used
+        last-known-good registry data
+        """
+        if registry.degraded():
+            metrics.increment('responses.degraded')
+            self.set_header('X-Degraded', 'true')
+            if isinstance(chunk, dict):
+                chunk = dict(chunk, degraded=True)
+
+        if self.context is not None and self.context.trace is not None:
+            self.set_header(tracing.TRACE_HEADER, self.context.trace.trace_id)
+
+        return super(AuthBaseHandler, self).finish(chunk)
+
+    def write_error(self, status_code, **kwargs):
+        """
+        Add Retry-After when the worker is overloaded, and include the timing
+        breakdown when the deadline is exceeded
+        """
+        exc = kwargs.get('exc_info', (None, None, None))[1]
+        if isinstance(exc, admission.Overloaded):
+            self.set_header('Retry-After', exc.retry_after)
+
+        if isinstance(exc, deadline.DeadlineExceeded):
+            body = self._error_template(status_code, exc.errors, exc.source)
+            body['timings'] = exc.timings
+            self.finish(body)
+        else:
+            super(AuthBaseHandler, self).write_error(status_code, **kwargs)
+
+    def admit(self):
+        """
+        Admit the request if the worker has capacity
+
+        :raises: admission.Overloaded
+        """
+        if self.admission_class is None:
+            return
+
+        controller = admission.get_controller()
+        if not controller.admit(self.admission_class,
+                                self.request.request_time()):
+            raise admission.Overloaded(admission.retry_after())
+
+        self._admitted = True
+
+    def log_slow_request(self):
+        """
+        Log the request's counters if it took longer than
+        `slow_request_threshold` seconds
+        """
+        threshold = float(getattr(options, 'slow_request_threshold', 0))
+        elapsed = self.request.request_time()
+        if not threshold or elapsed < threshold or self.context is None:
+            return
+
+        request_deadline = getattr(self, 'deadline', None)
+        timings = request_deadline.timings if request_deadline else []
+        details = {
+            'method': self.request.method,
+            'path': self.request.path,
+            'status': self.get_status(),
+            'ms': round(elapsed * 1000, 1),
+            'client_id': getattr(self.request, 'client_id', None),
+            'grant_type': getattr(self.request, 'grant_type', None),
+            'arguments': request_context.redact(
+                {k: v[0] if len(v) == 1 else v
+                 for k, v in self.request.body_arguments.items()}),
+            'counters': dict(self.context.counters),
+            'timings': [{'lookup': name, 'ms': round(duration * 1000, 1)}
+                        for name, duration in timings],
+        }
+        metrics.increment('responses.slow')
+        logging.warning('Slow request: %s', json.dumps(details,
+                                                       sort_keys=True))
+
+    def capture_request(self):
+        """Record the request if traffic is being captured"""
+        recorder = capture.get_capture()
+        if (recorder is None or self.capture_endpoint is None or
+                getattr(self.request, 'client_id', None) is None):
+            return
+
+        recorder.record(self.capture_endpoint, self.request,
+                        self.get_status(), self.request.request_time())
+
+    def on_finish(self):
+        if self._admitted:
+            self._admitted = False
+            admission.get_controller().release(self.admission_class)
+
+        self.log_slow_request()
+        self.capture_request()
+        if self.context is not None:
+            tracing.finish_trace(self.context.trace, status=self.get_status())
+        super(AuthBaseHandler, self).on_finish()
 
     @coroutine
     def prepare(self):
         if self.request.method == 'OPTIONS':
             return
 
-        auth_header = self.request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Basic '):
-            raise exceptions.HTTPError(401, 'Unauthenticated')
+        with tracing.span('prepare'):
+            self.admit()
+
+            timeout = None
+            if self.deadline_option:
+                timeout = float(getattr(options, self.deadline_option, 0))
+            self.deadline = deadline.from_request(self.request, timeout)
+
+            auth_header = self.request.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith('Basic '):
+                raise exceptions.HTTPError(401, 'Unauthenticated')
 
-        decoded = unquote_plus(base64.decodestring(auth_header[6:]))
-        client_id, client_secret = decoded.split(':', 1)
+            with histograms.timed('basic_auth'):
+                decoded = unquote_plus(base64.decodestring(auth_header[6:]))
+                client_id, client_secret = decoded.split(':', 1)
 
-        service = yield Service.authenticate(client_id, client_secret)
-        if not service:
-            raise exceptions.HTTPError(401, 'Unauthenticated')
+            with histograms.timed('authenticate'):
+                service = yield registry.authenticate(
+                    client_id, client_secret, self.deadline)
+            if not service:
+                raise exceptions.HTTPError(401, 'Unauthenticated')
 
-        self.request.client_id = client_id
-        self.request.client = service
+            self.request.client_id = client_id
+            self.request.client = service
 
-        grant_type = self.request.body_arguments.get('grant_type', [None])[0]
-        self.request.grant_type = grant_type
+            grant_type = self.request.body_arguments.get('grant_type',
+                                                         [None])[0]
+            self.request.grant_type = grant_type
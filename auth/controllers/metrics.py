@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""Metrics handler, serving the stage latency histograms & counters for
+Prometheus
+"""
+from tornado.web import RequestHandler
+
+from .. import fairqueue, histograms, memory, metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsHandler(RequestHandler):
+    """
+    Responds with the histograms & counters added up across the workers, the
+    RSS of each worker, and the fair queue of each organisation
+    """
+
+    def get(self):
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.finish(histograms.exposition() + metrics.exposition() +
+                    memory.exposition() + fairqueue.exposition())
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""Readiness handler, used by load balancers to route only to warm workers
+"""
+from koi import exceptions
+from koi.base import CorsHandler, JsonHandler
+
+from .. import warmup
+
+
+class ReadyHandler(CorsHandler, JsonHandler):
+    """Responds with a 503 until the worker has warmed up"""
+
+    def get(self):
+        if not warmup.is_ready():
+            raise exceptions.HTTPError(503, 'Warming up')
+
+        self.finish({
+            'status': 200,
+            'data': {
+                'ready': True,
+                'warm_up_ms': round((warmup.duration() or 0) * 1000, 1)
+            }
+        })
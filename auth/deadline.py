@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Request deadlines
+
+Each request has a time budget, configured per endpoint & optionally
+shortened by the caller using the `X-Deadline` header (milliseconds). The
+deadline is passed to the grant, scope & registry lookups. Lookups are not
+started once the deadline has passed, and waiting lookups are abandoned,
+so the request fails with a 504 including how long each lookup took.
+
+Abandoning a lookup only stops the request waiting for it, the lookup isn't
+cancelled. It may be shared with other requests (see `auth.singleflight`),
+so it continues until it completes or its HTTP request times out, keeping
+its connection from the CouchDB pool until then.
+"""
+import time
+from datetime import timedelta
+
+from koi.exceptions import HTTPError
+from tornado.gen import coroutine, with_timeout, Return, TimeoutError
+
+from . import metrics
+
+HEADER = 'X-Deadline'
+
+
+class DeadlineExceeded(HTTPError):
+    """The request's deadline has passed"""
+
+    def __init__(self, deadline):
+        elapsed = deadline.elapsed()
+        super(DeadlineExceeded, self).__init__(
+            504, 'Deadline of {:.0f}ms exceeded after {:.0f}ms'.format(
+                deadline.timeout * 1000, elapsed * 1000))
+        self.timings = [{'lookup': name, 'ms': round(duration * 1000, 1)}
+                        for name, duration in deadline.timings]
+        self.elapsed = elapsed
+
+
+class Deadline(object):
+    """
+    :param timeout: seconds until the deadline, None for no deadline
+    """
+
+    def __init__(self, timeout=None):
+        self.start = time.time()
+        self.timeout = timeout
+        self.timings = []
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def remaining(self):
+        """Seconds until the deadline, None if there's no deadline"""
+        if self.timeout is None:
+            return None
+
+        return self.timeout - self.elapsed()
+
+    def check(self):
+        """
+        Check the deadline has not passed
+
+        :raises: DeadlineExceeded
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            metrics.increment('deadline.exceeded')
+            raise DeadlineExceeded(self)
+
+    @coroutine
+    def wait(self, name, future):
+        """
+        Wait for a future until the deadline, recording how long it took. The
+        future is abandoned, not cancelled, if the deadline passes
+
+        :param name: the name used in the timing breakdown
+        :param future: a Future
+        :raises: DeadlineExceeded
+        """
+        self.check()
+
+        start = time.time()
+        remaining = self.remaining()
+        try:
+            if remaining is None:
+                result = yield future
+            else:
+                result = yield with_timeout(timedelta(seconds=remaining),
+                                            future)
+        except TimeoutError:
+            self.timings.append((name, time.time() - start))
+            self.check()
+            raise
+
+        self.timings.append((name, time.time() - start))
+        raise Return(result)
+
+
+def wait(deadline, name, future):
+    """
+    Wait for a future until the deadline, if there is one
+
+    :param deadline: a Deadline or None
+    :returns: a Future
+    """
+    if deadline is None:
+        return future
+
+    return deadline.wait(name, future)
+
+
+def from_request(request, timeout=None):
+    """
+    Create a request's deadline
+
+    :param request: the HTTP request
+    :param timeout: (optional) the endpoint's timeout in seconds, 0 or None
+        for no timeout
+    :returns: a Deadline
+    """
+    timeouts = [timeout] if timeout else []
+    try:
+        requested = float(request.headers.get(HEADER, 0)) / 1000
+    except (TypeError, ValueError):
+        requested = 0
+    if requested > 0:
+        timeouts.append(requested)
+
+    return Deadline(min(timeouts) if timeouts else None)
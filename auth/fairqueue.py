@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Fair queuing
+------------
+
+Schedules work across organisations using weighted fair queuing, so one
+organisation sending many requests can't starve the others.
+
+Each queued request is tagged with a virtual finish time: the later of the
+current virtual time & the organisation's previous tag, plus 1 / the
+organisation's weight. Requests are started in tag order, so organisations
+share the available concurrency in proportion to their weights, regardless
+of how many requests each has queued. An organisation may also be capped to
+a maximum number of requests in progress.
+
+The number of queued & running requests are exposed as gauges on /metrics.
+Each worker also publishes the queued & running requests of its busiest
+organisations, and how long the oldest queued request has waited, to shared
+memory, so /metrics can report them for each organisation.
+"""
+import heapq
+import itertools
+import mmap
+import struct
+import time
+from collections import defaultdict
+
+from tornado.concurrent import Future
+from tornado.ioloop import PeriodicCallback
+from tornado.options import options
+
+from . import metrics, slots
+
+# seconds between publishing the organisation gauges
+PUBLISH_INTERVAL = 1
+
+ORGANISATION_NAME = 'auth_fair_queue_organisation'
+
+# organisation ID, queued, running & oldest wait in seconds
+_ENTRY = struct.Struct('<128sddd')
+
+_scheduler = None
+_gauges = None
+
+
+class Turn(object):
+    """A request's place in the queue"""
+    __slots__ = ('organisation_id', 'tag', 'sequence', 'future', 'queued_at',
+                 'abandoned')
+
+    def __init__(self, organisation_id, tag, sequence):
+        self.organisation_id = organisation_id
+        self.tag = tag
+        self.sequence = sequence
+        self.future = Future()
+        self.queued_at = time.time()
+        self.abandoned = False
+
+    def __lt__(self, other):
+        return (self.tag, self.sequence) < (other.tag, other.sequence)
+
+
+class FairScheduler(object):
+    """
+    :param concurrency: maximum requests in progress
+    :param weights: (optional) dict of organisation ID -> weight, defaults
+        to 1
+    :param limits: (optional) dict of organisation ID -> maximum requests in
+        progress
+    :param default_limit: (optional) maximum requests in progress for
+        organisations without a limit, 0 for no limit
+    """
+
+    def __init__(self, concurrency, weights=None, limits=None,
+                 default_limit=0):
+        self.concurrency = concurrency
+        self.weights = weights or {}
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.running = 0
+        self.depth = 0
+        self.in_progress = defaultdict(int)
+        self.queued = defaultdict(int)
+        self._queue = []
+        self._tags = {}
+        self._virtual_time = 0
+        self._sequence = itertools.count()
+
+    def _under_limit(self, organisation_id):
+        limit = self.limits.get(organisation_id, self.default_limit)
+        return not limit or self.in_progress[organisation_id] < limit
+
+    def acquire(self, organisation_id):
+        """
+        Queue a request
+
+        :param organisation_id: the client's organisation
+        :returns: a Turn, the Turn's future resolves when the request may
+            start
+        """
+        weight = float(self.weights.get(organisation_id, 1))
+        tag = (max(self._virtual_time, self._tags.get(organisation_id, 0)) +
+               1 / weight)
+        self._tags[organisation_id] = tag
+
+        turn = Turn(organisation_id, tag, next(self._sequence))
+        heapq.heappush(self._queue, turn)
+        self.queued[organisation_id] += 1
+        self.depth += 1
+        self._dispatch()
+
+        return turn
+
+    def release(self, turn):
+        """Release a turn when the request has finished or was abandoned"""
+        if turn.future.done():
+            self.running -= 1
+            self.in_progress[turn.organisation_id] -= 1
+        elif not turn.abandoned:
+            turn.abandoned = True
+            self.queued[turn.organisation_id] -= 1
+            self.depth -= 1
+
+        self._dispatch()
+        self._prune(turn.organisation_id)
+
+    def _prune(self, organisation_id):
+        """Forget an organisation without queued or running requests"""
+        if self.queued[organisation_id] or self.in_progress[organisation_id]:
+            return
+
+        del self.queued[organisation_id]
+        del self.in_progress[organisation_id]
+        self._tags.pop(organisation_id, None)
+
+    def organisations(self):
+        """
+        The organisations with queued or running requests
+
+        :returns: list of (organisation ID, queued, running, seconds the
+            oldest queued request has waited), busiest first
+        """
+        now = time.time()
+        oldest = {}
+        for turn in self._queue:
+            if turn.abandoned:
+                continue
+            oldest[turn.organisation_id] = min(
+                turn.queued_at,
+                oldest.get(turn.organisation_id, turn.queued_at))
+
+        busy = set(self.queued) | set(self.in_progress)
+        result = [(organisation_id,
+                   self.queued.get(organisation_id, 0),
+                   self.in_progress.get(organisation_id, 0),
+                   now - oldest.get(organisation_id, now))
+                  for organisation_id in busy]
+        return sorted(result, key=lambda x: (x[1], x[2]), reverse=True)
+
+    def _next(self):
+        """Remove the queued turn with the lowest tag that may start"""
+        skipped = []
+        turn = None
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            if candidate.abandoned:
+                continue
+            elif self._under_limit(candidate.organisation_id):
+                turn = candidate
+                break
+            else:
+                skipped.append(candidate)
+
+        for candidate in skipped:
+            heapq.heappush(self._queue, candidate)
+
+        return turn
+
+    def _dispatch(self):
+        while self.running < self.concurrency:
+            turn = self._next()
+            if turn is None:
+                break
+
+            organisation_id = turn.organisation_id
+            self._virtual_time = turn.tag
+            self.running += 1
+            self.queued[organisation_id] -= 1
+            self.depth -= 1
+            self.in_progress[organisation_id] += 1
+
+            waited = time.time() - turn.queued_at
+            metrics.increment('fair_queue.started')
+            metrics.increment('fair_queue.wait_ms', waited * 1000)
+            turn.future.set_result(None)
+
+        metrics.set_gauge('fair_queue.queued', self.depth)
+        metrics.set_gauge('fair_queue.running', self.running)
+
+
+def get_scheduler():
+    """The worker's /token scheduler, None if fair queuing is disabled"""
+    global _scheduler
+
+    concurrency = int(getattr(options, 'fair_queue_concurrency', 0))
+    if not concurrency:
+        return None
+
+    if _scheduler is None:
+        _scheduler = FairScheduler(
+            concurrency,
+            getattr(options, 'fair_queue_weights', None),
+            getattr(options, 'fair_queue_org_limits', None),
+            int(getattr(options, 'fair_queue_org_limit', 0)))
+
+    return _scheduler
+
+
+class OrganisationGauges(object):
+    """
+    The busiest organisations of each worker, kept in shared memory
+
+    :param workers: the number of rows, one for each worker process
+    :param size: the number of organisations in each row
+    """
+
+    def __init__(self, workers=1, size=50):
+        self.workers = workers
+        self.size = size
+        # anonymous mmaps are MAP_SHARED, so are shared with forked children
+        self._mmap = mmap.mmap(-1, workers * size * _ENTRY.size)
+
+    def _offset(self, row, index):
+        return (row * self.size + index) * _ENTRY.size
+
+    def update(self, organisations):
+        """
+        Replace the worker's organisations
+
+        :param organisations: list of (organisation ID, queued, running,
+            oldest wait), only the first `size` are kept
+        """
+        row = slots.row(self.workers)
+        organisations = list(organisations)[:self.size]
+        for index in range(self.size):
+            if index < len(organisations):
+                organisation_id, queued, running, wait = organisations[index]
+                entry = (organisation_id.encode('utf-8'), queued, running,
+                         wait)
+            else:
+                entry = ('', 0, 0, 0)
+            _ENTRY.pack_into(self._mmap, self._offset(row, index), *entry)
+
+    def clear(self, row):
+        """Clear an exited worker's row"""
+        row %= self.workers
+        for index in range(self.size):
+            _ENTRY.pack_into(self._mmap, self._offset(row, index), '', 0, 0,
+                             0)
+
+    def read(self):
+        """
+        The organisations across the workers
+
+        :returns: dict of organisation ID -> [queued, running, oldest wait],
+            queued & running are added up, the oldest wait is the longest
+        """
+        result = {}
+        for row in range(self.workers):
+            for index in range(self.size):
+                organisation_id, queued, running, wait = _ENTRY.unpack_from(
+                    self._mmap, self._offset(row, index))
+                organisation_id = organisation_id.rstrip('\0')
+                if not organisation_id:
+                    break
+
+                # IDs longer than an entry are truncated
+                organisation_id = organisation_id.decode('utf-8', 'ignore')
+                totals = result.setdefault(organisation_id, [0, 0, 0])
+                totals[0] += queued
+                totals[1] += running
+                totals[2] = max(totals[2], wait)
+
+        return result
+
+
+def configure(processes=None, supervised=False):
+    """
+    Create the organisation gauges, must be called before forking for the
+    gauges to be shared by the workers
+
+    :param processes: the number of processes that will be started, 0 or
+        None for one per CPU
+    :param supervised: (optional) whether the workers are supervised
+    """
+    global _gauges
+
+    _gauges = OrganisationGauges(
+        slots.rows(processes, supervised),
+        int(getattr(options, 'fair_queue_metrics_organisations', 50)))
+
+
+def get_gauges():
+    """The organisation gauges, created for a single process if not
+    configured"""
+    global _gauges
+
+    if _gauges is None:
+        _gauges = OrganisationGauges()
+
+    return _gauges
+
+
+def publish():
+    """Publish the worker's busiest organisations to the gauges"""
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        get_gauges().update(scheduler.organisations())
+
+
+def start():
+    """Publish the organisation gauges periodically, if fair queuing is
+    enabled"""
+    if get_scheduler() is not None:
+        PeriodicCallback(publish, PUBLISH_INTERVAL * 1000).start()
+
+
+def _label(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def exposition():
+    """The organisation gauges in the Prometheus text format"""
+    organisations = sorted(get_gauges().read().items())
+    lines = []
+    for suffix, index, description in (
+            ('queued', 0, 'Queued /token requests of each organisation'),
+            ('running', 1, 'Running /token requests of each organisation'),
+            ('wait_seconds', 2, 'Wait of the oldest queued /token request '
+                                'of each organisation')):
+        name = '{}_{}'.format(ORGANISATION_NAME, suffix)
+        lines.extend(['# HELP {} {}'.format(name, description),
+                      '# TYPE {} gauge'.format(name)])
+        for organisation_id, values in organisations:
+            lines.append(u'{}{{organisation_id="{}"}} {:g}'.format(
+                name, _label(organisation_id), values[index]))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+A stand-in CouchDB server for tests & benchmarks
+
+Serves the parts of the CouchDB API used by the auth service: documents, the
+registered perch views, the changes feed and active tasks. Views are
+evaluated on each request by running the views' map functions over the
+documents in memory.
+
+Delays & errors can be injected to simulate a slow or failing CouchDB:
+
+    fake = FakeCouch()
+    fake.add('registry', {'_id': 'org1', 'type': 'organisation'})
+    fake.delay = 0.1
+    url = fake.start()
+"""
+import copy
+import json
+from collections import defaultdict, OrderedDict
+
+from perch.views import _views
+from tornado.gen import coroutine, sleep
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application, RequestHandler
+
+# imported to register the auth service's views with perch
+from . import views  # noqa: F401
+
+
+def _compile_views():
+    """
+    Compile the registered views' map functions
+
+    :returns: dict of (db name, view name) -> map function
+    """
+    maps = {}
+    for db_name, docs in _views.items():
+        for doc in docs:
+            for name, view in doc['views'].items():
+                namespace = {}
+                exec view['map'] in namespace
+                maps[(db_name, name)] = namespace[name]
+
+    return maps
+
+
+def _normalise(key):
+    """Convert a key to its JSON equivalent, e.g. tuples to lists"""
+    return json.loads(json.dumps(key))
+
+
+class FakeCouch(object):
+    """
+    :param delay: (optional) seconds to delay each request, or a function
+        called with the request that returns the delay
+    """
+
+    def __init__(self, delay=0):
+        self.databases = defaultdict(OrderedDict)
+        self.delay = delay
+        self.status = None
+        self.requests = 0
+        self.url = None
+        self._maps = _compile_views()
+        self._server = None
+
+    def add(self, db_name, doc):
+        """Add or replace a document"""
+        self.databases[db_name][doc['_id']] = doc
+
+    def view(self, db_name, view_name, key=None, keys=None,
+             include_docs=False, limit=None):
+        """
+        Query a view
+
+        :returns: a CouchDB view response
+        """
+        func = self._maps[(db_name, view_name)]
+        rows = []
+        for doc_id, doc in self.databases[db_name].items():
+            for k, value in func(copy.deepcopy(doc)) or []:
+                row = {'id': doc_id, 'key': _normalise(k),
+                       'value': _normalise(value)}
+                if include_docs:
+                    row['doc'] = doc
+                rows.append(row)
+
+        rows.sort(key=lambda x: (json.dumps(x['key']), x['id']))
+        if keys is not None:
+            rows = [x for k in keys for x in rows if x['key'] == k]
+        elif key is not None:
+            rows = [x for x in rows if x['key'] == key]
+
+        if limit is not None:
+            rows = rows[:limit]
+
+        return {'total_rows': len(rows), 'offset': 0, 'rows': rows}
+
+    def changes(self, db_name):
+        """The changes feed, including the docs"""
+        results = [{'seq': i + 1, 'id': doc_id, 'doc': doc}
+                   for i, (doc_id, doc) in
+                   enumerate(self.databases[db_name].items())]
+
+        return {'results': results, 'last_seq': len(results)}
+
+    def application(self):
+        kwargs = {'fake': self}
+        return Application([
+            (r'/', WelcomeHandler, kwargs),
+            (r'/_active_tasks', ActiveTasksHandler, kwargs),
+            (r'/([^/_][^/]*)/_changes', ChangesHandler, kwargs),
+            (r'/([^/_][^/]*)/_design/[^/]+/_view/([^/]+)', ViewHandler,
+             kwargs),
+            (r'/([^/_][^/]*)/([^/]+)', DocumentHandler, kwargs),
+        ])
+
+    def start(self, sockets=None):
+        """
+        Start serving on an unused port using the current IOLoop
+
+        :param sockets: (optional) listening sockets to serve on instead
+        :returns: the server's URL
+        """
+        if sockets is None:
+            sockets = [bind_unused_port()[0]]
+        port = sockets[0].getsockname()[1]
+        self._server = HTTPServer(self.application())
+        self._server.add_sockets(sockets)
+        self.url = 'http://127.0.0.1:{}'.format(port)
+
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+
+
+class BaseHandler(RequestHandler):
+    def initialize(self, fake):
+        self.fake = fake
+
+    @coroutine
+    def prepare(self):
+        self.fake.requests += 1
+
+        delay = self.fake.delay
+        if callable(delay):
+            delay = delay(self.request)
+        if delay:
+            yield sleep(delay)
+
+        if self.fake.status:
+            self.send_json({'error': 'unavailable'}, self.fake.status)
+
+    def send_json(self, body, status=200):
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(body))
+
+    def json_argument(self, name, default=None):
+        value = self.get_query_argument(name, None)
+        return default if value is None else json.loads(value)
+
+
+class WelcomeHandler(BaseHandler):
+    def get(self):
+        self.send_json({'couchdb': 'Welcome'})
+
+
+class ActiveTasksHandler(BaseHandler):
+    def get(self):
+        self.send_json([])
+
+
+class ChangesHandler(BaseHandler):
+    def get(self, db_name):
+        self.send_json(self.fake.changes(db_name))
+
+
+class ViewHandler(BaseHandler):
+    def get(self, db_name, view_name, keys=None):
+        try:
+            result = self.fake.view(
+                db_name, view_name,
+                key=self.json_argument('key'),
+                keys=keys or self.json_argument('keys'),
+                include_docs=self.json_argument('include_docs', False),
+                limit=self.json_argument('limit'))
+        except KeyError:
+            self.send_json({'error': 'not_found'}, 404)
+        else:
+            self.send_json(result)
+
+    def post(self, db_name, view_name):
+        keys = json.loads(self.request.body)['keys']
+        self.get(db_name, view_name, keys)
+
+
+class DocumentHandler(BaseHandler):
+    def get(self, db_name, doc_id):
+        try:
+            self.send_json(self.fake.databases[db_name][doc_id])
+        except KeyError:
+            self.send_json({'error': 'not_found'}, 404)
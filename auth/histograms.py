@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Histograms
+----------
+
+Latency histograms for the stages of handling a request, exposed in the
+Prometheus text format on /metrics.
+
+The histograms are kept in an anonymous mmap created before forking, so they
+are shared by the workers. Each worker has its own row of the histograms
+(see `auth.slots`) & only writes to its row, so no locks are needed, and
+the rows are added together when the histograms are read.
+"""
+import mmap
+import struct
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from . import slots
+
+# the stages of handling a request
+STAGES = (
+    'basic_auth',
+    'authenticate',
+    'decode_token',
+    'scope_parse',
+    'scope_validate',
+    'registry.authenticate',
+    'registry.service',
+    'registry.repository',
+    'registry.resource',
+    'registry.location',
+    'registry.organisation',
+    'registry.view',
+    'generate_token',
+)
+
+# bucket upper bounds in seconds, followed by +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5)
+
+NAME = 'auth_stage_duration_seconds'
+
+_VALUE = struct.Struct('<d')
+# a histogram's bucket counts (including +Inf) & sum
+_FIELDS = len(BUCKETS) + 2
+
+_histograms = None
+
+
+class Histograms(object):
+    """
+    :param workers: the number of rows, one for each worker process
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._index = {name: i for i, name in enumerate(STAGES)}
+        self._row_size = len(STAGES) * _FIELDS * _VALUE.size
+        # anonymous mmaps are MAP_SHARED, so are shared with forked children
+        self._mmap = mmap.mmap(-1, workers * self._row_size)
+
+    def _offset(self, stage, field):
+        row = slots.row(self.workers)
+        return (row * self._row_size +
+                (self._index[stage] * _FIELDS + field) * _VALUE.size)
+
+    def _add(self, offset, value):
+        _VALUE.pack_into(self._mmap, offset,
+                         _VALUE.unpack_from(self._mmap, offset)[0] + value)
+
+    def observe(self, stage, seconds):
+        """
+        Record how long a stage took
+
+        :param stage: one of STAGES
+        :param seconds: the stage's duration
+        """
+        self._add(self._offset(stage, bisect_left(BUCKETS, seconds)), 1)
+        self._add(self._offset(stage, _FIELDS - 1), seconds)
+
+    def read(self, stage):
+        """
+        Read a histogram, added up across the workers
+
+        :returns: (bucket counts including +Inf, sum)
+        """
+        values = [0.0] * _FIELDS
+        start = self._index[stage] * _FIELDS * _VALUE.size
+        for row in range(self.workers):
+            offset = row * self._row_size + start
+            for field in range(_FIELDS):
+                values[field] += _VALUE.unpack_from(
+                    self._mmap, offset + field * _VALUE.size)[0]
+
+        return values[:-1], values[-1]
+
+
+def configure(processes=None, supervised=False):
+    """
+    Create the histograms, must be called before forking for the histograms
+    to be shared by the workers
+
+    :param processes: the number of processes that will be started, 0 or
+        None for one per CPU
+    :param supervised: (optional) whether the workers are supervised
+    """
+    global _histograms
+
+    _histograms = Histograms(slots.rows(processes, supervised))
+
+
+def get_histograms():
+    """The histograms, created for a single process if not configured"""
+    global _histograms
+
+    if _histograms is None:
+        _histograms = Histograms()
+
+    return _histograms
+
+
+def observe(stage, seconds):
+    """Record how long a stage took"""
+    get_histograms().observe(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Record how long the block takes, including blocks that raise"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(stage, time.time() - start)
+
+
+def exposition():
+    """The histograms in the Prometheus text format"""
+    histograms = get_histograms()
+    lines = [
+        '# HELP {} Time spent in each stage of handling a request'.format(
+            NAME),
+        '# TYPE {} histogram'.format(NAME),
+    ]
+    for stage in STAGES:
+        counts, total = histograms.read(stage)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else repr(float(bound))
+            lines.append('{}_bucket{{stage="{}",le="{}"}} {:.0f}'.format(
+                NAME, stage, le, cumulative))
+        lines.append('{}_sum{{stage="{}"}} {!r}'.format(NAME, stage, total))
+        lines.append('{}_count{{stage="{}"}} {:.0f}'.format(
+            NAME, stage, cumulative))
+
+    return '\n'.join(lines) + '\n'
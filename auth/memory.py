@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Memory reporting
+----------------
+
+Finds what is growing in a long running worker. Once tracking is started
+(POST /admin/memory) the worker takes a snapshot of its allocations every
+`interval` seconds & compares it with the previous snapshot, keeping the
+allocation sites that grew the most for GET /admin/memory.
+
+Allocations are traced with tracemalloc when it's available (Python 3 or
+pytracemalloc), otherwise the garbage collector's objects are counted by
+type, which finds growing containers but not where they were allocated.
+
+Each worker's resident set size is also recorded in shared memory, so
+/metrics can report the RSS of every running worker.
+"""
+import gc
+import logging
+import mmap
+import resource
+import struct
+from collections import Counter
+
+from tornado.ioloop import PeriodicCallback
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from . import slots
+
+# number of stack frames traced for each allocation
+TRACE_FRAMES = 10
+# seconds between updating the RSS gauge
+RSS_INTERVAL = 10
+
+RSS_NAME = 'auth_worker_rss_bytes'
+
+_VALUE = struct.Struct('<d')
+
+_tracker = None
+_callback = None
+_gauge = None
+
+
+def rss():
+    """The current process's resident set size in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # the peak RSS in kilobytes, used if there's no /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Tracker(object):
+    """
+    :param limit: (optional) number of allocation sites to report
+    """
+
+    def __init__(self, limit=20):
+        self.limit = limit
+        self.method = 'tracemalloc' if tracemalloc else 'gc'
+        self.top = []
+        self._previous = None
+
+    def start(self):
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        self._previous = self._snapshot()
+
+    def stop(self):
+        if tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._previous = None
+
+    def _snapshot(self):
+        if tracemalloc:
+            return tracemalloc.take_snapshot()
+
+        return Counter(type(x).__name__ for x in gc.get_objects())
+
+    def _compare(self, current, previous):
+        if tracemalloc:
+            return [{'site': str(x.traceback),
+                     'size_diff': x.size_diff,
+                     'count_diff': x.count_diff}
+                    for x in current.compare_to(previous, 'traceback')
+                    if x.size_diff > 0][:self.limit]
+
+        growth = current.copy()
+        growth.subtract(previous)
+        return [{'site': name, 'count_diff': count}
+                for name, count in growth.most_common(self.limit)
+                if count > 0]
+
+    def update(self):
+        """Compare a new snapshot with the previous snapshot"""
+        current = self._snapshot()
+        self.top = self._compare(current, self._previous)
+        self._previous = current
+
+        if self.top:
+            logging.info('Top memory growth: %s', self.top[0])
+
+
+def start(interval, limit=20):
+    """
+    Start tracking memory growth
+
+    :param interval: seconds between snapshots
+    :param limit: (optional) number of allocation sites to report
+    :returns: False if memory growth is already being tracked
+    """
+    global _tracker, _callback
+
+    if _tracker is not None:
+        return False
+
+    _tracker = Tracker(limit)
+    _tracker.start()
+    _callback = PeriodicCallback(_tracker.update, interval * 1000)
+    _callback.start()
+
+    return True
+
+
+def stop():
+    """Stop tracking memory growth"""
+    global _tracker, _callback
+
+    if _tracker is not None:
+        _callback.stop()
+        _tracker.stop()
+        _tracker = _callback = None
+
+
+def report():
+    """The worker's RSS & memory growth"""
+    result = {'rss_bytes': rss(), 'tracking': _tracker is not None}
+    if _tracker is not None:
+        result['method'] = _tracker.method
+        result['top'] = _tracker.top
+
+    return result
+
+
+class RSSGauge(object):
+    """
+    The RSS of each worker, kept in shared memory
+
+    :param workers: the number of rows, one for each worker process
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        # anonymous mmaps are MAP_SHARED, so are shared with forked children
+        self._mmap = mmap.mmap(-1, workers * _VALUE.size)
+
+    def update(self):
+        row = slots.row(self.workers)
+        _VALUE.pack_into(self._mmap, row * _VALUE.size, rss())
+
+    def clear(self, row):
+        """Clear an exited worker's row"""
+        _VALUE.pack_into(self._mmap, (row % self.workers) * _VALUE.size, 0)
+
+    def read(self):
+        return [_VALUE.unpack_from(self._mmap, row * _VALUE.size)[0]
+                for row in range(self.workers)]
+
+
+def configure(processes=None, supervised=False):
+    """
+    Create the RSS gauge, must be called before forking for the gauge to be
+    shared by the workers
+
+    :param processes: the number of processes that will be started, 0 or
+        None for one per CPU
+    :param supervised: (optional) whether the workers are supervised
+    """
+    global _gauge
+
+    _gauge = RSSGauge(slots.rows(processes, supervised))
+
+
+def get_gauge():
+    """The RSS gauge, created for a single process if not configured"""
+    global _gauge
+
+    if _gauge is None:
+        _gauge = RSSGauge()
+
+    return _gauge
+
+
+def start_rss_gauge():
+    """Update the worker's RSS in the gauge periodically"""
+    gauge = get_gauge()
+    gauge.update()
+    PeriodicCallback(gauge.update, RSS_INTERVAL * 1000).start()
+
+
+def exposition():
+    """The RSS gauge in the Prometheus text format"""
+    lines = ['# HELP {} Resident set size of each worker'.format(RSS_NAME),
+             '# TYPE {} gauge'.format(RSS_NAME)]
+    for worker, value in enumerate(get_gauge().read()):
+        # rows without a running worker
+        if not value:
+            continue
+        lines.append('{}{{worker="{}"}} {:.0f}'.format(RSS_NAME, worker,
+                                                      value))
+
+    return '\n'.join(lines) + '\n'
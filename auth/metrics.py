@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Metrics
+-------
+
+Counters for events on the request path, e.g. which consistency mode was
+used to read a view.
+
+The counters in COUNTERS are also kept in an anonymous mmap created before
+forking, like the histograms, so they're added up across the workers &
+exposed in the Prometheus text format on /metrics. Other counters are only
+kept per process.
+
+The mmap also holds GAUGES, the current value of something in each worker,
+e.g. the number of requests queued by the fair queue, which are added up
+across the workers on /metrics. An exited worker's gauges are cleared by the
+supervisor.
+"""
+import mmap
+import struct
+from collections import Counter
+
+from . import slots
+
+# the counters exposed on /metrics
+COUNTERS = (
+    'responses.degraded',
+    'responses.slow',
+    'deadline.exceeded',
+    'admission.verify.admitted',
+    'admission.verify.rejected',
+    'admission.verify.queue_time_ms',
+    'admission.token.admitted',
+    'admission.token.rejected',
+    'admission.token.queue_time_ms',
+    'fair_queue.started',
+    'fair_queue.wait_ms',
+    'registry.lookups',
+    'registry.collapsed',
+    'registry.unavailable',
+    'registry.last_known_good',
+    'registry.breaker_rejected',
+    'registry.breaker_opened',
+    'registry.breaker_closed',
+    'view_reads.consistent',
+    'view_reads.stale',
+    'view_reads.stale_not_found',
+    'replicas.reads',
+    'replicas.hedged',
+    'replicas.failed',
+    'couch_pool.requests',
+    'couch_pool.queued',
+    'couch_pool.queue_wait_ms',
+    'couch_pool.queue_timeout',
+    'warm_up.failed',
+    'warm_up.ms',
+    'profiler.started',
+)
+
+# the gauges exposed on /metrics
+GAUGES = (
+    'fair_queue.queued',
+    'fair_queue.running',
+)
+
+PREFIX = 'auth_'
+
+_VALUE = struct.Struct('<d')
+
+_counters = Counter()
+_shared = None
+
+
+class SharedMetrics(object):
+    """
+    The COUNTERS & GAUGES of each worker, kept in shared memory. Each worker
+    only writes to its own row, so no locks are needed
+
+    :param workers: the number of rows, one for each worker process
+    """
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self._index = {name: i for i, name in enumerate(COUNTERS + GAUGES)}
+        self._row_size = len(self._index) * _VALUE.size
+        # anonymous mmaps are MAP_SHARED, so are shared with forked children
+        self._mmap = mmap.mmap(-1, workers * self._row_size)
+
+    def _offset(self, index, row=None):
+        if row is None:
+            row = slots.row(self.workers)
+        return row * self._row_size + index * _VALUE.size
+
+    def add(self, name, value):
+        """Add to a counter, if it's one of COUNTERS"""
+        index = self._index.get(name)
+        if index is None:
+            return
+
+        offset = self._offset(index)
+        _VALUE.pack_into(self._mmap, offset,
+                         _VALUE.unpack_from(self._mmap, offset)[0] + value)
+
+    def set(self, name, value):
+        """Set one of GAUGES"""
+        _VALUE.pack_into(self._mmap, self._offset(self._index[name]), value)
+
+    def read(self, name):
+        """Read a counter or gauge, added up across the workers"""
+        index = self._index[name]
+        return sum(_VALUE.unpack_from(self._mmap, self._offset(index, row))[0]
+                   for row in range(self.workers))
+
+    def clear_gauges(self, row):
+        """Clear an exited worker's gauges"""
+        row %= self.workers
+        for name in GAUGES:
+            _VALUE.pack_into(self._mmap, self._offset(self._index[name], row),
+                             0)
+
+
+def configure(processes=None, supervised=False):
+    """
+    Create the shared metrics, must be called before forking for the
+    metrics to be shared by the workers
+
+    :param processes: the number of processes that will be started, 0 or
+        None for one per CPU
+    :param supervised: (optional) whether the workers are supervised
+    """
+    global _shared
+
+    _shared = SharedMetrics(slots.rows(processes, supervised))
+
+
+def get_shared():
+    """The shared metrics, created for a single process if not configured"""
+    global _shared
+
+    if _shared is None:
+        _shared = SharedMetrics()
+
+    return _shared
+
+
+def increment(name, value=1):
+    """
+    Increment a counter
+
+    :param name: the counter's name
+    :param value: (optional) the amount to add
+    """
+    _counters[name] += value
+    get_shared().add(name, value)
+
+
+def set_gauge(name, value):
+    """
+    Set the worker's value of a gauge
+
+    :param name: one of GAUGES
+    :param value: the gauge's value
+    """
+    get_shared().set(name, value)
+
+
+def get(name):
+    """Get a counter's value"""
+    return _counters[name]
+
+
+def counters():
+    """Get a copy of all counters"""
+    return dict(_counters)
+
+
+def reset():
+    """Reset all counters"""
+    global _shared
+
+    _counters.clear()
+    _shared = None
+
+
+def metric_name(name, suffix=''):
+    """The Prometheus name of a metric, e.g. auth_registry_lookups_total"""
+    return '{}{}{}'.format(PREFIX, name.replace('.', '_'), suffix)
+
+
+def exposition():
+    """The shared counters & gauges in the Prometheus text format"""
+    shared = get_shared()
+    lines = []
+    for names, kind, suffix in [(COUNTERS, 'counter', '_total'),
+                                (GAUGES, 'gauge', '')]:
+        for name in names:
+            metric = metric_name(name, suffix)
+            lines.append('# TYPE {} {}'.format(metric, kind))
+            lines.append('{} {!r}'.format(metric, shared.read(name)))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Check whether a client is authorized to access a resource
+
+A resource's permissions are compiled into an authorization matrix, mapping
+the client's organisation & service type to the effective access, so that a
+check does not depend on the number of permission rules.
+
+Entries for resources in the registry snapshot are updated when the snapshot
+changes. Other resources are keyed on the revision of their parent document,
+so a changed document is compiled again on the next check. The matrix keeps
+up to `authorization_matrix_size` entries, evicting the least recently used.
+"""
+from collections import OrderedDict
+
+from perch import State
+from tornado.options import options
+
+from .. import cache, snapshot
+
+ACCESS = ('r', 'w', 'rw')
+
+
+def _effective_access(permission_sets):
+    """
+    The access permitted by the permission sets, following the same rules
+    as perch.Service.authorized
+
+    :param permission_sets: organisation, service type & all permission sets
+    :returns: frozenset of permitted access
+    """
+    permitted = set()
+    for access in ACCESS:
+        for permission_set in permission_sets:
+            if '-' in permission_set:
+                break
+            elif set(access).issubset(permission_set):
+                permitted.add(access)
+                break
+
+    return frozenset(permitted)
+
+
+class Entry(object):
+    """The effective access to a resource"""
+    __slots__ = ('source', 'organisations', 'service_types', 'access')
+
+    def __init__(self, source, grouped_permissions):
+        self.source = source
+        org, service_type, everyone = grouped_permissions
+        self.organisations = frozenset(org)
+        self.service_types = frozenset(service_type)
+        self.access = {
+            (org_id, type_id): _effective_access([
+                org.get(org_id, snapshot.EMPTY),
+                service_type.get(type_id, snapshot.EMPTY),
+                everyone])
+            for org_id in list(org) + [None]
+            for type_id in list(service_type) + [None]
+        }
+
+    def permits(self, organisation_id, service_type, requested_access):
+        """Is the requested access permitted"""
+        if organisation_id not in self.organisations:
+            organisation_id = None
+        if service_type not in self.service_types:
+            service_type = None
+
+        return requested_access in self.access[(organisation_id, service_type)]
+
+
+def _source(resource):
+    """
+    The source of a resource's permissions, used to check an entry is
+    up to date. None if the resource can't be indexed
+    """
+    try:
+        return resource.grouped_permissions
+    except AttributeError:
+        pass
+
+    try:
+        return resource.parent._resource['_rev']
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+
+class AuthorizationMatrix(object):
+    """
+    Maps a resource ID to the resource's compiled permissions
+
+    :param max_size: (optional) maximum number of entries, defaults to the
+        `authorization_matrix_size` option
+    """
+
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def max_size(self):
+        if self._max_size is None:
+            return int(getattr(options, 'authorization_matrix_size', 10000))
+
+        return self._max_size
+
+    def _set(self, resource_id, entry):
+        self._entries.pop(resource_id, None)
+        self._entries[resource_id] = entry
+
+        max_size = self.max_size
+        while len(self._entries) > max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, resource):
+        """
+        Get the entry for a resource, compiling it if it's missing or out of
+        date
+
+        :returns: an Entry or None if the resource can't be indexed
+        """
+        source = _source(resource)
+        if source is None:
+            return None
+
+        entry = self._entries.pop(resource.id, None)
+        if entry is None or (entry.source is not source and
+                             entry.source != source):
+            try:
+                grouped = resource.grouped_permissions
+            except AttributeError:
+                grouped = snapshot.compile_permissions(
+                    getattr(resource, 'permissions', []))
+            entry = Entry(source, grouped)
+
+        self._set(resource.id, entry)
+        return entry
+
+    def update(self, added, removed):
+        """Update the matrix when the registry snapshot changes"""
+        for resource_id in removed:
+            self._entries.pop(resource_id, None)
+
+        for record in added:
+            self._set(record.id, Entry(record.grouped_permissions,
+                                       record.grouped_permissions))
+
+    def authorized(self, client, requested_access, resource):
+        """
+        Check whether the client is authorized to access the resource
+
+        :param client: the client service
+        :param requested_access: "r", "w", or "rw"
+        :param resource: a service or repository
+        :returns: True if has access, False otherwise
+        """
+        access = ''.join(sorted(set(requested_access)))
+        entry = self.get(resource) if access in ACCESS else None
+        if entry is None:
+            return client.authorized(requested_access, resource)
+
+        if {client.state, resource.state} != {State.approved}:
+            return False
+
+        return entry.permits(client.organisation_id, client.service_type,
+                             access)
+
+
+matrix = AuthorizationMatrix()
+snapshot.subscribe(matrix.update)
+
+
+def authorized(client, requested_access, resource):
+    """
+    Check whether the client is authorized to access the resource
+
+    Decisions are cached in the "decisions" cache
+
+    :param client: the client service
+    :param requested_access: "r", "w", or "rw"
+    :param resource: a service or repository
+    :returns: True if has access, False otherwise
+    """
+    decisions = cache.get_cache('decisions')
+    if not decisions.enabled:
+        return matrix.authorized(client, requested_access, resource)
+
+    key = u'{}:{}:{}'.format(client.id, requested_access, resource.id)
+
+    has_access = decisions.get(key)
+    if has_access is None:
+        has_access = matrix.authorized(client, requested_access, resource)
+        decisions.set(key, has_access)
+
+    return has_access
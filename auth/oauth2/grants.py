@@ -13,8 +13,9 @@ Implementations for the client credentials & JWT-bearer authorization grants
 import couch
 from tornado.gen import coroutine, Return
 from tornado.options import options
-from perch import Repository, Service
 
+from .. import registry
+from .authorization import authorized
 from .scope import Scope
 from .token import generate_token, decode_token
 from .exceptions import InvalidGrantType, BadRequest, Unauthorized
@@ -22,8 +23,14 @@ from .exceptions import InvalidGrantType, BadRequest, Unauthorized
 _registry = {}
 
 
-def get_grant(request, token=None):
-    """Grant factory"""
+def get_grant(request, token=None, deadline=None):
+    """
+    Grant factory
+
+    :param request: the HTTP request
+    :param token: (optional) a token to verify
+    :param deadline: (optional) the request's Deadline
+    """
     if token is None:
         key = request.grant_type
     else:
@@ -35,12 +42,13 @@ def get_grant(request, token=None):
     except KeyError:
         raise InvalidGrantType(key)
 
-    return grant_type(request)
+    return grant_type(request, deadline)
 
 
 class BaseGrant(object):
-    def __init__(self, request):
+    def __init__(self, request, deadline=None):
         self.request = request
+        self.deadline = deadline
 
     @classmethod
     def register(cls):
@@ -66,7 +74,7 @@ class BaseGrant(object):
             except (KeyError, IndexError):
                 scope = options.default_scope
 
-            self._scope = scope = Scope(scope)
+            self._scope = scope = Scope(scope, self.deadline)
 
         return scope
 
@@ -156,7 +164,9 @@ class BaseGrant(object):
             raise Return(True)
 
         try:
-            repo = yield Repository.get(self.hosted_resource)
+            repo = yield registry.get_repository(
+                self.hosted_resource, client=client,
+                request_deadline=self.deadline)
         except couch.NotFound:
             raise Unauthorized("Unknown repository '{}'"
                                .format(self.hosted_resource))
@@ -166,7 +176,7 @@ class BaseGrant(object):
                                .format(self.request.client_id,
                                        self.hosted_resource))
 
-        has_access = client.authorized(self.requested_access, repo)
+        has_access = authorized(client, self.requested_access, repo)
         if not has_access:
             raise Unauthorized(
                 "'{}' does not have '{}' access to repository '{}'"
@@ -181,11 +191,13 @@ class BaseGrant(object):
         Verify the token's client / delegate has access to the service
         """
         try:
-            service = yield Service.get(self.request.client_id)
+            service = yield registry.get_service(
+                self.request.client_id, client=client,
+                request_deadline=self.deadline)
         except couch.NotFound:
             raise Unauthorized("Unknown service '{}'"
                                .format(self.request.client_id))
-        has_access = client.authorized(self.requested_access, service)
+        has_access = authorized(client, self.requested_access, service)
 
         if not has_access:
             raise Unauthorized("'{}' does not have '{}' to service '{}'"
@@ -228,7 +240,8 @@ class ClientCredentials(BaseGrant):
         """Verify a token has access to a resource"""
         decoded = decode_token(token)
         scope = decoded['scope']
-        client = yield Service.get(decoded['client']['id'])
+        client = yield registry.get_service(decoded['client']['id'],
+                                            request_deadline=self.deadline)
 
         self.verify_scope(scope)
         yield [self.verify_access_service(client),
@@ -288,8 +301,9 @@ class AuthorizeDelegate(BaseGrant):
 
         # Assuming delegation always requires write access
         # should change it to a param
-        client = yield Service.get(self.assertion['client']['id'])
-        has_access = client.authorized('w', self.request.client)
+        client = yield registry.get_service(self.assertion['client']['id'],
+                                            request_deadline=self.deadline)
+        has_access = authorized(client, 'w', self.request.client)
 
         if not has_access:
             raise Unauthorized('Client "{}" may not delegate to service "{}"'.format(
@@ -313,11 +327,13 @@ class AuthorizeDelegate(BaseGrant):
         self.verify_scope(scope)
 
         try:
-            delegate = yield Service.get(decoded['sub'])
+            delegate = yield registry.get_service(
+                decoded['sub'], request_deadline=self.deadline)
         except couch.NotFound:
             raise Unauthorized("Unknown delegate '{}'".format(decoded['sub']))
 
-        client = yield Service.get(decoded['client']['id'])
+        client = yield registry.get_service(decoded['client']['id'],
+                                            request_deadline=self.deadline)
 
         yield [self.verify_access_service(delegate),
                self.verify_access_service(client),
@@ -51,9 +51,11 @@ from collections import defaultdict, namedtuple
 from functools import partial
 
 import couch
-from perch import views, Repository, Service
+from perch import Service
 from tornado.gen import coroutine, Return
 
+from .. import histograms, registry, tracing
+from .authorization import authorized
 from .exceptions import InvalidScope, Unauthorized
 
 READ = 'read'
@@ -66,22 +68,22 @@ ACCESS_MAPPING = {
     READ: 'r',
     WRITE: 'w'
 }
-RESOURCE_TYPES = {
-    Repository.resource_type: Repository,
-    Service.resource_type: Service,
-}
 
 
 Access = namedtuple('Access', ['access', 'delegate_id'])
+EMPTY = frozenset()
 
 
 class Scope(object):
-    def __init__(self, scope):
+    def __init__(self, scope, deadline=None):
         self.scope = scope
+        # the request's Deadline, used when checking the client's access
+        self.deadline = deadline
         # read is True if the scope is for reading any resource
         self.read = False
         try:
-            self._group()
+            with histograms.timed('scope_parse'):
+                self._group()
         except KeyError:
             raise InvalidScope('Invalid action')
 
@@ -153,7 +155,9 @@ class Scope(object):
 
         access_set = {Access(x, None) for x in access if x in 'rw'}
 
-        return bool(access_set & (self.resources[resource_id] | self.delegates[resource_id]))
+        # use get to avoid adding keys to the defaultdicts on each check
+        return bool(access_set & (self.resources.get(resource_id, EMPTY) |
+                                  self.delegates.get(resource_id, EMPTY)))
 
     @coroutine
     def validate(self, client):
@@ -174,11 +178,17 @@ class Scope(object):
         resource_func = partial(self._check_access_resource, client)
         delegate_func = partial(self._check_access_delegate, client)
 
-        yield [self._check_access_resources(resource_func, self.resources),
-               self._check_access_resources(delegate_func, self.delegates)]
+        with histograms.timed('scope_validate'), \
+                tracing.span('scope.validate') as span:
+            span.tag(resources=len(self.resources),
+                     delegates=len(self.delegates))
+            yield [self._check_access_resources(resource_func, self.resources,
+                                                client),
+                   self._check_access_resources(delegate_func, self.delegates,
+                                                client)]
 
     @coroutine
-    def _check_access_resources(self, func, resources):
+    def _check_access_resources(self, func, resources, client=None):
         """Check resources exist and then call func for each resource"""
         grouped = {'ids': {}, 'urls': {}}
 
@@ -188,11 +198,11 @@ class Scope(object):
             else:
                 grouped['ids'][k] = v
 
-        yield [self._check_access_resource_ids(func, grouped['ids']),
+        yield [self._check_access_resource_ids(func, grouped['ids'], client),
                self._check_access_resource_urls(func, grouped['urls'])]
 
     @coroutine
-    def _check_access_resource_ids(self, func, resources):
+    def _check_access_resource_ids(self, func, resources, client=None):
         """
         Check resource identified by an ID exist and then call func for
         each resource
@@ -202,13 +212,14 @@ class Scope(object):
 
         for resource_id in resources:
             try:
-                doc = yield views.service_and_repository.first(key=resource_id)
+                resource = yield registry.get_resource(
+                    resource_id, client=client, request_deadline=self.deadline)
             except couch.NotFound:
                 raise InvalidScope('Scope contains an unknown resource ID')
 
-            resource = RESOURCE_TYPES[doc['value']['type']](**doc['value'])
             try:
-                yield resource.get_parent()
+                yield registry.get_parent(resource,
+                                          request_deadline=self.deadline)
             except couch.NotFound:
                 raise InvalidScope('Invalid resource - missing parent')
             func(resource, resources[resource_id])
@@ -221,7 +232,8 @@ class Scope(object):
         """
         for url in resources:
             try:
-                resource = yield Service.get_by_location(url)
+                resource = yield registry.get_service_by_location(
+                    url, request_deadline=self.deadline)
             except couch.NotFound:
                 raise InvalidScope("Scope contains an unknown location: '{}'"
                                    .format(url))
@@ -235,7 +247,7 @@ class Scope(object):
     def _check_access_resource(self, client, resource, access):
         """Check the client has access to the resource"""
         requested_access = self._concatenate_access(access)
-        has_access = client.authorized(requested_access, resource)
+        has_access = authorized(client, requested_access, resource)
 
         if not has_access:
             raise Unauthorized(
@@ -9,19 +9,25 @@
 
 """Create and decode JSON Web Tokens"""
 import calendar
+import time
 from datetime import datetime, timedelta
 from urlparse import urlparse
 
 import jwt
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.x509 import load_pem_x509_certificate
 from koi import LOCALHOST_CRT, LOCALHOST_KEY
 from tornado.options import options
 
 from .scope import Scope
+from .. import cache, histograms, request_context
 
 ALGORITHM = 'RS256'
 
+# parsed keys, keyed by the file they were read from
+_keys = {}
+
 
 def base_uri():
     auth_url = urlparse(getattr(options, 'url_auth', 'localhost'))
@@ -38,6 +44,31 @@ def audience():
     return '/'.join([base_uri(), 'verify'])
 
 
+def _load_key(path, loader):
+    """Read & parse a key file once per process"""
+    key = _keys.get(path)
+    if key is None:
+        with open(path) as f:
+            key = _keys[path] = loader(f.read())
+
+    return key
+
+
+def signing_key():
+    """The private key used to sign tokens"""
+    return _load_key(
+        getattr(options, 'ssl_key', None) or LOCALHOST_KEY,
+        lambda data: load_pem_private_key(data, None, default_backend()))
+
+
+def verification_key():
+    """The public key used to verify tokens"""
+    return _load_key(
+        getattr(options, 'ssl_cert', None) or LOCALHOST_CRT,
+        lambda data: load_pem_x509_certificate(
+            data, default_backend()).public_key())
+
+
 def generate_token(client, scope, grant_type, delegate_id=None):
     """
     Create an OAuth2 JSON Web Token, containing the scope & client details
@@ -51,10 +82,6 @@ def generate_token(client, scope, grant_type, delegate_id=None):
         ID is included as the "sub" claim
     :returns: (token, expiry datetime in seconds since the epoch)
     """
-    key_file = getattr(options, 'ssl_key', None) or LOCALHOST_KEY
-    with open(key_file) as f:
-        key = f.read()
-
     if delegate_id:
         subject = delegate_id
         delegate = True
@@ -81,8 +108,11 @@ def generate_token(client, scope, grant_type, delegate_id=None):
         'delegate': delegate
     }
 
-    return (jwt.encode(data, key, algorithm=ALGORITHM),
-            calendar.timegm(expiry.timetuple()))
+    with histograms.timed('generate_token'), \
+            request_context.timed('crypto_ms'):
+        token = jwt.encode(data, signing_key(), algorithm=ALGORITHM)
+
+    return token, calendar.timegm(expiry.timetuple())
 
 
 def decode_token(token):
@@ -98,13 +128,24 @@ def decode_token(token):
         jwt.InvalidIssuerError: Invalid "iss" claim
         jwt.MissingRequiredClaimError: Missing a required claim
     """
-    cert_file = getattr(options, 'ssl_cert', None) or LOCALHOST_CRT
-    with open(cert_file) as f:
-        cert = load_pem_x509_certificate(f.read(), default_backend())
-        public_key = cert.public_key()
+    with histograms.timed('decode_token'):
+        tokens = cache.get_cache('tokens')
+        payload = tokens.get(token)
+        if payload is None:
+            with request_context.timed('crypto_ms'):
+                payload = _verify_token(token)
+            # don't cache the token beyond its expiry
+            tokens.set(token, payload, ttl=payload['exp'] - time.time())
+
+    payload['scope'] = Scope(payload['scope'])
+
+    return payload
+
 
+def _verify_token(token):
+    """Verify the token's signature & claims, returning the payload"""
     payload = jwt.decode(token,
-                         public_key,
+                         verification_key(),
                          audience=audience(),
                          issuer=issuer(),
                          algorithms=[ALGORITHM],
@@ -113,6 +154,4 @@ def decode_token(token):
     if not payload.get('sub'):
         raise jwt.MissingRequiredClaimError('"sub" claim is required')
 
-    payload['scope'] = Scope(payload['scope'])
-
     return payload
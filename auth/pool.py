@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+CouchDB connection pool
+-----------------------
+
+perch & tornado-couchdb make their requests using tornado's shared
+AsyncHTTPClient, so the pool is installed by configuring AsyncHTTPClient.
+Requests are limited per host, waiting in a queue for a free connection,
+and the time spent waiting is recorded in the metrics.
+
+Connections are kept alive if pycurl is installed, using tornado's
+CurlAsyncHTTPClient. Otherwise the SimpleAsyncHTTPClient is used, which
+opens a connection for each request, so connections aren't warmed up.
+"""
+import logging
+import time
+from datetime import timedelta
+from urlparse import urlparse
+
+from tornado.gen import coroutine, Return, TimeoutError
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPResponse
+from tornado.locks import Semaphore
+from tornado.options import options
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+
+try:
+    from tornado.curl_httpclient import CurlAsyncHTTPClient
+except ImportError:
+    CurlAsyncHTTPClient = None
+
+from . import backends, metrics, request_context
+
+# seconds to wait for a connection if the request has no timeout
+DEFAULT_TIMEOUT = 20
+
+
+class PooledHTTPClient(AsyncHTTPClient):
+    """
+    An AsyncHTTPClient with a limit on concurrent requests to each host
+
+    :param max_clients: maximum number of concurrent requests
+    :param max_per_host: maximum number of concurrent requests to a host
+    """
+
+    def initialize(self, io_loop, max_clients=10, max_per_host=10,
+                   defaults=None):
+        super(PooledHTTPClient, self).initialize(io_loop, defaults=defaults)
+        impl = CurlAsyncHTTPClient or SimpleAsyncHTTPClient
+        self.client = impl(io_loop=io_loop, max_clients=max_clients,
+                           defaults=defaults, force_instance=True)
+        self.max_per_host = max_per_host
+        self._hosts = {}
+
+    def close(self):
+        self.client.close()
+        super(PooledHTTPClient, self).close()
+
+    def _semaphore(self, host):
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = Semaphore(self.max_per_host)
+
+        return semaphore
+
+    def fetch_impl(self, request, callback):
+        future = self._fetch(request.request)
+        self.io_loop.add_future(future, lambda f: callback(f.result()))
+
+    @coroutine
+    def _fetch(self, request):
+        """Wait for a connection to the host, then make the request"""
+        semaphore = self._semaphore(urlparse(request.url).netloc)
+        timeout = request.request_timeout or DEFAULT_TIMEOUT
+
+        start = time.time()
+        acquired = semaphore.acquire(timedelta(seconds=timeout))
+        queued = not acquired.done()
+        try:
+            yield acquired
+        except TimeoutError:
+            metrics.increment('couch_pool.queue_timeout')
+            raise Return(HTTPResponse(
+                request, 599, error=HTTPError(599, 'Timeout in request queue'),
+                request_time=time.time() - start))
+
+        waited = time.time() - start
+        metrics.increment('couch_pool.requests')
+        metrics.increment('couch_pool.queue_wait_ms', waited * 1000)
+        if queued:
+            metrics.increment('couch_pool.queued')
+
+        request_context.increment('couch.requests')
+        request_context.increment('couch.queue_wait_ms', waited * 1000)
+        if '/_view/' in request.url:
+            request_context.increment('couch.view_queries')
+
+        try:
+            with request_context.timed('couch.ms'):
+                response = yield self.client.fetch(request, raise_error=False)
+        finally:
+            semaphore.release()
+
+        raise Return(response)
+
+
+def configure():
+    """
+    Use the connection pool for all of the worker's couch requests, if
+    `couch_pool` is enabled
+    """
+    if not getattr(options, 'couch_pool', False):
+        return
+
+    if CurlAsyncHTTPClient is None:
+        logging.warning('pycurl is not installed, the CouchDB connection pool '
+                        'will open a connection for each request')
+
+    AsyncHTTPClient.configure(
+        PooledHTTPClient,
+        max_clients=int(getattr(options, 'couch_max_clients', 10)),
+        max_per_host=int(getattr(options, 'couch_max_per_host', 10)))
+
+
+def _urls():
+    """The CouchDB servers used by the worker"""
+    urls = [':'.join([options.url_registry_db, str(options.db_port)])]
+    urls.extend(getattr(options, 'registry_replicas', None) or [])
+
+    return urls
+
+
+@coroutine
+def warm_up():
+    """
+    Open connections to the CouchDB servers, so the first requests handled
+    by the worker don't wait for connections to be made
+    """
+    connections = int(getattr(options, 'couch_warm_connections', 0))
+    if (not getattr(options, 'couch_pool', False) or not connections or
+            backends.get_backend() is not None):
+        return
+
+    if CurlAsyncHTTPClient is None:
+        logging.warning('Not warming up connections to CouchDB, connections '
+                        'are only kept alive if pycurl is installed')
+        return
+
+    client = AsyncHTTPClient()
+    requests = [client.fetch(url + '/', raise_error=False)
+                for url in _urls() for _ in range(connections)]
+    responses = yield requests
+
+    failed = [x.request.url for x in responses if x.error]
+    if failed:
+        logging.warning('Could not warm up connections to %s',
+                        ', '.join(sorted(set(failed))))
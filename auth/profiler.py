@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Sampling profiler
+-----------------
+
+Profiles a running worker by sampling its stack on SIGPROF, which the
+kernel sends every `interval` seconds of CPU time used by the process. The
+overhead is a stack walk per sample, so the profiler can be used on a worker
+under live load.
+
+The samples are written to `profile_dir` in the collapsed stack format, one
+line per stack with the number of samples, which can be turned into a flame
+graph with flamegraph.pl or speedscope.
+
+A profile is started using POST /admin/profile, which profiles the worker
+handling the request, or by sending SIGUSR1 to a worker.
+"""
+import logging
+import os
+import signal
+import time
+from collections import Counter
+
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+from . import metrics
+
+_sampler = None
+
+
+class Sampler(object):
+    """
+    :param interval: (optional) seconds of CPU time between samples
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._previous = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name, code.co_filename,
+                                             code.co_firstlineno))
+            frame = frame.f_back
+
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        # restart system calls interrupted by a sample instead of failing
+        # them with EINTR, e.g. the IOLoop's epoll or a socket write
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+        # python's default for the signals it handles
+        signal.siginterrupt(signal.SIGPROF, True)
+
+    def collapsed(self):
+        """The samples in the collapsed stack format"""
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in sorted(self.stacks.items()))
+
+
+def is_running():
+    return _sampler is not None
+
+
+def output_path():
+    """A file in `profile_dir` for the worker's profile"""
+    return os.path.join(
+        getattr(options, 'profile_dir', 'profiles'),
+        'auth-{}-{}.collapsed'.format(os.getpid(),
+                                      time.strftime('%Y%m%d%H%M%S')))
+
+
+def _finish(path):
+    global _sampler
+
+    sampler, _sampler = _sampler, None
+    sampler.stop()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        f.write(sampler.collapsed())
+
+    logging.info('Wrote profile with %s samples to %s',
+                 sum(sampler.stacks.values()), path)
+
+
+def start(seconds=None):
+    """
+    Profile the worker
+
+    :param seconds: (optional) seconds to profile for, defaults to the
+        `profile_duration` option
+    :returns: the file the profile will be written to, None if the worker is
+        already being profiled
+    """
+    global _sampler
+
+    if _sampler is not None:
+        return None
+
+    seconds = seconds or float(getattr(options, 'profile_duration', 30))
+    path = output_path()
+    _sampler = Sampler(float(getattr(options, 'profile_interval', 0.005)))
+    _sampler.start()
+    metrics.increment('profiler.started')
+    IOLoop.current().call_later(seconds, _finish, path)
+    logging.info('Profiling for %ss', seconds)
+
+    return path
+
+
+def install_signal_handler():
+    """Start profiling the worker when it receives SIGUSR1"""
+    io_loop = IOLoop.current()
+
+    def on_signal(signum, frame):
+        io_loop.add_callback_from_signal(start)
+
+    signal.signal(signal.SIGUSR1, on_signal)
@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Registry lookups used when authorizing requests
+
+Resources are read from the registry snapshot when it's enabled, falling
+back to the registry database (e.g. for resources created since the snapshot
+was last updated).
+
+If the `authorization_view` option is enabled, resources that are looked up
+to authorize a client are read from the auth_resource_access view, fetching
+the resource and the client's permissions with a single query.
+
+Concurrent lookups of the same resource share one request to the registry.
+
+View reads use the `view_stale` consistency mode. A stale read that doesn't
+find a resource is read again from an up to date index, in case the resource
+was created since the index was updated.
+
+If read replicas are configured, lookups read from the replicas (see
+`auth.replicas`) instead of through perch. If a registry backend other than
+CouchDB is configured, lookups are made to the backend (see `auth.backends`).
+
+Lookups are protected by a circuit breaker. While the registry is failing or
+slow, lookups are answered from the last-known-good result of the same
+lookup, if it's no older than `last_known_good_max_age`, and the service is
+"degraded".
+"""
+import hashlib
+import socket
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import partial
+
+import couch
+from koi.exceptions import HTTPError
+from perch import exceptions, views, Repository, Service
+from tornado.gen import coroutine, with_timeout, Return, TimeoutError
+from tornado.httpclient import HTTPError as ClientHTTPError
+from tornado.options import options
+
+from . import (backends, breaker, cache, deadline, histograms, metrics,
+               replicas, request_context, singleflight, snapshot, tracing)
+from .views import auth_resource_access
+
+RESOURCE_TYPES = {
+    Repository.resource_type: Repository,
+    Service.resource_type: Service,
+}
+STALE = ('ok', 'update_after')
+
+# failures that mean the registry is unavailable, rather than that the
+# resource doesn't exist
+UNAVAILABLE = (couch.CouchException, ClientHTTPError, TimeoutError,
+               socket.error)
+
+_lookups = singleflight.Group('registry')
+_breaker = None
+_last_known_good = None
+_last_fallback = 0
+
+
+class Unavailable(HTTPError):
+    """The registry is unavailable & there's no last-known-good result"""
+
+    def __init__(self):
+        super(Unavailable, self).__init__(503, 'Registry unavailable')
+
+
+class LastKnownGood(object):
+    """
+    The most recent result of each lookup
+
+    :param max_age: seconds a result may be used for
+    :param max_size: maximum number of results, the oldest result is evicted
+        when full
+    """
+
+    def __init__(self, max_age, max_size):
+        self.max_age = max_age
+        self.max_size = max_size
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """Get a result, None if missing or too old"""
+        try:
+            stored, value = self._results[key]
+        except KeyError:
+            return None
+
+        if time.time() - stored > self.max_age:
+            return None
+
+        return value
+
+    def set(self, key, value):
+        self._results.pop(key, None)
+        self._results[key] = (time.time(), value)
+
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+
+def get_breaker():
+    """The registry's circuit breaker"""
+    global _breaker
+
+    if _breaker is None:
+        _breaker = breaker.CircuitBreaker(
+            'registry',
+            int(getattr(options, 'breaker_threshold', 5)),
+            float(getattr(options, 'breaker_reset_timeout', 30)))
+
+    return _breaker
+
+
+def get_last_known_good():
+    """The last-known-good lookup results"""
+    global _last_known_good
+
+    if _last_known_good is None:
+        _last_known_good = LastKnownGood(
+            float(getattr(options, 'last_known_good_max_age', 300)),
+            int(getattr(options, 'last_known_good_size', 10000)))
+
+    return _last_known_good
+
+
+def degraded():
+    """
+    Is the service degraded, i.e. the registry's circuit is not closed or a
+    last-known-good result was used recently
+    """
+    registry_breaker = get_breaker()
+    return (registry_breaker.state != breaker.CLOSED or
+            time.time() - _last_fallback < registry_breaker.reset_timeout)
+
+
+def _fallback(key):
+    """
+    Get the last-known-good result for a lookup
+
+    :raises: Unavailable
+    """
+    global _last_fallback
+
+    value = get_last_known_good().get(key)
+    if value is None:
+        metrics.increment('registry.unavailable')
+        raise Unavailable()
+
+    metrics.increment('registry.last_known_good')
+    request_context.increment('registry.last_known_good')
+    _last_fallback = time.time()
+    return value
+
+
+@coroutine
+def _call(func, *args, **kwargs):
+    """
+    Call func, recording the result with the circuit breaker. Called once
+    for concurrent lookups, so the result is only recorded once however many
+    requests are waiting for it. After `registry_timeout` the call is
+    abandoned & counted as a failure, but not cancelled
+
+    :raises: couch.NotFound, any of UNAVAILABLE
+    """
+    registry_breaker = get_breaker()
+    timeout = float(getattr(options, 'registry_timeout', 0))
+    try:
+        future = func(*args, **kwargs)
+        if timeout:
+            future = with_timeout(timedelta(seconds=timeout), future)
+        result = yield future
+    except couch.NotFound:
+        registry_breaker.success()
+        raise
+    except UNAVAILABLE:
+        registry_breaker.failure()
+        raise
+
+    registry_breaker.success()
+    raise Return(result)
+
+
+@coroutine
+def _lookup(key, request_deadline, func, *args, **kwargs):
+    """
+    Look up something in the registry, coalescing concurrent lookups and
+    using the last-known-good result if the registry is unavailable
+
+    :param key: a hashable key identifying the lookup
+    :param request_deadline: the request's Deadline, or None
+    :param func: a coroutine that looks up the result
+    :raises: couch.NotFound, Unavailable, DeadlineExceeded
+    """
+    if request_deadline is not None:
+        request_deadline.check()
+
+    request_context.increment('registry.' + key[0])
+    if not get_breaker().allow():
+        raise Return(_fallback(key))
+
+    try:
+        future = _lookups.do(key, _call, func, *args, **kwargs)
+        with histograms.timed('registry.' + key[0]), \
+                tracing.span('registry.' + key[0], leaf=True):
+            result = yield deadline.wait(request_deadline, key[0], future)
+    except couch.NotFound:
+        raise
+    except UNAVAILABLE:
+        raise Return(_fallback(key))
+
+    if result is not None:
+        get_last_known_good().set(key, result)
+
+    raise Return(result)
+
+
+@coroutine
+def authenticate(client_id, client_secret, request_deadline=None):
+    """
+    Authenticate a client, using the "credentials" cache to avoid looking up
+    the client's secrets
+
+    :param request_deadline: (optional) the request's Deadline
+
+    :returns: the client service, or None if the credentials are invalid
+    """
+    credentials = cache.get_cache('credentials')
+    key = hashlib.sha256(':'.join([client_id, client_secret])).hexdigest()
+
+    if credentials.get(key):
+        try:
+            service = yield get_service(
+                client_id, request_deadline=request_deadline)
+        except couch.NotFound:
+            service = None
+    else:
+        backend = backends.get_backend()
+        if backend is not None:
+            func = backend.authenticate
+        elif replicas.get_replicas() is None:
+            func = Service.authenticate
+        else:
+            func = _replica_authenticate
+        service = yield _lookup(('authenticate', key), request_deadline,
+                                func, client_id, client_secret)
+        if service:
+            credentials.set(key, True)
+            service = (_from_snapshot(service.id, Service.resource_type) or
+                       service)
+
+    raise Return(service)
+
+
+def _subresource(cls, row):
+    """Create a service or repository from a view row including the doc"""
+    return cls(parent=cls.parent_resource(**row['doc']), **row['value'])
+
+
+@coroutine
+def _replica_get(cls, resource_id):
+    """Get an active service or repository from the replicas, like cls.get"""
+    row = yield replicas.get_replicas().first(
+        cls.active_view, key=resource_id, include_docs=True)
+    raise Return(_subresource(cls, row))
+
+
+@coroutine
+def _replica_authenticate(client_id, client_secret):
+    """Authenticate a client using the replicas, like Service.authenticate"""
+    result = yield replicas.get_replicas().get(
+        views.oauth_client, key=[client_secret, client_id])
+    if not result['rows']:
+        raise Return(None)
+
+    service = yield _replica_get(Service, client_id)
+    raise Return(service)
+
+
+@coroutine
+def _replica_get_by_location(location):
+    """Get an active service from the replicas, like Service.get_by_location"""
+    row = yield replicas.get_replicas().first(
+        views.active_service_location, key=location, include_docs=True)
+    raise Return(_subresource(Service, row))
+
+
+def _getter(cls):
+    """
+    cls.get, or the equivalent read from the backend or the replicas if
+    configured
+    """
+    backend = backends.get_backend()
+    if backend is not None:
+        return partial(backend.get, cls)
+    elif replicas.get_replicas() is None:
+        return cls.get
+
+    return partial(_replica_get, cls)
+
+
+def _from_snapshot(resource_id, resource_type=None):
+    current = snapshot.current()
+    if current is None:
+        return None
+
+    return current.get(resource_id, resource_type)
+
+
+def _stale():
+    stale = getattr(options, 'view_stale', None)
+    return stale if stale in STALE else None
+
+
+@coroutine
+def read_view(query, **kwargs):
+    """
+    Query a view using the `view_stale` consistency mode, falling back to a
+    consistent read if the stale read raises NotFound
+
+    :param query: a coroutine that queries the view, e.g. a View's `first`
+    :param kwargs: the query parameters
+    :raises: couch.NotFound
+    """
+    stale = _stale()
+    if stale:
+        try:
+            result = yield query(stale=stale, **kwargs)
+        except couch.NotFound:
+            metrics.increment('view_reads.stale_not_found')
+        else:
+            metrics.increment('view_reads.stale')
+            raise Return(result)
+
+    result = yield query(**kwargs)
+    metrics.increment('view_reads.consistent')
+
+    raise Return(result)
+
+
+def _use_view(client):
+    return (client is not None and
+            getattr(options, 'authorization_view', False) and
+            backends.get_backend() is None)
+
+
+def _record_from_rows(resource_id, rows):
+    """
+    Create a snapshot record from auth_resource_access rows
+
+    The record only contains the permissions included in the rows
+    """
+    try:
+        details = next(x['value'] for x in rows if x['key'][0] == 'resource')
+    except StopIteration:
+        raise exceptions.NotFound()
+
+    parent = snapshot.Organisation({'_id': details['organisation_id'],
+                                    'state': details['organisation_state']})
+    details['permissions'] = [
+        {'type': x['key'][0], 'value': x['key'][1], 'permission': x['value']}
+        for x in rows if x['key'][0] != 'resource']
+    if details['type'] == Service.resource_type:
+        return snapshot.Service(parent, resource_id, details)
+    else:
+        return snapshot.Repository(parent, resource_id, details)
+
+
+@coroutine
+def get_with_view(client, resource_id, resource_type=None,
+                  request_deadline=None):
+    """
+    Get an active service or repository, including the resource permissions
+    that apply to the client, using one query
+
+    :param client: the client that will be authorized to access the resource
+    :param resource_id: the resource ID
+    :param resource_type: (optional) the expected resource type
+    :param request_deadline: (optional) the request's Deadline
+    :returns: a snapshot record
+    :raises: couch.NotFound
+    """
+    keys = [
+        ['resource', None, resource_id],
+        ['organisation_id', client.organisation_id, resource_id],
+        ['service_type', client.service_type, resource_id],
+        ['all', None, resource_id]
+    ]
+
+    @coroutine
+    def query(**kwargs):
+        pool = replicas.get_replicas()
+        if pool is None:
+            result = yield auth_resource_access.get(keys=keys, **kwargs)
+        else:
+            result = yield pool.get(auth_resource_access, keys=keys, **kwargs)
+        raise Return(_record_from_rows(resource_id, result['rows']))
+
+    key = ('view', resource_id, client.organisation_id, client.service_type)
+    resource = yield _lookup(key, request_deadline, read_view, query)
+
+    if resource_type and resource.resource_type != resource_type:
+        raise exceptions.NotFound()
+
+    raise Return(resource)
+
+
+@coroutine
+def get_service(service_id, client=None, request_deadline=None):
+    """
+    Get an active service
+
+    :param service_id: the service ID
+    :param client: (optional) the client that will be authorized to access
+        the service
+    :param request_deadline: (optional) the request's Deadline
+    :raises: couch.NotFound
+    """
+    service = _from_snapshot(service_id, Service.resource_type)
+    if service is None:
+        if _use_view(client):
+            service = yield get_with_view(client, service_id,
+                                          Service.resource_type,
+                                          request_deadline)
+        else:
+            service = yield _lookup(('service', service_id), request_deadline,
+                                    _getter(Service), service_id)
+
+    raise Return(service)
+
+
+@coroutine
+def get_repository(repository_id, client=None, request_deadline=None):
+    """
+    Get an active repository
+
+    :param repository_id: the repository ID
+    :param client: (optional) the client that will be authorized to access
+        the repository
+    :param request_deadline: (optional) the request's Deadline
+    :raises: couch.NotFound
+    """
+    repository = _from_snapshot(repository_id, Repository.resource_type)
+    if repository is None:
+        if _use_view(client):
+            repository = yield get_with_view(client, repository_id,
+                                             Repository.resource_type,
+                                             request_deadline)
+        else:
+            repository = yield _lookup(('repository', repository_id),
+                                       request_deadline,
+                                       _getter(Repository), repository_id)
+
+    raise Return(repository)
+
+
+@coroutine
+def get_resource(resource_id, client=None, request_deadline=None):
+    """
+    Get an active service or repository using its ID
+
+    The resource's parent is not populated unless the resource is a snapshot
+    record or was read from the replicas, use `get_parent` to get the parent.
+
+    :param resource_id: the resource ID
+    :param client: (optional) the client that will be authorized to access
+        the resource
+    :param request_deadline: (optional) the request's Deadline
+    :raises: couch.NotFound
+    """
+    resource = _from_snapshot(resource_id)
+    if resource is None:
+        backend = backends.get_backend()
+        if _use_view(client):
+            resource = yield get_with_view(
+                client, resource_id, request_deadline=request_deadline)
+        elif backend is not None:
+            resource = yield _lookup(('resource', resource_id),
+                                     request_deadline, backend.get_resource,
+                                     resource_id)
+        elif replicas.get_replicas() is None:
+            query = partial(read_view, views.service_and_repository.first,
+                            key=resource_id)
+            doc = yield _lookup(('resource', resource_id), request_deadline,
+                                query)
+            resource = RESOURCE_TYPES[doc['value']['type']](**doc['value'])
+        else:
+            first = partial(replicas.get_replicas().first,
+                            views.service_and_repository)
+            query = partial(read_view, first, key=resource_id,
+                            include_docs=True)
+            doc = yield _lookup(('resource', resource_id), request_deadline,
+                                query)
+            resource = _subresource(RESOURCE_TYPES[doc['value']['type']], doc)
+
+    raise Return(resource)
+
+
+@coroutine
+def get_parent(resource, request_deadline=None):
+    """
+    Get a service or repository's organisation, populating the resource's
+    parent
+
+    :param resource: the service or repository
+    :param request_deadline: (optional) the request's Deadline
+    :raises: couch.NotFound
+    """
+    if resource.parent is None:
+        # perch resources keep their parent in _parent, get_parent isn't
+        # called if the last-known-good organisation is used
+        resource._parent = yield _lookup(
+            ('organisation', resource.parent_id), request_deadline,
+            resource.get_parent)
+
+    raise Return(resource.parent)
+
+
+@coroutine
+def get_service_by_location(location, request_deadline=None):
+    """
+    Get an active service using its location
+
+    :param request_deadline: (optional) the request's Deadline
+
+    :raises: couch.NotFound
+    """
+    current = snapshot.current()
+    service = current.get_by_location(location) if current else None
+    if service is None:
+        backend = backends.get_backend()
+        if backend is not None:
+            func = backend.get_by_location
+        elif replicas.get_replicas() is None:
+            func = Service.get_by_location
+        else:
+            func = _replica_get_by_location
+        service = yield _lookup(('location', location), request_deadline,
+                                func, location)
+
+    raise Return(service)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Read replicas
+-------------
+
+When `registry_replicas` lists CouchDB URLs, registry view reads are sent to
+the replica with the lowest observed latency instead of `url_registry_db`.
+
+If a read hasn't returned after the `replica_hedge_percentile` latency of
+recent reads, a second "hedged" read is sent to the next replica and the
+first response is used. A replica that fails is skipped for the request and
+penalised, so it is tried again later once the other replicas slow down.
+"""
+import json
+import sys
+import time
+from collections import deque
+from urllib import urlencode
+
+import couch
+from perch import exceptions
+from tornado.concurrent import Future
+from tornado.gen import coroutine, Return
+from tornado.httpclient import AsyncHTTPClient, HTTPError, HTTPRequest
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+from . import metrics, tracing
+
+# weight of the latest latency in a replica's moving average
+ALPHA = 0.2
+# latency recorded for a replica that fails
+FAILURE_LATENCY = 1.0
+# number of latencies used to calculate the hedge delay
+WINDOW = 200
+# latencies needed before using the percentile as the hedge delay
+MIN_SAMPLES = 20
+
+_replicas = None
+
+
+def _encode(query):
+    """Encode view query parameters, which are JSON except for "stale" """
+    return urlencode({k: v if k == 'stale' else json.dumps(v)
+                      for k, v in query.items()})
+
+
+class Replicas(object):
+    """
+    :param urls: the replicas' URLs, including the port
+    :param percentile: latency percentile after which a read is hedged
+    :param hedge_delay: seconds before hedging until there are enough
+        latencies to calculate the percentile
+    """
+
+    def __init__(self, urls, percentile=95, hedge_delay=0.05):
+        self.urls = [x.rstrip('/') for x in urls]
+        self.percentile = percentile
+        self.default_hedge_delay = hedge_delay
+        self.latency = dict.fromkeys(self.urls, 0.0)
+        self._latencies = deque(maxlen=WINDOW)
+
+    def ordered(self):
+        """The replicas' URLs, fastest first"""
+        return sorted(self.urls, key=self.latency.get)
+
+    def hedge_delay(self):
+        """Seconds to wait for a read before sending a hedged read"""
+        if len(self._latencies) < MIN_SAMPLES:
+            return self.default_hedge_delay
+
+        latencies = sorted(self._latencies)
+        index = int(len(latencies) * self.percentile / 100.0)
+        return latencies[min(index, len(latencies) - 1)]
+
+    def record(self, url, latency, failed=False):
+        """Record a read's latency"""
+        if failed:
+            latency = max(latency, FAILURE_LATENCY)
+        else:
+            self._latencies.append(latency)
+
+        self.latency[url] = ALPHA * latency + (1 - ALPHA) * self.latency[url]
+
+    @coroutine
+    def _attempt(self, url, path, body):
+        """
+        Read from one replica
+
+        :raises: couch.CouchException if the replica responded with an error,
+            other exceptions if the replica is unavailable
+        """
+        # continue the request's trace, if it's traced
+        headers = tracing.headers()
+        if body is None:
+            request = HTTPRequest(url + path, headers=headers)
+        else:
+            headers['Content-Type'] = 'application/json'
+            request = HTTPRequest(url + path, method='POST', body=body,
+                                  headers=headers)
+
+        start = time.time()
+        try:
+            response = yield AsyncHTTPClient().fetch(request)
+        except HTTPError as exc:
+            failed = exc.code == 599 or exc.code >= 500
+            self.record(url, time.time() - start, failed)
+            if failed:
+                raise
+            elif exc.code == 404:
+                raise couch.NotFound(exc)
+            else:
+                raise couch.CouchException(exc)
+        except Exception:
+            self.record(url, time.time() - start, True)
+            raise
+
+        self.record(url, time.time() - start)
+        raise Return(json.loads(response.body))
+
+    def fetch(self, path, body=None):
+        """
+        Read from the fastest replica, hedging if it's slow & failing over
+        to the next replica if it fails
+
+        :param path: the path, including the query string
+        :param body: (optional) JSON body, sent using POST
+        :returns: a Future resolving to the decoded response
+        """
+        io_loop = IOLoop.current()
+        result = Future()
+        urls = self.ordered()
+        state = {'next': 0, 'pending': 0, 'timeout': None}
+
+        def start():
+            if state['next'] >= len(urls):
+                return False
+
+            url = urls[state['next']]
+            state['next'] += 1
+            state['pending'] += 1
+            metrics.increment('replicas.reads')
+            io_loop.add_future(self._attempt(url, path, body), finished)
+            return True
+
+        def hedge():
+            if not result.done() and start():
+                metrics.increment('replicas.hedged')
+
+        def finished(future):
+            state['pending'] -= 1
+            if result.done():
+                return
+
+            try:
+                response = future.result()
+            except couch.CouchException:
+                result.set_exc_info(sys.exc_info())
+            except Exception:
+                metrics.increment('replicas.failed')
+                exc_info = sys.exc_info()
+                if not start() and not state['pending']:
+                    result.set_exc_info(exc_info)
+                return
+            else:
+                result.set_result(response)
+
+            if state['timeout'] is not None:
+                io_loop.remove_timeout(state['timeout'])
+
+        start()
+        if len(urls) > 1:
+            state['timeout'] = io_loop.call_later(self.hedge_delay(), hedge)
+
+        return result
+
+    @coroutine
+    def get(self, view, **query):
+        """
+        Query a view, like perch's View.get
+
+        :param view: a perch View
+        :param query: the query parameters
+        """
+        keys = query.pop('keys', None)
+        body = None if keys is None else json.dumps({'keys': keys})
+        path = '/{0}/_design/{1}/_view/{1}'.format(view.db_name, view.name)
+        if query:
+            path += '?' + _encode(query)
+
+        result = yield self.fetch(path, body)
+        raise Return(result)
+
+    @coroutine
+    def first(self, view, **query):
+        """
+        Get a view's first row, like perch's View.first
+
+        :raises: perch.exceptions.NotFound
+        """
+        result = yield self.get(view, **query)
+        if not result['rows']:
+            raise exceptions.NotFound()
+
+        raise Return(result['rows'][0])
+
+
+def get_replicas():
+    """The read replicas, None if `registry_replicas` is not configured"""
+    global _replicas
+
+    urls = getattr(options, 'registry_replicas', None)
+    if not urls:
+        return None
+
+    if _replicas is None:
+        _replicas = Replicas(
+            urls,
+            float(getattr(options, 'replica_hedge_percentile', 95)),
+            float(getattr(options, 'replica_hedge_delay', 0.05)))
+
+    return _replicas
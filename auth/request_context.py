@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Request context
+---------------
+
+Per-request counters, e.g. the number of CouchDB requests & cache hits, for
+the slow request log.
+
+The context is carried across callbacks & coroutines using a tornado
+StackContext, so code deep in the call stack can count events without being
+passed the request:
+
+    context = RequestContext()
+    with request_context.activate(context):
+        ...
+    request_context.increment('couch.requests')
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+
+from tornado.stack_context import StackContext
+
+# request arguments & headers that are not logged
+SENSITIVE = frozenset(['assertion', 'authorization', 'client_secret', 'code',
+                       'password', 'refresh_token', 'token'])
+REDACTED = '[redacted]'
+
+_local = threading.local()
+
+
+class RequestContext(object):
+    """Counters for a request, and its trace if it's traced"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.trace = None
+
+
+def current():
+    """The active request's context, None outside of a request"""
+    return getattr(_local, 'context', None)
+
+
+@contextmanager
+def _switch(context):
+    previous = current()
+    _local.context = context
+    try:
+        yield
+    finally:
+        _local.context = previous
+
+
+def activate(context):
+    """
+    Make a context active for a block & the callbacks it schedules
+
+    :param context: a RequestContext
+    :returns: a StackContext
+    """
+    return StackContext(partial(_switch, context))
+
+
+def increment(name, value=1):
+    """Increment one of the active request's counters"""
+    context = current()
+    if context is not None:
+        context.counters[name] += value
+
+
+@contextmanager
+def timed(name):
+    """Add the time taken by the block in milliseconds to a counter"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        increment(name, (time.time() - start) * 1000)
+
+
+def redact(values):
+    """
+    Redact sensitive values from a dict of request arguments or headers
+
+    :returns: a new dict
+    """
+    return {k: REDACTED if k.lower() in SENSITIVE else v
+            for k, v in values.items()}
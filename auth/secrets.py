@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Secrets
+-------
+
+The service's options are logged when it starts, so secrets aren't options.
+Each secret is read from a file named by an option instead, e.g. the
+warm-up client's secret is read from `warm_up_client_secret_file`. The file
+should only be readable by the service's user.
+"""
+import logging
+
+from tornado.options import options
+
+# the secrets read from files, the option naming the file has a "_file"
+# suffix
+SECRETS = (
+    'admin_token',
+    'capture_key',
+    'warm_up_client_secret',
+)
+
+
+def read(name):
+    """
+    Read a secret from the file named by its option
+
+    :param name: one of SECRETS
+    :returns: the secret without surrounding whitespace, or '' if the option
+        isn't set or the file can't be read
+    """
+    path = getattr(options, name + '_file', '')
+    if not path:
+        return ''
+
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except IOError as exc:
+        logging.warning('Unable to read %s: %s', name, exc)
+        return ''
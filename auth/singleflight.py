@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Coalesce concurrent identical lookups
+
+While a lookup is in flight, other requests for the same key wait on the
+same Future instead of starting another lookup. The result, or the
+exception, is shared by all waiters, so the result should not be modified.
+"""
+from tornado.ioloop import IOLoop
+
+from . import metrics
+
+
+class Group(object):
+    """
+    A group of in-flight lookups
+
+    :param name: the name used for the group's metrics
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call func, unless a call for the same key is in flight
+
+        :param key: a hashable key identifying the lookup
+        :param func: a coroutine
+        :returns: a Future
+        """
+        metrics.increment('{}.lookups'.format(self.name))
+
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.increment('{}.collapsed'.format(self.name))
+            return future
+
+        future = func(*args, **kwargs)
+        if not future.done():
+            self._calls[key] = future
+            IOLoop.current().add_future(
+                future, lambda f: self._forget(key, f))
+
+        return future
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
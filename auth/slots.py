@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Worker slots
+------------
+
+A worker's slot is its place among the service's processes, from 0 to
+processes - 1, e.g. only the worker in slot 0 saves the registry snapshot.
+
+The histograms, counters & RSS gauge are kept in shared memory, with a row
+for each worker. Workers started by tornado use their task ID as both their
+slot & row. Supervised workers are given them by the supervisor: a worker
+replacing another while reloading runs alongside it, so the supervisor uses
+twice as many rows as processes & gives the replacement a different row.
+"""
+from tornado import process
+
+_slot = None
+_row = None
+
+
+def configure(slot, row):
+    """Set the slot & row of a supervised worker"""
+    global _slot, _row
+
+    _slot = slot
+    _row = row
+
+
+def slot():
+    """The worker's slot, None if the service isn't forked"""
+    return _slot if _slot is not None else process.task_id()
+
+
+def row(rows):
+    """
+    The worker's row in shared memory
+
+    :param rows: the number of rows
+    """
+    current = _row if _row is not None else process.task_id() or 0
+    return current % rows
+
+
+def rows(processes, supervised=False):
+    """
+    The number of rows needed in shared memory
+
+    :param processes: the number of processes that will be started, 0 or
+        None for one per CPU
+    :param supervised: (optional) whether the workers are supervised
+    """
+    count = int(processes or process.cpu_count())
+    return count * 2 if supervised else count
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Registry snapshot
+-----------------
+
+When the `snapshot` option is enabled the organisations, services and
+repositories in the registry are loaded into memory before the service forks
+its workers, so the snapshot is shared copy-on-write by the workers.
+
+Each resource is held in a compact record containing only the fields used to
+authorize requests. The snapshot is saved to `snapshot_file` so that a
+restart loads the snapshot from the file instead of the registry. Each worker
+then keeps its copy up to date by following the registry's changes feed.
+"""
+import cPickle as pickle
+import json
+import logging
+import os
+from urllib import urlencode
+
+from perch import State
+from perch.organisation import group_permissions
+from tornado.gen import coroutine, Return
+from tornado.httpclient import AsyncHTTPClient, HTTPClient
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.options import options
+
+from . import slots
+
+# increment if the records change, so that old snapshot files are ignored
+VERSION = 1
+EMPTY = frozenset()
+
+_snapshot = None
+_polling = False
+_listeners = []
+
+
+def compile_permissions(permissions):
+    """
+    Group a resource's permissions for checking access
+
+    :param permissions: list of permission dicts
+    :returns: (organisation permissions, service type permissions,
+        all permission) where the organisation & service type permissions are
+        dictionaries of frozen sets.
+    """
+    groups = group_permissions(permissions)
+    return (
+        {k: frozenset(v) for k, v in groups['organisation_id'].items()},
+        {k: frozenset(v) for k, v in groups['service_type'].items()},
+        frozenset(groups['all'])
+    )
+
+
+class Organisation(object):
+    """An organisation record"""
+    __slots__ = ('id', 'state')
+    resource_type = 'organisation'
+
+    def __init__(self, doc):
+        self.id = doc['_id']
+        self.state = State[doc.get('state', State.pending.name)]
+
+
+class Resource(object):
+    """
+    A service or repository record
+
+    Implements the parts of perch's SubResource interface used by the auth
+    service
+    """
+    __slots__ = ('id', 'parent', 'grouped_permissions', '_state')
+    resource_type = None
+
+    def __init__(self, parent, resource_id, resource):
+        self.id = resource_id
+        self.parent = parent
+        self.grouped_permissions = compile_permissions(
+            resource.get('permissions', []))
+        self._state = State[resource.get('state', State.pending.name)]
+
+    @property
+    def type(self):
+        return self.resource_type
+
+    @property
+    def organisation_id(self):
+        return self.parent.id
+
+    @property
+    def state(self):
+        """The record's state, overridden by the parent's state"""
+        return max([self._state, self.parent.state],
+                   key=lambda x: x.value)
+
+    @property
+    def permissions(self):
+        """The permissions, in the format stored in the registry"""
+        org, service_type, everyone = self.grouped_permissions
+        permissions = [{'type': 'all', 'permission': x} for x in everyone]
+        for permission_type, groups in [('organisation_id', org),
+                                        ('service_type', service_type)]:
+            for value, permission_set in groups.items():
+                permissions.extend({'type': permission_type, 'value': value,
+                                    'permission': x} for x in permission_set)
+
+        return permissions
+
+    @coroutine
+    def get_parent(self):
+        raise Return(self.parent)
+
+
+class Service(Resource):
+    """A service record"""
+    __slots__ = ('service_type', 'location')
+    resource_type = 'service'
+
+    def __init__(self, parent, resource_id, resource):
+        super(Service, self).__init__(parent, resource_id, resource)
+        self.service_type = resource.get('service_type')
+        self.location = resource.get('location')
+
+    def authorized(self, requested_access, resource):
+        """
+        Check whether the service is authorized to access a resource, using
+        the same rules as perch.Service.authorized
+
+        :param requested_access: "r", "w", or "rw"
+        :param resource: a record or a perch resource
+        :returns: True if has access, False otherwise
+        """
+        if {self.state, resource.state} != {State.approved}:
+            return False
+
+        try:
+            org, service_type, everyone = resource.grouped_permissions
+        except AttributeError:
+            org, service_type, everyone = compile_permissions(
+                getattr(resource, 'permissions', []))
+
+        for permission_set in [org.get(self.organisation_id, EMPTY),
+                               service_type.get(self.service_type, EMPTY),
+                               everyone]:
+            if '-' in permission_set:
+                return False
+            elif set(requested_access).issubset(permission_set):
+                return True
+
+        return False
+
+
+class Repository(Resource):
+    """A repository record"""
+    __slots__ = ('service_id',)
+    resource_type = 'repository'
+
+    def __init__(self, parent, resource_id, resource):
+        super(Repository, self).__init__(parent, resource_id, resource)
+        self.service_id = resource.get('service_id')
+
+
+class Snapshot(object):
+    """The registry's organisations, services & repositories"""
+
+    def __init__(self):
+        self.sequence = 0
+        self.organisations = {}
+        self.resources = {}
+        self.locations = {}
+        self._children = {}
+
+    def __len__(self):
+        return len(self.resources)
+
+    def remove_document(self, doc_id):
+        """Remove an organisation and its services & repositories"""
+        self.organisations.pop(doc_id, None)
+        for resource in self._children.pop(doc_id, []):
+            if self.resources.get(resource.id) is resource:
+                del self.resources[resource.id]
+            location = getattr(resource, 'location', None)
+            if self.locations.get(location) is resource:
+                del self.locations[location]
+
+    def add_document(self, doc):
+        """
+        Add or replace a registry document. Documents that are not
+        organisations are ignored
+
+        :returns: the list of added services & repositories
+        """
+        self.remove_document(doc['_id'])
+        if doc.get('type') != Organisation.resource_type:
+            return []
+
+        organisation = Organisation(doc)
+        self.organisations[organisation.id] = organisation
+
+        children = []
+        for key, cls in [('services', Service), ('repositories', Repository)]:
+            for resource_id, resource in doc.get(key, {}).items():
+                record = cls(organisation, resource_id, resource)
+                children.append(record)
+                self.resources[resource_id] = record
+                if getattr(record, 'location', None):
+                    self.locations[record.location] = record
+
+        self._children[organisation.id] = children
+
+        return children
+
+    def get(self, resource_id, resource_type=None):
+        """
+        Get an active service or repository
+
+        :param resource_id: the resource ID
+        :param resource_type: (optional) the expected resource type
+        :returns: a record, or None
+        """
+        record = self.resources.get(resource_id)
+        if record is None or record.state == State.deactivated:
+            return None
+        if resource_type and record.resource_type != resource_type:
+            return None
+
+        return record
+
+    def get_by_location(self, location):
+        """Get an active service by its location"""
+        record = self.locations.get(location)
+        if record is None or record.state == State.deactivated:
+            return None
+
+        return record
+
+    def apply_changes(self, changes):
+        """
+        Apply a response from the registry's changes feed
+
+        :param changes: a decoded _changes response
+        :returns: number of changes applied
+        """
+        results = changes.get('results', [])
+        added = []
+        removed = []
+        for change in results:
+            removed.extend(x.id for x in self._children.get(change['id'], []))
+            if change.get('deleted'):
+                self.remove_document(change['id'])
+            elif 'doc' in change:
+                added.extend(self.add_document(change['doc']))
+
+        self.sequence = changes.get('last_seq', self.sequence)
+        if results:
+            _notify(added, removed)
+
+        return len(results)
+
+    def dump(self, path):
+        """Save the snapshot to a file"""
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump((VERSION, self), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a snapshot from a file
+
+        :raises: IOError, ValueError if the file can't be used
+        """
+        with open(path, 'rb') as f:
+            try:
+                version, snapshot = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError, AttributeError,
+                    ImportError, TypeError) as exc:
+                raise ValueError('Invalid snapshot file: {}'.format(exc))
+
+        if version != VERSION:
+            raise ValueError('Snapshot version {} is not {}'
+                             .format(version, VERSION))
+
+        return snapshot
+
+
+def subscribe(listener):
+    """
+    Call a function when resources are added or removed from the snapshot
+
+    :param listener: function accepting lists of added records and removed
+        resource IDs
+    """
+    _listeners.append(listener)
+
+
+def _notify(added, removed):
+    for listener in _listeners:
+        listener(added, removed)
+
+
+def changes_url(since=0):
+    """The URL for the registry's changes feed"""
+    db_url = ':'.join([options.url_registry_db, str(options.db_port)])
+    query = urlencode({'since': json.dumps(since), 'include_docs': 'true'})
+    return '{}/registry/_changes?{}'.format(db_url, query)
+
+
+def load_registry():
+    """Load a snapshot from the registry. Blocks until loaded"""
+    snapshot = Snapshot()
+    response = HTTPClient().fetch(changes_url(),
+                                  request_timeout=options.snapshot_timeout)
+    snapshot.apply_changes(json.loads(response.body))
+
+    return snapshot
+
+
+def current():
+    """The current snapshot, None if the snapshot is not enabled"""
+    return _snapshot
+
+
+def preload():
+    """
+    Load the snapshot, from the snapshot file if it exists, otherwise from
+    the registry.
+
+    Should be called before forking so the snapshot is shared copy-on-write
+    """
+    global _snapshot
+
+    if not getattr(options, 'snapshot', False):
+        return
+
+    path = options.snapshot_file
+    try:
+        _snapshot = Snapshot.load(path)
+    except (IOError, ValueError) as exc:
+        logging.warning('Unable to load snapshot file: %s', exc)
+    else:
+        logging.info('Loaded %s resources from %s', len(_snapshot), path)
+        _notify(_snapshot.resources.values(), [])
+        return
+
+    # listeners are notified when the changes are applied
+    _snapshot = load_registry()
+    logging.info('Loaded %s resources from the registry', len(_snapshot))
+    _save()
+
+
+def _save():
+    try:
+        _snapshot.dump(options.snapshot_file)
+    except (IOError, OSError) as exc:
+        logging.warning('Unable to save snapshot file: %s', exc)
+
+
+@coroutine
+def catch_up():
+    """
+    Apply changes since the snapshot was taken
+
+    :returns: number of changes applied
+    """
+    if _snapshot is None:
+        raise Return(0)
+
+    response = yield AsyncHTTPClient().fetch(
+        changes_url(_snapshot.sequence),
+        request_timeout=options.snapshot_timeout)
+    applied = _snapshot.apply_changes(json.loads(response.body))
+
+    # only one worker saves the snapshot file
+    if applied and slots.slot() in (None, 0):
+        _save()
+
+    raise Return(applied)
+
+
+@coroutine
+def _poll():
+    global _polling
+
+    if _polling:
+        return
+
+    _polling = True
+    try:
+        yield catch_up()
+    except Exception:
+        logging.exception('Unable to update the registry snapshot')
+    finally:
+        _polling = False
+
+
+def follow():
+    """Follow the registry's changes feed. Call once in each worker"""
+    if _snapshot is None:
+        return
+
+    IOLoop.current().add_callback(_poll)
+    PeriodicCallback(_poll, options.snapshot_poll_interval * 1000).start()
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Supervisor
+----------
+
+Runs the service's workers under a supervisor process when `supervisor` is
+enabled:
+
+    - each worker binds the port using SO_REUSEPORT, so workers can be
+      replaced without closing the listening socket
+    - a worker that exits unexpectedly is respawned
+    - SIGHUP restarts the workers one at a time, each new worker re-reads
+      local.conf & warms up before the worker it replaces is stopped. The
+      supervisor keeps reaping workers & handling signals while it waits
+    - SIGTERM or SIGINT stops the workers, which stop accepting connections
+      & finish their in-flight requests before exiting
+    - workers may be pinned to a CPU core
+
+The caches & registry snapshot are created by the supervisor before forking,
+so they are kept when workers are restarted. Each worker has a slot & a row
+in the shared histograms, counters & RSS gauge (see `auth.slots`). A worker
+started while reloading has the same slot as the worker it replaces, but a
+different row, so both can run at once. An exited worker's RSS & gauges
+are cleared.
+
+To deploy a new version, start a new supervisor then send SIGTERM to the
+old one, both accept connections until the old supervisor's workers have
+stopped.
+"""
+import errno
+import logging
+import os
+import select
+import signal
+import time
+from functools import partial
+
+from koi import configure
+from tornado import process
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
+from tornado.options import options
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from . import (admission, capture, fairqueue, memory, metrics, profiler,
+               slots, snapshot, tracing, warmup)
+
+# seconds between checking for signals, exited workers & ready replacements
+POLL_INTERVAL = 0.2
+# workers exiting sooner than this after starting are respawned after a delay
+MIN_UPTIME = 5
+
+
+class Worker(object):
+    """A worker process"""
+    __slots__ = ('pid', 'slot', 'row', 'started', 'ready_fd')
+
+    def __init__(self, pid, slot, row, ready_fd):
+        self.pid = pid
+        self.slot = slot
+        self.row = row
+        self.started = time.time()
+        self.ready_fd = ready_fd
+
+
+class Supervisor(object):
+    """
+    :param target: function run in each worker, called with the worker's
+        slot, row & a file descriptor to write to when the worker is ready
+    :param processes: number of workers
+    :param ready_timeout: (optional) seconds to wait for a new worker to be
+        ready when reloading
+    :param respawn_delay: (optional) seconds to wait before respawning a
+        worker that exited soon after starting
+    """
+
+    def __init__(self, target, processes, ready_timeout=60, respawn_delay=1):
+        self.target = target
+        self.processes = processes
+        self.rows = slots.rows(processes, supervised=True)
+        self.ready_timeout = ready_timeout
+        self.respawn_delay = respawn_delay
+        self.workers = {}
+        self.stopping = set()
+        self.running = False
+        self._signals = []
+        # pids of workers waiting to be replaced
+        self._pending = []
+        # (replacement pid, replaced Worker, time the replacement must be
+        # ready by) of the worker being replaced
+        self._replacing = None
+
+    @property
+    def reloading(self):
+        return bool(self._pending or self._replacing)
+
+    def free_row(self, slot):
+        """A row that isn't used by a running worker"""
+        used = set(x.row for x in self.workers.values())
+        for row in range(self.rows):
+            if row not in used:
+                return row
+
+        # only if workers are still stopping after more than one reload
+        logging.warning('No free row for worker %s, sharing row %s', slot,
+                        slot)
+        return slot
+
+    def spawn(self, slot):
+        """
+        Fork a worker
+
+        :returns: the worker's pid
+        """
+        row = self.free_row(slot)
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 0
+            try:
+                self.target(slot, row, write_fd)
+            except Exception:
+                logging.exception('Worker %s failed', slot)
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(write_fd)
+        self.workers[pid] = Worker(pid, slot, row, read_fd)
+        logging.info('Started worker %s (pid %s, row %s)', slot, pid, row)
+
+        return pid
+
+    def ready(self, pid):
+        """
+        Check whether a worker is ready, without waiting
+
+        :returns: True if the worker is ready, False if it exited before it
+            was ready, None if it isn't ready yet
+        """
+        worker = self.workers.get(pid)
+        if worker is None:
+            return False
+
+        try:
+            readable, _, _ = select.select([worker.ready_fd], [], [], 0)
+        except select.error as exc:
+            if exc.args[0] == errno.EINTR:
+                return None
+            raise
+
+        if not readable:
+            return None
+
+        # nothing is read if the worker exited before it was ready
+        return bool(os.read(worker.ready_fd, 1))
+
+    def terminate(self, pid):
+        """Ask a worker to stop, it will not be respawned"""
+        self.stopping.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError as exc:
+            if exc.errno != errno.ESRCH:
+                raise
+
+    def reload(self):
+        """
+        Start replacing the workers one at a time, the replacements are
+        started by `continue_reload`. Reloading again replaces every worker,
+        including those already replaced
+        """
+        logging.info('Reloading workers')
+        replaced = self._replacing[1].pid if self._replacing else None
+        self._pending = [
+            x.pid for x in sorted(self.workers.values(), key=lambda x: x.slot)
+            if x.pid not in self.stopping and x.pid != replaced]
+        self.continue_reload()
+
+    def continue_reload(self):
+        """
+        Stop the replaced worker once its replacement is ready, then start
+        the next replacement
+        """
+        if self._replacing is not None:
+            pid, replaced, ready_by = self._replacing
+            ready = self.ready(pid)
+            if ready is None and time.time() < ready_by:
+                return
+
+            self._replacing = None
+            if not ready:
+                logging.error('Worker %s (pid %s) was not ready, stopping '
+                              'the reload', replaced.slot, pid)
+                self._pending = []
+                if pid in self.workers:
+                    self.terminate(pid)
+                return
+
+            self.terminate(replaced.pid)
+
+        while self._pending:
+            worker = self.workers.get(self._pending.pop(0))
+            if worker is None or worker.pid in self.stopping:
+                continue
+
+            pid = self.spawn(worker.slot)
+            self._replacing = (pid, worker, time.time() + self.ready_timeout)
+            return
+
+    def stop(self):
+        """Stop all workers"""
+        logging.info('Stopping workers')
+        self.running = False
+        self._pending = []
+        self._replacing = None
+        for pid in list(self.workers):
+            self.terminate(pid)
+
+    def reap(self):
+        """Collect exited workers, respawning unexpectedly exited workers"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                elif exc.errno == errno.ECHILD:
+                    return
+                raise
+
+            if pid == 0:
+                return
+
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+
+            os.close(worker.ready_fd)
+            memory.get_gauge().clear(worker.row)
+            metrics.get_shared().clear_gauges(worker.row)
+            fairqueue.get_gauges().clear(worker.row)
+            if pid in self.stopping:
+                self.stopping.discard(pid)
+                continue
+            elif not self.running:
+                continue
+            elif self._replacing and pid == self._replacing[0]:
+                # the reload is stopped by continue_reload
+                continue
+
+            logging.warning('Worker %s (pid %s) exited with status %s, '
+                            'respawning', worker.slot, pid, status)
+            if time.time() - worker.started < MIN_UPTIME:
+                time.sleep(self.respawn_delay)
+            self.spawn(worker.slot)
+
+    def _on_signal(self, name, signum, frame):
+        self._signals.append(name)
+
+    def run(self):
+        """Start the workers & supervise them until they have all stopped"""
+        self.running = True
+        for slot in range(self.processes):
+            self.spawn(slot)
+
+        signal.signal(signal.SIGHUP, partial(self._on_signal, 'reload'))
+        signal.signal(signal.SIGTERM, partial(self._on_signal, 'stop'))
+        signal.signal(signal.SIGINT, partial(self._on_signal, 'stop'))
+
+        while self.workers:
+            while self._signals:
+                name = self._signals.pop(0)
+                if name == 'stop':
+                    self.stop()
+                elif name == 'reload' and self.running:
+                    self.reload()
+
+            self.continue_reload()
+            self.reap()
+            time.sleep(POLL_INTERVAL)
+
+
+def pin_to_cpu(slot):
+    """Pin the current process to a CPU core, using the worker's slot"""
+    cpu = slot % process.cpu_count()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, [cpu])
+    elif psutil is not None:
+        psutil.Process().cpu_affinity([cpu])
+    else:
+        logging.warning('Unable to pin worker %s to a CPU, psutil is not '
+                        'installed', slot)
+        return
+
+    logging.info('Pinned worker %s to CPU %s', slot, cpu)
+
+
+def reload_config(conf_dir):
+    """Re-read local.conf, keeping options set on the command line"""
+    local_conf = os.path.join(conf_dir, 'local.conf')
+    if os.path.isfile(local_conf):
+        options.parse_config_file(local_conf, final=False)
+    options.parse_command_line(final=False)
+
+
+def drain(server, timeout):
+    """
+    Stop accepting connections, then stop the IOLoop once the in-flight
+    requests have finished or the timeout has passed
+    """
+    server.stop()
+    io_loop = IOLoop.current()
+    stop_at = time.time() + timeout
+
+    def check():
+        if not admission.get_controller().total or time.time() >= stop_at:
+            io_loop.stop()
+
+    PeriodicCallback(check, POLL_INTERVAL * 1000).start()
+
+
+def run_worker(application, conf_dir, slot, row, ready_fd):
+    """Serve the application in a worker process"""
+    slots.configure(slot, row)
+
+    reload_config(conf_dir)
+    if getattr(options, 'cpu_affinity', False):
+        pin_to_cpu(slot)
+
+    ssl_options = configure.ssl_server_options() if options.use_ssl else None
+    server = HTTPServer(application, ssl_options=ssl_options)
+    server.add_sockets(bind_sockets(options.port, options.ip,
+                                    reuse_port=True))
+
+    def on_ready():
+        os.write(ready_fd, '1')
+        os.close(ready_fd)
+
+    io_loop = IOLoop.current()
+    stop = partial(io_loop.add_callback_from_signal, drain, server,
+                   float(getattr(options, 'worker_drain_timeout', 10)))
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop())
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    profiler.install_signal_handler()
+    memory.start_rss_gauge()
+    fairqueue.start()
+    capture.start()
+    tracing.start()
+
+    warmup.subscribe(on_ready)
+    snapshot.follow()
+    warmup.start()
+
+    io_loop.start()
+    # keep the requests captured & spans finished since the last write
+    capture.flush()
+    tracing.flush()
+
+
+def configure_logging():
+    """Configure logging, done by koi.make_server when not supervised"""
+    configure.configure_syslog()
+    configure.log_config()
+
+
+def run(application, conf_dir):
+    """Run the application's workers under a supervisor"""
+    processes = int(options.processes) or process.cpu_count()
+    supervisor = Supervisor(
+        partial(run_worker, application, conf_dir),
+        processes,
+        float(getattr(options, 'worker_ready_timeout', 60)))
+    supervisor.run()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Tracing
+-------
+
+Records how long the stages of a request take, as spans of a trace, e.g.
+
+    POST /v1/auth/token
+        prepare
+            registry.authenticate
+        fair_queue
+        grant
+            scope.validate
+                registry.service
+                registry.repository
+
+Tracing is enabled by the `tracing` option. A share of requests
+(`tracing_sample_rate`) is traced, so the overhead at full load stays small,
+e.g. under 1% with the default rate. The decision can be made by the caller
+using Zipkin's B3 headers: a request with `X-B3-Sampled: 0` isn't traced,
+and a request with `X-B3-Sampled: 1` is traced, up to `tracing_forced_rate`
+requests a second in each worker, so callers can't make every request be
+traced. Past the limit, requests are sampled as usual. A trace continues the
+caller's trace if the request has the `X-B3-TraceId` & `X-B3-SpanId`
+headers, and the trace ID is returned in the `X-B3-TraceId` response header.
+The trace's headers are also sent with requests to the registry's read
+replicas.
+
+Spans are created with `span`, a context manager that does nothing outside
+of a traced request:
+
+    with tracing.span('scope.validate') as span:
+        span.tag(resources=3)
+
+A span's parent is the innermost unfinished span of the request, so spans
+for concurrent work are nested in each other unless they're opened as
+leaves, which are never parents.
+
+Each worker buffers the finished spans & exports them in batches every
+FLUSH_INTERVAL seconds. The `tracing_exporter` option selects the exporter:
+
+    - "file": appends the spans to `tracing_file` as JSON lines
+    - the dotted path of a class, e.g. "mypackage.tracing.ZipkinExporter"
+
+An exporter is created by calling its class's `from_options` method, and
+its `export(spans)` method is called with a list of span dicts.
+"""
+import importlib
+import json
+import logging
+import os
+import random
+import time
+
+from tornado.ioloop import PeriodicCallback
+from tornado.options import options
+
+from . import request_context
+
+TRACE_HEADER = 'X-B3-TraceId'
+SPAN_HEADER = 'X-B3-SpanId'
+SAMPLED_HEADER = 'X-B3-Sampled'
+
+# seconds between exporting the buffered spans
+FLUSH_INTERVAL = 1
+# maximum spans buffered before exporting
+BATCH_SIZE = 1000
+# requests a second traced because of the X-B3-Sampled header
+DEFAULT_FORCED_RATE = 10
+
+
+class RateLimit(object):
+    """
+    A token bucket, allowing `rate` events a second on average and bursts of
+    up to `rate` events
+
+    :param rate: events a second, 0 allows none
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.time()
+
+    def allow(self):
+        """Use a token, if there is one"""
+        now = time.time()
+        self.tokens = min(self.rate,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+_exporter = None
+_sample_rate = 0
+_forced = RateLimit(DEFAULT_FORCED_RATE)
+_spans = []
+
+
+def new_id():
+    """A random 64 bit ID, in hex"""
+    return '{:016x}'.format(random.getrandbits(64))
+
+
+class Span(object):
+    """
+    A stage of handling a request
+
+    :param trace: the Trace
+    :param parent_id: the parent span's ID, or None
+    :param name: the stage's name
+    """
+    __slots__ = ('trace', 'trace_id', 'span_id', 'parent_id', 'name', 'start',
+                 'duration', 'tags')
+
+    def __init__(self, trace, parent_id, name):
+        self.trace = trace
+        self.trace_id = trace.trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.tags = {}
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.tag(error=exc_type.__name__)
+        self.trace.finish(self)
+
+    def to_dict(self):
+        return {'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'name': self.name,
+                'start': round(self.start, 6),
+                'duration_ms': round(self.duration * 1000, 3),
+                'tags': self.tags}
+
+
+class NullSpan(object):
+    """The span used outside of a traced request"""
+
+    def tag(self, **tags):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Trace(object):
+    """
+    The spans of a traced request
+
+    :param name: the name of the request's span
+    :param trace_id: (optional) the caller's trace ID
+    :param parent_id: (optional) the caller's span ID
+    """
+
+    def __init__(self, name, trace_id=None, parent_id=None):
+        self.trace_id = trace_id or new_id()
+        self.root = Span(self, parent_id, name)
+        self.spans = [self.root]
+        # the unfinished spans that may be parents
+        self._open = [self.root]
+
+    @property
+    def current(self):
+        """The innermost unfinished span"""
+        return self._open[-1] if self._open else self.root
+
+    def start(self, name, leaf=False):
+        span = Span(self, self.current.span_id, name)
+        self.spans.append(span)
+        if not leaf:
+            self._open.append(span)
+
+        return span
+
+    def finish(self, span):
+        span.finish()
+        if span in self._open:
+            self._open.remove(span)
+
+    def headers(self):
+        """The B3 headers continuing the trace in another service"""
+        return {TRACE_HEADER: self.trace_id,
+                SPAN_HEADER: self.current.span_id,
+                SAMPLED_HEADER: '1'}
+
+
+def _sampled(headers):
+    """Whether to trace a request"""
+    sampled = headers.get(SAMPLED_HEADER)
+    if sampled is not None:
+        if sampled.lower() not in ('1', 'true'):
+            return False
+        elif _forced.allow():
+            return True
+
+    return random.random() < _sample_rate
+
+
+def start_trace(request):
+    """
+    Start tracing a request, if tracing is enabled & the request is sampled
+
+    :param request: the HTTP request
+    :returns: a Trace, or None
+    """
+    if _exporter is None or not _sampled(request.headers):
+        return None
+
+    return Trace('{} {}'.format(request.method, request.path),
+                 request.headers.get(TRACE_HEADER),
+                 request.headers.get(SPAN_HEADER))
+
+
+def finish_trace(trace, **tags):
+    """Finish a request's trace & buffer its spans for exporting"""
+    if trace is None:
+        return
+
+    trace.root.tag(**tags)
+    trace.finish(trace.root)
+    _spans.extend(x.to_dict() for x in trace.spans if x.duration is not None)
+    if len(_spans) >= BATCH_SIZE:
+        flush()
+
+
+def current_trace():
+    """The active request's trace, None if it's not traced"""
+    context = request_context.current()
+    return context.trace if context is not None else None
+
+
+def span(name, leaf=False):
+    """
+    A span of the active request's trace, used as a context manager around
+    the stage
+
+    :param name: the span's name
+    :param leaf: (optional) True if the span doesn't contain other spans
+    :returns: a started Span, or NULL_SPAN if the request isn't traced
+    """
+    trace = current_trace()
+    if trace is None:
+        return NULL_SPAN
+
+    return trace.start(name, leaf)
+
+
+def headers():
+    """The B3 headers for a request made while handling a traced request"""
+    trace = current_trace()
+    return trace.headers() if trace is not None else {}
+
+
+class FileExporter(object):
+    """
+    Appends spans to a file, one JSON object per line
+
+    :param path: the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_options(cls):
+        return cls(getattr(options, 'tracing_file', 'traces.jsonl'))
+
+    def export(self, spans):
+        data = ''.join(json.dumps(x, sort_keys=True) + '\n' for x in spans)
+        # a single write, so lines from different workers aren't interleaved
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+EXPORTERS = {
+    'file': FileExporter,
+}
+
+
+def _exporter_class(name):
+    """The exporter class for a name or dotted path"""
+    try:
+        return EXPORTERS[name]
+    except KeyError:
+        pass
+
+    module_name, _, class_name = name.rpartition('.')
+    if not module_name:
+        raise ValueError('Unknown tracing exporter "{}"'.format(name))
+
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def configure():
+    """Create the configured exporter, if tracing is enabled"""
+    global _exporter, _sample_rate, _forced
+
+    if not getattr(options, 'tracing', False):
+        _exporter = None
+        return
+
+    _exporter = _exporter_class(
+        getattr(options, 'tracing_exporter', 'file')).from_options()
+    _sample_rate = float(getattr(options, 'tracing_sample_rate', 0))
+    _forced = RateLimit(float(getattr(options, 'tracing_forced_rate',
+                                      DEFAULT_FORCED_RATE)))
+
+
+def flush():
+    """Export the buffered spans"""
+    global _spans
+
+    if not _spans or _exporter is None:
+        return
+
+    spans, _spans = _spans, []
+    try:
+        _exporter.export(spans)
+    except Exception:
+        logging.exception('Unable to export %s spans', len(spans))
+
+
+def start():
+    """Export the worker's spans periodically"""
+    if _exporter is not None:
+        PeriodicCallback(flush, FLUSH_INTERVAL * 1000).start()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+CouchDB views used by the auth service
+
+The views are registered with perch, so are installed by the
+`load_design_docs` command.
+
+NOTE: the map function source is saved in CouchDB, so it cannot depend on
+anything outside the function's scope.
+"""
+from perch.views import view
+
+
+@view('registry')
+def auth_resource_access(doc):
+    """
+    The permissions for active services and repositories, so a client's
+    access to a resource can be checked with a single query.
+
+    Emits a row for each resource:
+
+        ['resource', None, resource_id] -> the resource's details
+
+    and a row for each of the resource's permissions:
+
+        ['organisation_id', organisation_id, resource_id] -> permission
+        ['service_type', service_type, resource_id] -> permission
+        ['all', None, resource_id] -> permission
+    """
+    priority = ['approved', 'pending', 'rejected', 'deactivated']
+
+    def effective_state(*states):
+        states = [x if x in priority else 'pending' for x in states]
+        return max(states, key=priority.index)
+
+    org_state = doc.get('state')
+    if doc.get('type') == 'organisation' and org_state != 'deactivated':
+        for key in ['services', 'repositories']:
+            for resource_id, resource in doc.get(key, {}).items():
+                if resource.get('state') == 'deactivated':
+                    continue
+
+                yield ['resource', None, resource_id], {
+                    'type': 'service' if key == 'services' else 'repository',
+                    'organisation_id': doc['_id'],
+                    'organisation_state': effective_state(org_state),
+                    'state': effective_state(resource.get('state'), org_state),
+                    'service_type': resource.get('service_type'),
+                    'location': resource.get('location'),
+                    'service_id': resource.get('service_id'),
+                }
+
+                for permission in resource.get('permissions', []):
+                    value = permission.get('value')
+                    yield ([permission.get('type'), value, resource_id],
+                           permission.get('permission'))
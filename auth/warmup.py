@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+"""
+Worker warm-up
+--------------
+
+Workers start cold after forking, so each worker warms up before reporting
+that it's ready (see the /ready endpoint):
+
+    1. load the keys used to sign & verify tokens
+    2. open connections to CouchDB
+    3. look up the warm-up client & resources in the registry, priming the
+       caches
+    4. generate & verify a token
+
+A step that fails is logged and the worker continues warming up. The worker
+is ready once all steps have run, or `warm_up_timeout` has passed, because a
+cold worker is better than none.
+"""
+import logging
+import time
+
+import couch
+import perch
+from tornado.gen import coroutine, maybe_future, Return
+from tornado.ioloop import IOLoop
+from tornado.options import options
+
+from . import deadline, metrics, pool, registry, secrets
+from .oauth2 import token
+
+# the client used for the synthetic token if there's no warm-up client
+SYNTHETIC_CLIENT = {
+    'id': 'warm-up',
+    'service_type': 'warm-up',
+    'organisation_id': 'warm-up'
+}
+
+_ready = False
+_duration = None
+_listeners = []
+
+
+def is_ready():
+    """Whether the worker has warmed up"""
+    return _ready
+
+
+def duration():
+    """Seconds taken to warm up, None if the worker is not ready"""
+    return _duration
+
+
+def subscribe(listener):
+    """
+    Call a function when the worker is ready
+
+    :param listener: function accepting no arguments
+    """
+    _listeners.append(listener)
+
+
+def _set_ready():
+    global _ready
+
+    _ready = True
+    for listener in _listeners:
+        listener()
+
+
+def load_keys():
+    token.signing_key()
+    token.verification_key()
+
+
+@coroutine
+def prime_registry(request_deadline=None):
+    """
+    Look up the warm-up client & resources
+
+    :returns: the warm-up client, None if there isn't one
+    """
+    client = None
+    client_id = getattr(options, 'warm_up_client_id', None)
+    if client_id:
+        client = yield registry.authenticate(
+            client_id, secrets.read('warm_up_client_secret'),
+            request_deadline)
+        if not client:
+            logging.warning('Warm-up client %s could not authenticate',
+                            client_id)
+
+    for resource_id in getattr(options, 'warm_up_resources', None) or []:
+        try:
+            yield registry.get_resource(resource_id, client,
+                                        request_deadline)
+        except couch.NotFound:
+            logging.warning('Warm-up resource %s not found', resource_id)
+
+    raise Return(client)
+
+
+def token_round_trip(client=None):
+    """Generate & verify a token"""
+    client = client or perch.Service(**SYNTHETIC_CLIENT)
+    encoded, _ = token.generate_token(client, 'read', 'client_credentials')
+    token.decode_token(encoded)
+
+
+@coroutine
+def _step(warm_up_deadline, name, func, *args):
+    """Run a warm-up step, logging failures"""
+    try:
+        warm_up_deadline.check()
+        result = yield deadline.wait(warm_up_deadline, name,
+                                     maybe_future(func(*args)))
+    except Exception:
+        logging.exception('Warm-up step "%s" failed', name)
+        metrics.increment('warm_up.failed')
+        result = None
+
+    raise Return(result)
+
+
+@coroutine
+def warm_up():
+    """Warm up the worker, then mark it as ready"""
+    global _duration
+
+    start = time.time()
+    warm_up_deadline = deadline.Deadline(
+        float(getattr(options, 'warm_up_timeout', 0)) or None)
+
+    yield _step(warm_up_deadline, 'keys', load_keys)
+    yield _step(warm_up_deadline, 'connections', pool.warm_up)
+    client = yield _step(warm_up_deadline, 'registry', prime_registry,
+                         warm_up_deadline)
+    yield _step(warm_up_deadline, 'token', token_round_trip, client)
+
+    _duration = time.time() - start
+    metrics.increment('warm_up.ms', _duration * 1000)
+    logging.info('Worker warmed up in %.0fms', _duration * 1000)
+    _set_ready()
+
+
+def start():
+    """
+    Warm up the worker once its IOLoop starts, the worker is ready straight
+    away if `warm_up` is disabled
+    """
+    if getattr(options, 'warm_up', False):
+        IOLoop.current().add_callback(warm_up)
+    else:
+        _set_ready()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+
+from click.testing import CliRunner
+from mock import patch
+
+from auth.commands import benchmark_oauth2
+
+ENVIRONMENT = {'python': 'CPython 2.7.12', 'machine': 'x86_64',
+               'cpu': 'cpu1', 'cpus': 4}
+
+
+def write_baseline(path, results, environment=ENVIRONMENT):
+    path.write(json.dumps({'environment': environment, 'results': results}))
+
+
+def test_benchmarks_run():
+    for name, func in benchmark_oauth2.benchmarks():
+        func()
+
+
+def test_run_selected_benchmarks():
+    results = benchmark_oauth2.run(['scope_parse[1]'], repeat=1,
+                                   min_time=0.001)
+
+    assert results.keys() == ['scope_parse[1]']
+    assert results['scope_parse[1]'] > 0
+
+
+def test_compare():
+    rows = benchmark_oauth2.compare({'a': 12.0, 'b': 20.0, 'c': 1.0},
+                                    {'a': 10.0, 'b': 10.0}, 0.5)
+
+    assert rows == [('a', 12.0, 10.0, 1.2, False),
+                    ('b', 20.0, 10.0, 2.0, True)]
+
+
+def test_environment():
+    environment = benchmark_oauth2.environment()
+
+    assert environment['python'].startswith('CPython 2.7')
+    assert environment['cpus'] > 0
+
+
+@patch.object(benchmark_oauth2, 'environment', return_value=ENVIRONMENT)
+@patch.object(benchmark_oauth2, 'run', return_value={'a': 12.0})
+def test_cli_within_tolerance(run, environment, tmpdir):
+    baseline = tmpdir.join('baseline.json')
+    write_baseline(baseline, {'a': 10.0})
+    output = tmpdir.join('results.json')
+
+    result = CliRunner().invoke(benchmark_oauth2.cli, [
+        '--baseline', str(baseline), '--output', str(output)])
+
+    assert result.exit_code == 0
+    assert json.loads(output.read()) == {'a': 12.0}
+
+
+@patch.object(benchmark_oauth2, 'environment', return_value=ENVIRONMENT)
+@patch.object(benchmark_oauth2, 'run', return_value={'a': 20.0})
+def test_cli_regression(run, environment, tmpdir):
+    baseline = tmpdir.join('baseline.json')
+    write_baseline(baseline, {'a': 10.0})
+
+    result = CliRunner().invoke(benchmark_oauth2.cli, [
+        '--baseline', str(baseline), '--tolerance', '0.25'])
+
+    assert result.exit_code == 1
+    assert 'Slower than the baseline: a' in result.output
+
+
+@patch.object(benchmark_oauth2, 'environment', return_value=ENVIRONMENT)
+@patch.object(benchmark_oauth2, 'run', return_value={'a': 20.0})
+def test_cli_other_machine_not_compared(run, environment, tmpdir):
+    baseline = tmpdir.join('baseline.json')
+    write_baseline(baseline, {'a': 10.0}, dict(ENVIRONMENT, cpu='cpu2'))
+    output = tmpdir.join('results.json')
+
+    result = CliRunner().invoke(benchmark_oauth2.cli, [
+        '--baseline', str(baseline), '--output', str(output)])
+
+    assert result.exit_code == 0
+    assert 'Not comparing with the baseline' in result.output
+    assert json.loads(output.read()) == {'a': 20.0}
+
+
+@patch.object(benchmark_oauth2, 'environment', return_value=ENVIRONMENT)
+@patch.object(benchmark_oauth2, 'run', return_value={'a': 20.0})
+def test_cli_save_baseline(run, environment, tmpdir):
+    baseline = tmpdir.join('baseline.json')
+
+    result = CliRunner().invoke(benchmark_oauth2.cli, [
+        '--baseline', str(baseline), '--save-baseline'])
+
+    assert result.exit_code == 0
+    assert json.loads(baseline.read()) == {'environment': ENVIRONMENT,
+                                           'results': {'a': 20.0}}
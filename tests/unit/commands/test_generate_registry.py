@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+import random
+
+from click.testing import CliRunner
+
+from auth.backends import LocalBackend
+from auth.commands import generate_registry, load_test
+
+
+def organisations(docs):
+    return [x for x in docs if x['type'] == 'organisation']
+
+
+def test_split():
+    counts = generate_registry.split(10, [1, 1, 2])
+
+    assert sum(counts) == 10
+    assert counts[2] >= counts[0]
+
+
+def test_generate_counts():
+    docs = list(generate_registry.documents(
+        organisations=5, services=50, repositories=200, clients=2,
+        scope_size=3))
+    generated = [x for x in organisations(docs)
+                 if x['_id'] != load_test.ORGANISATION_ID]
+    secrets = [x for x in docs if x['type'] == 'oauth_client_credentials']
+
+    assert len(generated) == 5
+    assert sum(len(x['services']) for x in generated) == 50
+    assert sum(len(x['repositories']) for x in generated) == 200
+    # generated services & the load test's
+    assert len(secrets) == 50 + len(load_test.fixture(clients=2)) - 1
+
+
+def test_generate_is_repeatable():
+    first = list(generate_registry.documents(organisations=3, services=10,
+                                             repositories=20, seed=1))
+    second = list(generate_registry.documents(organisations=3, services=10,
+                                              repositories=20, seed=1))
+
+    assert first == second
+
+
+def test_repositories_hosted_by_repository_service():
+    docs = generate_registry.documents(organisations=4, services=20,
+                                       repositories=50)
+
+    for organisation in organisations(docs):
+        services = organisation['services']
+        for repository in organisation['repositories'].values():
+            host = services[repository['service_id']]
+            assert host['service_type'] == 'repository'
+
+
+def test_give_hosts():
+    service_counts = [5, 0, 0, 1]
+    repository_counts = [10, 3, 0, 0]
+
+    generate_registry.give_hosts(service_counts, repository_counts)
+
+    assert service_counts == [4, 1, 0, 1]
+
+
+def test_give_hosts_without_spare_services():
+    service_counts = [1, 0]
+    repository_counts = [10, 3]
+
+    generate_registry.give_hosts(service_counts, repository_counts)
+
+    assert service_counts == [1, 0]
+
+
+def test_every_organisation_with_repositories_hosts_them():
+    # few services, so most organisations aren't given any by split
+    docs = generate_registry.documents(organisations=20, services=20,
+                                       repositories=500)
+
+    for organisation in organisations(docs):
+        services = organisation['services']
+        for repository in organisation['repositories'].values():
+            host = services[repository['service_id']]
+            assert host['service_type'] == 'repository'
+
+
+def test_repositories_without_services_use_shared_host():
+    docs = generate_registry.organisation(random.Random(0), 0, [], ['repo0'],
+                                          1, 0)
+
+    repository = docs[0]['repositories']['repo0']
+    assert repository['service_id'] == load_test.RESOURCE_ID
+
+
+def test_permissions_owner_access():
+    rand = random.Random(0)
+
+    for _ in range(20):
+        permissions = generate_registry.permissions(rand, 'org1', 10, 3)
+        assert permissions[0] == {'type': 'organisation_id', 'value': 'org1',
+                                  'permission': 'rw'}
+        assert all(x['permission'] in ('r', 'w', 'rw', '-')
+                   for x in permissions)
+
+
+def test_local_backend_loads_registry():
+    docs = list(generate_registry.documents(organisations=3, services=10,
+                                            repositories=20))
+
+    backend = LocalBackend(docs)
+
+    assert backend.snapshot.get('repo0') is not None
+    assert backend.snapshot.get(load_test.RESOURCE_ID) is not None
+    assert (load_test.secret('service0'), 'service0') in backend.secrets
+
+
+def test_cli():
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        result = runner.invoke(generate_registry.cli, [
+            'registry.json', '--organisations', '2', '--services', '4',
+            '--repositories', '8'])
+        with open('registry.json') as f:
+            docs = json.load(f)
+
+    assert result.exit_code == 0
+    assert len(organisations(docs)) == 3
+
+
+def test_cli_requires_organisation():
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        result = runner.invoke(generate_registry.cli, [
+            'registry.json', '--organisations', '0'])
+
+    assert result.exit_code != 0
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+
+import click
+import couch
+import pytest
+from mock import MagicMock, patch
+
+from auth.commands import load_design_docs
+
+DOC = {
+    '_id': '_design/view1',
+    'language': 'python',
+    'views': {'view1': {'map': 'def view1(doc): pass'}}
+}
+
+
+def response(body):
+    return MagicMock(body=json.dumps(body))
+
+
+def test_changed_design_docs_missing():
+    db = MagicMock()
+    db.get_doc.side_effect = couch.NotFound()
+
+    assert load_design_docs.changed_design_docs(db, [DOC]) == [DOC]
+
+
+def test_changed_design_docs_unchanged():
+    db = MagicMock()
+    db.get_doc.return_value = dict(DOC, _rev='1-a')
+
+    assert load_design_docs.changed_design_docs(db, [DOC]) == []
+
+
+def test_changed_design_docs_changed():
+    db = MagicMock()
+    db.get_doc.return_value = dict(DOC, _rev='1-a', views={})
+
+    result = load_design_docs.changed_design_docs(db, [DOC])
+
+    assert result == [dict(DOC, _rev='1-a')]
+    assert '_rev' not in DOC
+
+
+@patch('auth.commands.load_design_docs.options')
+def test_indexer_progress(options):
+    options.url_registry_db = 'http://localhost'
+    options.db_port = 5984
+    http_client = MagicMock()
+    http_client.fetch.return_value = response([
+        {'type': 'indexer', 'database': 'registry',
+         'design_document': '_design/view1', 'progress': 40},
+        {'type': 'indexer', 'database': 'shards/00-1f/registry.1458',
+         'design_document': '_design/view1', 'progress': 20},
+        {'type': 'indexer', 'database': 'other',
+         'design_document': '_design/view1', 'progress': 10},
+        {'type': 'replication'},
+    ])
+
+    progress = load_design_docs.indexer_progress(
+        http_client, 'registry', {'_design/view1'})
+
+    assert progress == {'_design/view1': 20}
+    http_client.fetch.assert_called_once_with(
+        'http://localhost:5984/_active_tasks')
+
+
+@patch('auth.commands.load_design_docs.time.sleep')
+@patch('auth.commands.load_design_docs.options')
+def test_wait_for_indexes(options, sleep):
+    options.url_registry_db = 'http://localhost'
+    options.db_port = 5984
+    http_client = MagicMock()
+    building = response([{'type': 'indexer', 'database': 'registry',
+                          'design_document': '_design/view1',
+                          'progress': 50}])
+    http_client.fetch.side_effect = [None, building, response([]), None]
+
+    load_design_docs.wait_for_indexes(http_client, 'registry', [DOC], 60, 1)
+
+    urls = [x[0][0] for x in http_client.fetch.call_args_list]
+    assert urls[0].startswith(
+        'http://localhost:5984/registry/_design/view1/_view/view1?')
+    assert 'stale=update_after' in urls[0]
+    assert 'stale' not in urls[-1]
+    assert sleep.call_count == 1
+
+
+@patch('auth.commands.load_design_docs.time.sleep')
+@patch('auth.commands.load_design_docs.options')
+def test_wait_for_indexes_timeout(options, sleep):
+    options.url_registry_db = 'http://localhost'
+    options.db_port = 5984
+    http_client = MagicMock()
+    building = response([{'type': 'indexer', 'database': 'registry',
+                          'design_document': '_design/view1',
+                          'progress': 50}])
+    http_client.fetch.side_effect = [None, building]
+
+    with pytest.raises(click.ClickException):
+        load_design_docs.wait_for_indexes(http_client, 'registry', [DOC], 0, 1)
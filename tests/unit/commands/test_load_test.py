@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import base64
+import json
+import random
+import urlparse
+from StringIO import StringIO
+
+import click
+import pytest
+from tornado.httpclient import AsyncHTTPClient
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from auth.commands import load_test
+from auth.fakecouch import FakeCouch
+
+
+def test_fixture():
+    docs = load_test.fixture(clients=2)
+    organisation = docs[0]
+    secrets = {x['client_id']: x['_id'] for x in docs[1:]}
+
+    assert sorted(organisation['services']) == [
+        'loadtest-client0', 'loadtest-client1', load_test.DELEGATE_ID,
+        load_test.RESOURCE_ID]
+    assert secrets['loadtest-client0'] == 'secret-loadtest-client0'
+    assert all(x['type'] == 'oauth_client_credentials' for x in docs[1:])
+
+
+def test_fixture_repositories():
+    docs = load_test.fixture(clients=1, repositories=3)
+    repositories = docs[0]['repositories']
+
+    assert sorted(repositories) == load_test.repository_ids(3)
+    assert all(x['service_id'] == load_test.RESOURCE_ID
+               for x in repositories.values())
+
+
+def test_fixture_views():
+    fake = FakeCouch()
+    for doc in load_test.fixture(clients=1):
+        fake.add('registry', doc)
+
+    secret = fake.view('registry', 'oauth_client',
+                       key=['secret-loadtest-client0', 'loadtest-client0'])
+    services = fake.view('registry', 'active_services',
+                         keys=['loadtest-client0', load_test.RESOURCE_ID])
+
+    assert len(secret['rows']) == 1
+    assert [x['value']['organisation_id'] for x in services['rows']] == [
+        'loadtest', 'loadtest']
+
+
+def test_parse_mix():
+    mix = load_test.parse_mix('client_credentials=3, verify,jwt_bearer=0')
+
+    assert mix == [('client_credentials', 3.0), ('verify', 1.0)]
+
+
+def test_parse_mix_unknown_type():
+    with pytest.raises(click.BadParameter):
+        load_test.parse_mix('refresh_token=1')
+
+
+def test_parse_mix_no_traffic():
+    with pytest.raises(click.BadParameter):
+        load_test.parse_mix('verify=0')
+
+
+def test_choose():
+    mix = [('client_credentials', 3), ('verify', 1)]
+    rand = random.Random(1)
+
+    chosen = [load_test.choose(mix, rand) for _ in range(1000)]
+
+    assert 650 < chosen.count('client_credentials') < 850
+    assert chosen.count('client_credentials') + chosen.count('verify') == 1000
+
+
+def test_summarise():
+    results = {'verify': [(float(x), 200) for x in range(1, 100)] +
+                         [(100.0, 503)]}
+
+    summary = load_test.summarise(results, 2)['verify']
+
+    assert summary['requests'] == 100
+    assert summary['errors'] == 1
+    assert summary['statuses'] == {'200': 99, '503': 1}
+    assert summary['rps'] == 50
+    assert summary['p50_ms'] == 51
+    assert summary['p95_ms'] == 96
+    assert summary['p99_ms'] == 100
+
+
+def test_write_fixture():
+    f = StringIO()
+    docs = load_test.fixture(clients=2)
+
+    load_test.write_fixture(iter(docs), f)
+
+    assert json.loads(f.getvalue()) == docs
+
+
+def test_post_authenticates_client():
+    request = load_test.post('http://localhost/token', 'client1',
+                             grant_type='client_credentials')
+
+    credentials = request.headers['Authorization'][len('Basic '):]
+    assert base64.b64decode(credentials) == 'client1:secret-client1'
+    assert urlparse.parse_qs(request.body) == {
+        'grant_type': ['client_credentials']}
+
+
+def test_traffic_scoped_requests():
+    traffic = load_test.Traffic('http://localhost', ['client1'],
+                                scope_size=2)
+    traffic.token = 'token1'
+
+    token = urlparse.parse_qs(traffic.request('client_credentials').body)
+    verify = urlparse.parse_qs(traffic.request('verify').body)
+
+    assert token['scope'] == [load_test.scope(2)]
+    assert verify['resource_id'] == [load_test.repository_ids(2)[-1]]
+
+
+def test_traffic_default_scope():
+    traffic = load_test.Traffic('http://localhost', ['client1'])
+    traffic.token = 'token1'
+
+    token = urlparse.parse_qs(traffic.request('client_credentials').body)
+    verify = urlparse.parse_qs(traffic.request('verify').body)
+
+    assert 'scope' not in token
+    assert 'resource_id' not in verify
+
+
+class FakeTokenHandler(RequestHandler):
+    def post(self):
+        self.finish({'access_token': 'token1'})
+
+
+class FakeVerifyHandler(RequestHandler):
+    def post(self):
+        self.finish({'has_access': True})
+
+
+class TestDrive(AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([(r'/token', FakeTokenHandler),
+                            (r'/verify', FakeVerifyHandler)])
+
+    @gen_test
+    def test_drive(self):
+        http_client = AsyncHTTPClient(io_loop=self.io_loop)
+        traffic = load_test.Traffic(self.get_url(''), ['client1'],
+                                    rand=random.Random(1))
+        yield traffic.setup(http_client)
+        mix = [('client_credentials', 1), ('jwt_bearer', 1), ('verify', 1)]
+
+        results, elapsed = yield load_test.drive(http_client, traffic, mix,
+                                                 concurrency=2, duration=0.2)
+
+        assert traffic.token == traffic.assertion == 'token1'
+        assert set(results) == {'client_credentials', 'jwt_bearer', 'verify'}
+        assert all(code == 200 for samples in results.values()
+                   for _, code in samples)
+        assert elapsed >= 0.2
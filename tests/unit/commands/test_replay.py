@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+import urlparse
+from StringIO import StringIO
+
+from click.testing import CliRunner
+from tornado.httpclient import AsyncHTTPClient
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+from auth.backends import LocalBackend
+from auth.commands import load_test, replay
+
+JWT_BEARER = load_test.JWT_BEARER
+
+TOKEN = {'t': 2.0, 'endpoint': 'token', 'client': 'client1',
+         'grant_type': 'client_credentials', 'scope': 'read[repo1]',
+         'status': 200, 'ms': 4.0}
+DELEGATE = {'t': 2.5, 'endpoint': 'token', 'client': 'delegate1',
+            'grant_type': JWT_BEARER, 'scope': 'write[repo1]',
+            'assertion': {'grant_type': 'client_credentials',
+                          'client': 'client1', 'sub': 'client1',
+                          'scope': 'delegate[delegate1]:write[repo1]'},
+            'status': 200, 'ms': 6.0}
+VERIFY = {'t': 1.0, 'endpoint': 'verify', 'client': 'host1',
+          'requested_access': 'r', 'resource_id': 'repo1',
+          'token': {'grant_type': JWT_BEARER, 'client': 'client1',
+                    'sub': 'delegate1', 'scope': 'write[repo1]'},
+          'status': 200, 'ms': 2.0}
+RECORDS = [VERIFY, TOKEN, DELEGATE]
+
+
+def test_read_capture():
+    f = StringIO(''.join(json.dumps(x) + '\n' for x in [TOKEN, VERIFY]) +
+                 '\n')
+
+    records = replay.read_capture(f)
+
+    assert [x['t'] for x in records] == [1.0, 2.0]
+
+
+def test_registry_documents():
+    docs = replay.registry_documents(RECORDS)
+    organisation = docs[0]
+    services = organisation['services']
+    repositories = organisation['repositories']
+
+    assert sorted(services) == ['client1', 'delegate1', 'host1']
+    assert services['host1']['service_type'] == 'repository'
+    assert services['client1']['service_type'] == 'external'
+    assert sorted(repositories) == ['repo1']
+    assert repositories['repo1']['service_id'] == 'host1'
+    assert sorted(x['client_id'] for x in docs[1:]) == sorted(services)
+
+
+def test_registry_documents_unhosted_repository():
+    docs = replay.registry_documents([TOKEN])
+    organisation = docs[0]
+
+    assert organisation['repositories']['repo1']['service_id'] == \
+        replay.HOST_ID
+    assert organisation['services'][replay.HOST_ID]['service_type'] == \
+        'repository'
+
+
+def test_registry_documents_load():
+    backend = LocalBackend(replay.registry_documents(RECORDS))
+
+    assert backend.snapshot.get('repo1') is not None
+    assert (load_test.secret('delegate1'), 'delegate1') in backend.secrets
+
+
+def test_request():
+    requests = replay.Requests('http://localhost')
+    requests.tokens[replay._key(VERIFY['token'])] = 'token1'
+
+    request = requests.request(VERIFY)
+
+    assert request.url == 'http://localhost/verify'
+    assert urlparse.parse_qs(request.body) == {
+        'requested_access': ['r'], 'resource_id': ['repo1'],
+        'token': ['token1']}
+
+
+def test_request_without_token():
+    requests = replay.Requests('http://localhost')
+
+    request = requests.request(dict(VERIFY, token=None))
+
+    assert urlparse.parse_qs(request.body)['token'] == [replay.INVALID_TOKEN]
+
+
+def test_captured():
+    summaries = replay.captured(RECORDS)
+
+    assert summaries['token']['requests'] == 2
+    assert summaries['verify']['p50_ms'] == 2
+
+
+def test_ks_statistic():
+    assert replay.ks_statistic([1, 2, 3], [1, 2, 3]) == 0
+    assert replay.ks_statistic([1, 2], [3, 4]) == 1
+    assert replay.ks_statistic([1, 2, 3, 4], [3, 4, 5, 6]) == 0.5
+    assert replay.ks_statistic([], [1]) is None
+
+
+def test_compare():
+    baseline = {'latencies': {'token': [float(x) for x in range(1, 101)],
+                              'verify': [1.0]}}
+    candidate = {'latencies': {'token': [x * 1.5 for x in range(1, 101)]}}
+
+    rows = replay.compare(baseline, candidate, 0.25)
+
+    assert [x[1] for x in rows] == ['p50_ms', 'p95_ms', 'p99_ms', 'ks']
+    assert all(x[0] == 'token' for x in rows)
+    assert rows[0][2:] == (51.0, 76.5, 1.5, True)
+
+
+def test_compare_cli():
+    runner = CliRunner()
+    latencies = {'latencies': {'token': [1.0, 2.0, 3.0]}}
+    with runner.isolated_filesystem():
+        for name in ['baseline.json', 'candidate.json']:
+            with open(name, 'w') as f:
+                json.dump(latencies, f)
+
+        result = runner.invoke(replay.cli, ['compare', 'baseline.json',
+                                            'candidate.json'])
+
+    assert result.exit_code == 0
+    assert 'REGRESSED' not in result.output
+
+
+class FakeTokenHandler(RequestHandler):
+    def post(self):
+        grant_type = self.get_body_argument('grant_type')
+        self.application.tokens.append(
+            (grant_type, self.get_body_argument('scope')))
+        self.finish({'access_token': 'token{}'.format(
+            len(self.application.tokens))})
+
+
+class FakeVerifyHandler(RequestHandler):
+    def post(self):
+        self.finish({'has_access': True})
+
+
+class TestReplay(AsyncHTTPTestCase):
+    def get_app(self):
+        app = Application([(r'/token', FakeTokenHandler),
+                           (r'/verify', FakeVerifyHandler)])
+        app.tokens = []
+        return app
+
+    @gen_test
+    def test_setup(self):
+        http_client = AsyncHTTPClient(io_loop=self.io_loop)
+        requests = replay.Requests(self.get_url(''))
+
+        yield requests.setup(http_client, RECORDS)
+
+        # the delegate token's assertion is also the token request's
+        assert self._app.tokens == [
+            ('client_credentials', 'delegate[delegate1]:write[repo1]'),
+            (JWT_BEARER, 'write[repo1]')]
+        assert requests.tokens[replay._key(VERIFY['token'])] == 'token2'
+        assert requests.tokens[replay._key(DELEGATE['assertion'])] == \
+            'token1'
+
+    @gen_test
+    def test_replay(self):
+        http_client = AsyncHTTPClient(io_loop=self.io_loop)
+        requests = replay.Requests(self.get_url(''))
+        records = replay.read_capture(
+            json.dumps(x) for x in RECORDS)
+
+        results, elapsed, lag = yield replay.replay(
+            http_client, records, requests, speed=10, concurrency=2)
+
+        assert len(results['token']) == 2
+        assert len(results['verify']) == 1
+        assert all(code == 200 for samples in results.values()
+                   for _, code in samples)
+        # the capture spans 1.5s
+        assert elapsed >= 0.15
+        assert lag >= 0
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import click
+import pytest
+
+from auth.commands import scaling_report
+
+METRICS = """# TYPE auth_worker_rss_bytes gauge
+auth_worker_rss_bytes{worker="0"} 1000.0
+auth_worker_rss_bytes{worker="1"} 3000.0
+auth_requests_total 5.0
+"""
+
+
+def test_parse_sizes():
+    sizes = scaling_report.parse_sizes(['services=1000,10',
+                                        'scope_size=5'])
+
+    assert sizes == {'services': [10, 1000], 'scope_size': [5]}
+
+
+def test_parse_sizes_unknown_dimension():
+    with pytest.raises(click.BadParameter):
+        scaling_report.parse_sizes(['clients=1,2'])
+
+
+def test_parse_sizes_invalid():
+    with pytest.raises(click.BadParameter):
+        scaling_report.parse_sizes(['services=many'])
+
+
+def test_points():
+    base = {'services': 1, 'repositories': 2}
+
+    points = scaling_report.points({'services': [10, 100]}, base)
+
+    assert points == [('services', {'services': 10, 'repositories': 2}),
+                      ('services', {'services': 100, 'repositories': 2})]
+
+
+def test_parse_rss():
+    assert scaling_report.parse_rss(METRICS) == 3000.0
+
+
+def test_parse_rss_missing():
+    assert scaling_report.parse_rss('auth_requests_total 5.0\n') is None
+
+
+def test_table():
+    summary = {'rps': 10.0, 'p50_ms': 1.5, 'p99_ms': 3.0}
+    results = [{'dimension': 'services', 'size': 100,
+                'traffic': {'client_credentials': summary},
+                'rss_bytes': 2 ** 20}]
+
+    lines = scaling_report.table(results).splitlines()
+
+    assert len(lines) == 2
+    assert lines[1].split() == ['services', '100', '/token', '10.0', '1.50',
+                                '3.00', '1.0']
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+
+import pytest
+from koi.exceptions import HTTPError
+from mock import MagicMock, patch
+
+from auth.controllers.admin import (AdminHandler, MemoryHandler,
+                                   ProfileHandler, HEADER)
+
+
+def handler(cls, token='secret'):
+    h = cls(MagicMock(), MagicMock())
+    h.request.headers = {HEADER: token} if token else {}
+    h.finish = MagicMock()
+    return h
+
+
+@patch('auth.controllers.admin.secrets.read', return_value='')
+def test_disabled(read):
+    with pytest.raises(HTTPError) as exc:
+        handler(AdminHandler).prepare()
+
+    assert exc.value.status_code == 404
+
+
+@patch('auth.controllers.admin.secrets.read', return_value='secret')
+def test_invalid_token(read):
+    with pytest.raises(HTTPError) as exc:
+        handler(AdminHandler, 'wrong').prepare()
+
+    assert exc.value.status_code == 403
+
+
+@patch('auth.controllers.admin.secrets.read', return_value='secret')
+def test_valid_token(read):
+    handler(AdminHandler).prepare()
+
+
+@patch('auth.controllers.admin.profiler')
+def test_profile(profiler):
+    profiler.start.return_value = 'profiles/auth.collapsed'
+    h = handler(ProfileHandler)
+    h.get_argument = MagicMock(return_value='10')
+
+    h.post()
+
+    profiler.start.assert_called_once_with(10)
+    h.finish.assert_called_once_with({
+        'status': 200,
+        'data': {'pid': os.getpid(), 'path': 'profiles/auth.collapsed'}
+    })
+
+
+@patch('auth.controllers.admin.profiler')
+def test_profile_already_running(profiler):
+    profiler.start.return_value = None
+    h = handler(ProfileHandler)
+    h.get_argument = MagicMock(return_value='10')
+
+    with pytest.raises(HTTPError) as exc:
+        h.post()
+
+    assert exc.value.status_code == 409
+
+
+@pytest.mark.parametrize('seconds', ['abc', '-1', '1000'])
+def test_profile_invalid_seconds(seconds):
+    h = handler(ProfileHandler)
+    h.get_argument = MagicMock(return_value=seconds)
+
+    with pytest.raises(HTTPError) as exc:
+        h.post()
+
+    assert exc.value.status_code == 400
+
+
+@patch('auth.controllers.admin.memory')
+def test_memory_report(memory):
+    memory.report.return_value = {'rss_bytes': 1024, 'tracking': False}
+    h = handler(MemoryHandler)
+
+    h.get()
+
+    h.finish.assert_called_once_with({
+        'status': 200, 'data': {'rss_bytes': 1024, 'tracking': False}})
+
+
+@patch('auth.controllers.admin.memory')
+def test_memory_start(memory):
+    memory.start.return_value = True
+    h = handler(MemoryHandler)
+    h.get_argument = MagicMock(side_effect=lambda name, default: {
+        'interval': '30', 'limit': '10'}[name])
+
+    h.post()
+
+    memory.start.assert_called_once_with(30, 10)
+
+
+@patch('auth.controllers.admin.memory')
+def test_memory_already_tracking(memory):
+    memory.start.return_value = False
+    h = handler(MemoryHandler)
+    h.get_argument = MagicMock(side_effect=lambda name, default: default)
+
+    with pytest.raises(HTTPError) as exc:
+        h.post()
+
+    assert exc.value.status_code == 409
+
+
+@patch('auth.controllers.admin.memory')
+def test_memory_stop(memory):
+    h = handler(MemoryHandler)
+
+    h.delete()
+
+    memory.stop.assert_called_once_with()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+
+import pytest
+from mock import MagicMock, patch
+
+from auth import admission, request_context, tracing
+from auth.admission import AdmissionController
+from auth.controllers.base import AuthBaseHandler
+from auth.deadline import Deadline, DeadlineExceeded
+
+
+def handler():
+    h = AuthBaseHandler(MagicMock(), MagicMock())
+    h.set_header = MagicMock()
+    return h
+
+
+@patch('auth.controllers.base.JsonHandler.finish')
+@patch('auth.controllers.base.registry.degraded', return_value=False)
+def test_finish(degraded, finish):
+    h = handler()
+
+    h.finish({'status': 200})
+
+    finish.assert_called_once_with({'status': 200})
+    assert not h.set_header.called
+
+
+@patch('auth.controllers.base.JsonHandler.finish')
+@patch('auth.controllers.base.registry.degraded', return_value=True)
+def test_finish_degraded(degraded, finish):
+    h = handler()
+
+    h.finish({'status': 200})
+
+    finish.assert_called_once_with({'status': 200, 'degraded': True})
+    h.set_header.assert_called_once_with('X-Degraded', 'true')
+
+
+@patch('auth.controllers.base.JsonHandler.finish')
+@patch('auth.controllers.base.registry.degraded', return_value=False)
+def test_write_error_deadline_exceeded(degraded, finish):
+    h = handler()
+    d = Deadline(0)
+    d.timings.append(('service', 0.5))
+
+    h.write_error(504, exc_info=(DeadlineExceeded, DeadlineExceeded(d), None))
+
+    body = finish.call_args[0][0]
+    assert body['status'] == 504
+    assert body['timings'] == [{'lookup': 'service', 'ms': 500.0}]
+
+
+@patch('auth.controllers.base.admission.get_controller')
+def test_admit(get_controller):
+    get_controller.return_value = AdmissionController(1, {'verify': 1})
+    h = handler()
+    h.admission_class = 'verify'
+    h.request.request_time.return_value = 0
+
+    h.admit()
+    h.on_finish()
+
+    assert get_controller.return_value.in_flight == {'verify': 0}
+
+
+@patch('auth.controllers.base.admission.get_controller')
+def test_admit_overloaded(get_controller):
+    get_controller.return_value = AdmissionController(1, {'verify': 1})
+    get_controller.return_value.admit('verify')
+    h = handler()
+    h.admission_class = 'verify'
+    h.request.request_time.return_value = 0
+
+    with pytest.raises(admission.Overloaded):
+        h.admit()
+    h.on_finish()
+
+    assert get_controller.return_value.in_flight == {'verify': 1}
+
+
+@patch('auth.controllers.base.JsonHandler.finish')
+@patch('auth.controllers.base.registry.degraded', return_value=False)
+def test_write_error_overloaded(degraded, finish):
+    h = handler()
+    exc = admission.Overloaded(2)
+
+    h.write_error(503, exc_info=(admission.Overloaded, exc, None))
+
+    h.set_header.assert_called_once_with('Retry-After', 2)
+
+
+@patch('auth.controllers.base.logging')
+@patch('auth.controllers.base.options')
+def test_log_slow_request(options, logging):
+    options.slow_request_threshold = 0.5
+    h = handler()
+    h.context = request_context.RequestContext()
+    h.context.counters['couch.requests'] = 3
+    h.deadline = Deadline(5)
+    h.deadline.timings.append(('service', 0.25))
+    h.request.request_time.return_value = 0.75
+    h.request.method = 'POST'
+    h.request.path = '/verify'
+    h.request.client_id = 'client1'
+    h.request.grant_type = 'client_credentials'
+    h.request.body_arguments = {'token': ['abc'], 'scope': ['read']}
+
+    h.log_slow_request()
+
+    details = json.loads(logging.warning.call_args[0][1])
+    assert details['ms'] == 750
+    assert details['grant_type'] == 'client_credentials'
+    assert details['counters'] == {'couch.requests': 3}
+    assert details['timings'] == [{'lookup': 'service', 'ms': 250.0}]
+    assert details['arguments'] == {'token': request_context.REDACTED,
+                                    'scope': 'read'}
+
+
+@patch('auth.controllers.base.logging')
+@patch('auth.controllers.base.options')
+def test_fast_request_not_logged(options, logging):
+    options.slow_request_threshold = 0.5
+    h = handler()
+    h.context = request_context.RequestContext()
+    h.request.request_time.return_value = 0.25
+
+    h.log_slow_request()
+
+    assert not logging.warning.called
+
+
+@patch('auth.controllers.base.capture.get_capture')
+def test_capture_request(get_capture):
+    h = handler()
+    h.capture_endpoint = 'verify'
+    h.request.client_id = 'client1'
+    h.request.request_time.return_value = 0.01
+    h.get_status = MagicMock(return_value=200)
+
+    h.capture_request()
+
+    get_capture.return_value.record.assert_called_once_with(
+        'verify', h.request, 200, 0.01)
+
+
+@patch('auth.controllers.base.capture.get_capture')
+def test_capture_request_unauthenticated(get_capture):
+    h = handler()
+    h.capture_endpoint = 'verify'
+    h.request.client_id = None
+
+    h.capture_request()
+
+    assert not get_capture.return_value.record.called
+
+
+@patch('auth.controllers.base.JsonHandler.finish')
+@patch('auth.controllers.base.registry.degraded', return_value=False)
+def test_finish_traced(degraded, finish):
+    h = handler()
+    h.context = request_context.RequestContext()
+    h.context.trace = tracing.Trace('request', trace_id='trace1')
+
+    h.finish({'status': 200})
+
+    h.set_header.assert_called_once_with('X-B3-TraceId', 'trace1')
+
+
+@patch('auth.controllers.base.tracing.finish_trace')
+def test_on_finish_finishes_trace(finish_trace):
+    h = handler()
+    h.context = request_context.RequestContext()
+    h.context.trace = tracing.Trace('request')
+    h.request.request_time.return_value = 0
+    h.get_status = MagicMock(return_value=200)
+
+    h.on_finish()
+
+    finish_trace.assert_called_once_with(h.context.trace, status=200)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from mock import MagicMock, patch
+
+from auth.controllers.metrics import MetricsHandler, CONTENT_TYPE
+
+
+@patch('auth.controllers.metrics.fairqueue')
+@patch('auth.controllers.metrics.memory')
+@patch('auth.controllers.metrics.metrics')
+@patch('auth.controllers.metrics.histograms')
+def test_get(histograms, metrics, memory, fairqueue):
+    histograms.exposition.return_value = 'histograms\n'
+    metrics.exposition.return_value = 'counters\n'
+    memory.exposition.return_value = 'rss\n'
+    fairqueue.exposition.return_value = 'organisations\n'
+    handler = MetricsHandler(MagicMock(), MagicMock())
+    handler.set_header = MagicMock()
+    handler.finish = MagicMock()
+
+    handler.get()
+
+    handler.set_header.assert_called_once_with('Content-Type', CONTENT_TYPE)
+    handler.finish.assert_called_once_with(
+        'histograms\ncounters\nrss\norganisations\n')
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import pytest
+from koi.exceptions import HTTPError
+from mock import MagicMock, patch
+
+from auth.controllers.ready import ReadyHandler
+
+
+@patch('auth.controllers.ready.warmup')
+def test_not_ready(warmup):
+    warmup.is_ready.return_value = False
+    handler = ReadyHandler(MagicMock(), MagicMock())
+
+    with pytest.raises(HTTPError) as exc:
+        handler.get()
+
+    assert exc.value.status_code == 503
+
+
+@patch('auth.controllers.ready.warmup')
+def test_ready(warmup):
+    warmup.is_ready.return_value = True
+    warmup.duration.return_value = 1.5
+    handler = ReadyHandler(MagicMock(), MagicMock())
+    handler.finish = MagicMock()
+
+    handler.get()
+
+    handler.finish.assert_called_once_with({
+        'status': 200,
+        'data': {'ready': True, 'warm_up_ms': 1500.0}
+    })
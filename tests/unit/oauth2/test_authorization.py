@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import perch
+import pytest
+from mock import MagicMock, patch
+
+from auth import cache, snapshot
+from auth.oauth2 import authorization
+from auth.oauth2.authorization import authorized, AuthorizationMatrix
+
+
+def resource(rev='1-a', permissions=None, state=perch.State.approved):
+    parent = perch.Organisation(id='org1', state=perch.State.approved,
+                                _rev=rev)
+    return perch.Repository(id='repo1', parent=parent, state=state,
+                            permissions=permissions or [])
+
+
+def client(organisation_id='org1', service_type='external'):
+    parent = perch.Organisation(id=organisation_id,
+                                state=perch.State.approved)
+    return perch.Service(id='client1', parent=parent,
+                         organisation_id=organisation_id,
+                         service_type=service_type,
+                         state=perch.State.approved)
+
+
+def test_authorized_without_cache():
+    client = MagicMock()
+    client.authorized.return_value = True
+    unindexed = MagicMock(spec=['id', 'state'])
+
+    assert authorized(client, 'r', unindexed) is True
+    assert authorized(client, 'r', unindexed) is True
+    assert client.authorized.call_count == 2
+
+
+def test_authorized_cached():
+    client = MagicMock(id='client')
+    client.authorized.return_value = False
+    unindexed = MagicMock(spec=['id', 'state'], id='resource')
+    decisions = cache.LocalCache(30, 10)
+
+    with patch.dict(cache._caches, {'decisions': decisions}):
+        assert authorized(client, 'r', unindexed) is False
+        assert authorized(client, 'r', unindexed) is False
+
+    client.authorized.assert_called_once_with('r', unindexed)
+
+
+def test_authorized_cached_by_access():
+    client = MagicMock(id='client')
+    client.authorized.side_effect = [True, False]
+    unindexed = MagicMock(spec=['id', 'state'], id='resource')
+    decisions = cache.LocalCache(30, 10)
+
+    with patch.dict(cache._caches, {'decisions': decisions}):
+        assert authorized(client, 'r', unindexed) is True
+        assert authorized(client, 'w', unindexed) is False
+
+
+PERMISSIONS = [
+    {'type': 'organisation_id', 'value': 'org1', 'permission': 'r'},
+    {'type': 'organisation_id', 'value': 'org2', 'permission': '-'},
+    {'type': 'service_type', 'value': 'external', 'permission': 'w'},
+    {'type': 'service_type', 'value': 'index', 'permission': 'rw'},
+    {'type': 'all', 'permission': 'r'},
+]
+
+
+@pytest.mark.parametrize('organisation_id,service_type', [
+    ('org1', 'external'),
+    ('org1', 'index'),
+    ('org1', 'other'),
+    ('org2', 'index'),
+    ('org3', 'external'),
+    ('org3', 'index'),
+    ('org3', 'other'),
+])
+@pytest.mark.parametrize('access', ['r', 'w', 'rw', 'wr', 'x', ''])
+def test_matrix_matches_perch(organisation_id, service_type, access):
+    c = client(organisation_id, service_type)
+    r = resource(permissions=PERMISSIONS)
+
+    expected = c.authorized(access, r)
+
+    assert AuthorizationMatrix().authorized(c, access, r) is expected
+
+
+def test_matrix_resource_not_approved():
+    r = resource(permissions=[{'type': 'all', 'permission': 'rw'}],
+                 state=perch.State.pending)
+
+    assert AuthorizationMatrix().authorized(client(), 'r', r) is False
+
+
+def test_matrix_compiled_once():
+    matrix = AuthorizationMatrix()
+    r = resource(permissions=PERMISSIONS)
+
+    assert matrix.get(r) is matrix.get(r)
+    assert len(matrix) == 1
+
+
+def test_matrix_recompiled_when_revision_changes():
+    matrix = AuthorizationMatrix()
+    c = client()
+    matrix.authorized(c, 'w', resource('1-a', PERMISSIONS))
+
+    changed = resource('2-b', [{'type': 'all', 'permission': 'rw'}])
+
+    assert matrix.authorized(c, 'w', changed) is True
+
+
+def test_matrix_evicts_least_recently_used():
+    matrix = AuthorizationMatrix(max_size=2)
+    resources = [resource(permissions=PERMISSIONS) for _ in range(3)]
+    for i, r in enumerate(resources):
+        r.id = 'repo{}'.format(i)
+
+    first = matrix.get(resources[0])
+    matrix.get(resources[1])
+    matrix.get(resources[0])
+    matrix.get(resources[2])
+
+    assert list(matrix._entries) == ['repo0', 'repo2']
+    assert matrix.get(resources[0]) is first
+
+
+@patch('auth.oauth2.authorization.options')
+def test_matrix_size_option(options):
+    options.authorization_matrix_size = 1
+    matrix = AuthorizationMatrix()
+    matrix.get(resource(permissions=PERMISSIONS))
+    other = resource(permissions=PERMISSIONS)
+    other.id = 'repo2'
+    matrix.get(other)
+
+    assert len(matrix) == 1
+
+
+def test_matrix_without_revision():
+    matrix = AuthorizationMatrix()
+    r = resource(rev=None, permissions=PERMISSIONS)
+    del r.parent._resource['_rev']
+
+    assert matrix.get(r) is None
+
+
+def test_matrix_updated_from_snapshot():
+    matrix = AuthorizationMatrix()
+    registry = snapshot.Snapshot()
+    doc = {
+        '_id': 'org1',
+        'type': 'organisation',
+        'state': 'approved',
+        'services': {
+            'service1': {'state': 'approved', 'service_type': 'external'}
+        },
+        'repositories': {
+            'repo1': {'state': 'approved', 'permissions': [
+                {'type': 'organisation_id', 'value': 'org1', 'permission': 'r'}
+            ]}
+        }
+    }
+    snapshot.subscribe(matrix.update)
+
+    try:
+        registry.apply_changes({'results': [{'id': 'org1', 'doc': doc}]})
+        assert len(matrix) == 2
+        assert matrix.authorized(registry.get('service1'), 'r',
+                                 registry.get('repo1')) is True
+
+        doc['repositories']['repo1']['permissions'] = []
+        registry.apply_changes({'results': [{'id': 'org1', 'doc': doc}]})
+        assert matrix.authorized(registry.get('service1'), 'r',
+                                 registry.get('repo1')) is False
+
+        registry.apply_changes({'results': [{'id': 'org1', 'deleted': True}]})
+        assert len(matrix) == 0
+    finally:
+        snapshot._listeners.remove(matrix.update)
+
+
+def test_module_matrix_is_subscribed():
+    assert authorization.matrix.update in snapshot._listeners
@@ -16,6 +16,7 @@ from perch import exceptions
 from tornado.testing import AsyncTestCase, gen_test
 from tornado.gen import coroutine
 
+from auth.deadline import Deadline
 from auth.oauth2 import grants, Scope
 from auth.oauth2.token import decode_token, generate_token
 
@@ -62,6 +63,15 @@ class TestBaseGrant(AsyncTestCase):
         instance = grants.get_grant(self.request)
         assert isinstance(instance, self.Grant)
 
+    def test_grant_deadline(self):
+        self.Grant.register()
+        deadline = Deadline(1)
+
+        instance = grants.get_grant(self.request, deadline=deadline)
+
+        assert instance.deadline is deadline
+        assert instance.requested_scope.deadline is deadline
+
     def test_unregistered_grant(self):
         with pytest.raises(grants.InvalidGrantType):
             grants.get_grant(FakeRequest(grant_type='unregistered grant'))
@@ -185,7 +195,7 @@ class TestBaseGrant(AsyncTestCase):
         self.request.body_arguments['requested_access'] = ['r']
         self.request.body_arguments['resource_id'] = ['1234']
 
-        with patch.object(grants.Repository, 'get') as repo_get:
+        with patch.object(perch.Repository, 'get') as repo_get:
             client = perch.Service(
                 parent=ORGANISATION,
                 id='something',
@@ -216,7 +226,7 @@ class TestBaseGrant(AsyncTestCase):
     def test_verify_access_hosted_resource_does_not_exist(self):
         self.request.body_arguments['resource_id'] = ['1234']
 
-        with patch.object(grants.Repository, 'get') as repo_get:
+        with patch.object(perch.Repository, 'get') as repo_get:
             repo_get.side_effect = exceptions.NotFound()
 
             grant = self.Grant(self.request)
@@ -226,7 +236,7 @@ class TestBaseGrant(AsyncTestCase):
     @gen_test
     def test_verify_access_hosted_resource_service_mismatch(self):
         self.request.body_arguments['resource_id'] = ['1234']
-        with patch.object(grants.Repository, 'get') as repo_get:
+        with patch.object(perch.Repository, 'get') as repo_get:
             client = perch.Service(
                 parent=ORGANISATION,
                 id='something',
@@ -256,7 +266,7 @@ class TestBaseGrant(AsyncTestCase):
     def test_cannot_access_hosted_resource(self):
         self.request.body_arguments['requested_access'] = ['r']
         self.request.body_arguments['resource_id'] = ['1234']
-        with patch.object(grants.Repository, 'get') as repo_get:
+        with patch.object(perch.Repository, 'get') as repo_get:
             client = perch.Service(
                 parent=ORGANISATION,
                 id='something',
@@ -285,7 +295,7 @@ class TestBaseGrant(AsyncTestCase):
     @gen_test
     def test_verify_access_service(self):
         self.request.body_arguments['requested_access'] = ['r']
-        with patch.object(grants.Service, 'get') as service_get:
+        with patch.object(perch.Service, 'get') as service_get:
             client = perch.Service(
                 parent=ORGANISATION,
                 id='something',
@@ -312,7 +322,7 @@ class TestBaseGrant(AsyncTestCase):
     @gen_test
     def test_verify_access_service_does_not_have_access(self):
         self.request.body_arguments['requested_access'] = ['r']
-        with patch.object(grants.Service, 'get') as service_get:
+        with patch.object(perch.Service, 'get') as service_get:
             client = perch.Service(
                 parent=ORGANISATION,
                 id='something',
@@ -387,7 +397,7 @@ class TestClientCredentialsGrant(AsyncTestCase):
             token=[token])
 
         grant = grants.ClientCredentials(request)
-        with patch.object(grants.Service, 'get') as service_get:
+        with patch.object(perch.Service, 'get') as service_get:
             service_get.return_value = make_future(self.client)
             yield grant.verify_access(token)
 
@@ -438,7 +448,7 @@ class TestAuthorizeDelegateGrant(AsyncTestCase):
     def test_generate_token(self):
         grant = grants.AuthorizeDelegate(self.request)
 
-        with patch.object(grants.Service, 'get') as get_srv:
+        with patch.object(perch.Service, 'get') as get_srv:
             get_srv.return_value = make_future(self.client)
 
             token, expiry = yield grant.generate_token()
@@ -455,7 +465,7 @@ class TestAuthorizeDelegateGrant(AsyncTestCase):
         self.delegate.permissions = []
         grant = grants.AuthorizeDelegate(self.request)
 
-        with patch.object(grants.Service, 'get') as get_srv:
+        with patch.object(perch.Service, 'get') as get_srv:
             get_srv.return_value = make_future(self.client)
 
             with pytest.raises(grants.Unauthorized):
@@ -505,7 +515,7 @@ class TestAuthorizeDelegateGrant(AsyncTestCase):
             scope=self.scope,
             assertion=[client_token])
 
-        with patch.object(grants.Service, 'get') as get_srv:
+        with patch.object(perch.Service, 'get') as get_srv:
             get_srv.return_value = make_future(self.client)
             grant = grants.AuthorizeDelegate(request)
 
@@ -527,7 +537,7 @@ class TestAuthorizeDelegateGrant(AsyncTestCase):
 
         grant = grants.AuthorizeDelegate(request)
 
-        with patch.object(grants.Service, 'get') as get_srv:
+        with patch.object(perch.Service, 'get') as get_srv:
             get_srv.return_value = make_future(self.client)
             grant = grants.AuthorizeDelegate(request)
 
@@ -563,7 +573,7 @@ class TestAuthorizeDelegateGrant(AsyncTestCase):
             else:
                 return make_future(self.client)
 
-        with patch.object(grants.Service, 'get', classmethod(get_service)):
+        with patch.object(perch.Service, 'get', classmethod(get_service)):
             grant = grants.AuthorizeDelegate(request)
             yield grant.verify_access(token)
 
@@ -7,6 +7,7 @@
 # distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and limitations under the License.
 
+import couch
 import pytest
 from mock import patch
 import perch
@@ -14,7 +15,7 @@ from perch import exceptions
 from tornado.gen import coroutine, Return
 from tornado.testing import AsyncTestCase, gen_test
 
-from auth import oauth2
+from auth import oauth2, registry
 from auth.oauth2.scope import Scope, READ, WRITE, DELEGATE
 
 
@@ -92,7 +93,7 @@ class TestScope(AsyncTestCase):
         self.locations = {x['location']: x for x in self.services}
 
         view_patch = patch(
-            'auth.oauth2.scope.views.service_and_repository.first',
+            'auth.registry.views.service_and_repository.first',
             coroutine(lambda key: {'value': self.resources[key]})
         )
         view_patch.start()
@@ -223,6 +224,27 @@ class TestScope(AsyncTestCase):
         with pytest.raises(oauth2.Unauthorized):
             yield Scope('delegate[service2]:write[repo1]').validate(self.client)
 
+    @patch.object(perch.Organisation, 'get')
+    @gen_test
+    def test_parent_last_known_good(self, get):
+        get.side_effect = couch.CouchException()
+        repository = dict(self.repositories[0], id='repo4',
+                          organisation_id=ORGANISATION.id)
+        del repository['parent']
+        self.resources['repo4'] = repository
+        registry._last_known_good = registry.LastKnownGood(300, 10)
+        registry.get_last_known_good().set(('organisation', ORGANISATION.id),
+                                           ORGANISATION)
+
+        try:
+            yield Scope('write[repo4]').validate(self.client)
+        finally:
+            registry._breaker = None
+            registry._last_known_good = None
+            registry._last_fallback = 0
+
+        get.assert_called_once_with(ORGANISATION.id)
+
 
 @pytest.mark.parametrize('access,scope,expected', [
     ('r', 'read', True),
@@ -251,3 +273,12 @@ def test_within_read_scope(access, scope, expected):
     scope = oauth2.Scope(scope)
 
     assert scope.within_scope(access, 'something') is expected
+
+
+def test_within_scope_does_not_add_resources():
+    scope = oauth2.Scope('write[1234]')
+
+    scope.within_scope('w', 'something')
+
+    assert scope.resources.keys() == ['1234']
+    assert scope.delegates.keys() == []
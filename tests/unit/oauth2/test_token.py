@@ -138,3 +138,15 @@ def test_missing_sub():
 
     with pytest.raises(jwt.MissingRequiredClaimError):
         decode_token(token)
+
+
+def test_keys_loaded_once():
+    _token._keys.clear()
+    token, expiry = generate_token(CLIENT, SCOPE, 'grant_type')
+    decode_token(token)
+
+    with patch('auth.oauth2.token.open', create=True) as open_:
+        token, expiry = generate_token(CLIENT, SCOPE, 'grant_type')
+        decode_token(token)
+
+    assert open_.call_count == 0
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from auth import metrics
+from auth.admission import AdmissionController
+
+
+def setup_function(function):
+    metrics.reset()
+
+
+def controller(capacity=4, verify=4, token=2, reserved=2):
+    return AdmissionController(capacity, {'verify': verify, 'token': token},
+                               reserved)
+
+
+def test_admit():
+    c = controller()
+
+    assert c.admit('verify', 0.25)
+    assert c.in_flight == {'verify': 1, 'token': 0}
+    assert metrics.get('admission.verify.admitted') == 1
+    assert metrics.get('admission.verify.queue_time_ms') == 250
+
+
+def test_class_limit():
+    c = controller(capacity=10, reserved=0)
+
+    assert c.admit('token')
+    assert c.admit('token')
+    assert not c.admit('token')
+    assert metrics.get('admission.token.rejected') == 1
+
+
+def test_release():
+    c = controller(capacity=10, reserved=0, token=1)
+    c.admit('token')
+    c.release('token')
+
+    assert c.admit('token')
+
+
+def test_verify_uses_reserved_capacity():
+    c = controller()
+    c.admit('token')
+    c.admit('token')
+
+    assert not c.admit('token')
+    assert c.admit('verify')
+    assert c.admit('verify')
+    assert not c.admit('verify')
+
+
+def test_token_rejected_before_reserved_capacity():
+    c = controller(token=4)
+    c.admit('verify')
+    c.admit('verify')
+
+    assert not c.admit('token')
+
+
+def test_no_limits():
+    c = AdmissionController(0, {'verify': 0, 'token': 0})
+
+    assert all(c.admit('token') for _ in range(100))
@@ -21,6 +21,7 @@ def test_main_configure_and_run_service(load_config, make_server,
                                         instance, options):
     server = make_server.return_value
     options.processes = 1
+    options.supervisor = False
     # MUT
     auth.app.main()
 
@@ -28,3 +29,19 @@ def test_main_configure_and_run_service(load_config, make_server,
     make_server.call_count == 1
     server.start.assert_called_once_with(1)
     instance.call_count == 1
+
+
+@patch('auth.app.supervisor')
+@patch('auth.app.options')
+@patch('auth.app.koi.make_server')
+@patch('auth.app.koi.load_config')
+def test_main_supervised(load_config, make_server, options, supervisor):
+    options.processes = 1
+    options.supervisor = True
+
+    auth.app.main()
+
+    assert not make_server.called
+    supervisor.configure_logging.assert_called_once_with()
+    supervisor.run.assert_called_once_with(supervisor.run.call_args[0][0],
+                                           auth.app.CONF_DIR)
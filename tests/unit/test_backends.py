@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+
+import perch
+import pytest
+from mock import patch
+from perch import exceptions
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import backends, registry
+
+DOCS = [
+    {
+        '_id': 'org1',
+        'type': 'organisation',
+        'state': 'approved',
+        'services': {
+            'service1': {'service_type': 'external', 'state': 'approved'},
+            'service2': {'service_type': 'repository', 'state': 'approved',
+                         'location': 'https://service2.test'},
+            'service3': {'service_type': 'external', 'state': 'deactivated'},
+        },
+        'repositories': {'repo1': {'service_id': 'service2',
+                                   'state': 'approved'}}
+    },
+    {'_id': 'secret1', 'type': 'oauth_client_credentials',
+     'client_id': 'service1'},
+]
+
+
+def test_read_fixture_list(tmpdir):
+    path = tmpdir.join('registry.json')
+    path.write(json.dumps(DOCS))
+
+    assert backends.read_fixture(str(path)) == DOCS
+
+
+def test_read_fixture_all_docs(tmpdir):
+    path = tmpdir.join('registry.json')
+    rows = [{'id': x['_id'], 'doc': x} for x in DOCS]
+    rows.append({'id': '_design/views', 'doc': {'_id': '_design/views'}})
+    path.write(json.dumps({'total_rows': 3, 'rows': rows}))
+
+    assert backends.read_fixture(str(path)) == DOCS
+
+
+@patch('auth.backends.options')
+def test_configure_couch(options):
+    options.registry_backend = 'couch'
+
+    backends.configure()
+
+    assert backends.get_backend() is None
+
+
+@patch('auth.backends.options')
+def test_configure_local(options, tmpdir):
+    path = tmpdir.join('registry.json')
+    path.write(json.dumps(DOCS))
+    options.registry_backend = 'local'
+    options.registry_fixture = str(path)
+
+    backends.configure()
+
+    try:
+        assert isinstance(backends.get_backend(), backends.LocalBackend)
+        assert len(backends.get_backend().snapshot) == 4
+    finally:
+        backends._backend = None
+
+
+@patch('auth.backends.options')
+@patch.object(backends.LocalBackend, 'from_options')
+def test_configure_dotted_path(create, options):
+    options.registry_backend = 'auth.backends.LocalBackend'
+
+    backends.configure()
+
+    try:
+        assert backends.get_backend() is create.return_value
+    finally:
+        backends._backend = None
+
+
+@patch('auth.backends.options')
+def test_configure_unknown(options):
+    options.registry_backend = 'unknown'
+
+    with pytest.raises(ValueError):
+        backends.configure()
+
+
+class TestLocalBackend(AsyncTestCase):
+    def setUp(self):
+        super(TestLocalBackend, self).setUp()
+        self.backend = backends.LocalBackend(DOCS)
+
+    @gen_test
+    def test_authenticate(self):
+        service = yield self.backend.authenticate('service1', 'secret1')
+
+        assert service.id == 'service1'
+        assert service.organisation_id == 'org1'
+
+    @gen_test
+    def test_authenticate_invalid_secret(self):
+        service = yield self.backend.authenticate('service1', 'secret2')
+
+        assert service is None
+
+    @gen_test
+    def test_get(self):
+        repository = yield self.backend.get(perch.Repository, 'repo1')
+
+        assert repository.service_id == 'service2'
+
+    @gen_test
+    def test_get_wrong_type(self):
+        with pytest.raises(exceptions.NotFound):
+            yield self.backend.get(perch.Service, 'repo1')
+
+    @gen_test
+    def test_get_deactivated(self):
+        with pytest.raises(exceptions.NotFound):
+            yield self.backend.get(perch.Service, 'service3')
+
+    @gen_test
+    def test_get_resource(self):
+        resource = yield self.backend.get_resource('service2')
+
+        assert resource.resource_type == 'service'
+
+    @gen_test
+    def test_get_by_location(self):
+        service = yield self.backend.get_by_location('https://service2.test')
+
+        assert service.id == 'service2'
+
+    @gen_test
+    def test_get_by_unknown_location(self):
+        with pytest.raises(exceptions.NotFound):
+            yield self.backend.get_by_location('https://unknown.test')
+
+
+class TestRegistryWithLocalBackend(AsyncTestCase):
+    def setUp(self):
+        super(TestRegistryWithLocalBackend, self).setUp()
+        backends._backend = backends.LocalBackend(DOCS)
+
+    def tearDown(self):
+        backends._backend = None
+        super(TestRegistryWithLocalBackend, self).tearDown()
+
+    @patch.object(perch.Service, 'authenticate')
+    @gen_test
+    def test_authenticate(self, authenticate):
+        service = yield registry.authenticate('service1', 'secret1')
+
+        assert service.id == 'service1'
+        assert not authenticate.called
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_get_service(self, get):
+        service = yield registry.get_service('service2')
+
+        assert service.location == 'https://service2.test'
+        assert not get.called
+
+    @patch('auth.registry.views.service_and_repository.first')
+    @gen_test
+    def test_get_resource(self, first):
+        resource = yield registry.get_resource('repo1')
+
+        assert resource.id == 'repo1'
+        assert not first.called
+
+    @gen_test
+    def test_get_service_by_location(self):
+        service = yield registry.get_service_by_location(
+            'https://service2.test')
+
+        assert service.id == 'service2'
+
+    @gen_test
+    def test_get_missing_repository(self):
+        with pytest.raises(exceptions.NotFound):
+            yield registry.get_repository('repo2')
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from mock import patch
+
+from auth import breaker
+from auth.breaker import CircuitBreaker
+
+
+def test_closed():
+    b = CircuitBreaker('test', threshold=2)
+    b.failure()
+
+    assert b.state == breaker.CLOSED
+    assert b.allow()
+
+
+def test_opens_after_threshold():
+    b = CircuitBreaker('test', threshold=2)
+    b.failure()
+    b.failure()
+
+    assert b.state == breaker.OPEN
+    assert not b.allow()
+
+
+def test_success_resets_failures():
+    b = CircuitBreaker('test', threshold=2)
+    b.failure()
+    b.success()
+    b.failure()
+
+    assert b.state == breaker.CLOSED
+
+
+@patch('auth.breaker.time.time')
+def test_half_open_allows_one_trial(time):
+    time.return_value = 100
+    b = CircuitBreaker('test', threshold=1, reset_timeout=10)
+    b.failure()
+    time.return_value = 110
+
+    assert b.state == breaker.HALF_OPEN
+    assert b.allow()
+    assert not b.allow()
+
+
+@patch('auth.breaker.time.time')
+def test_trial_success_closes(time):
+    time.return_value = 100
+    b = CircuitBreaker('test', threshold=1, reset_timeout=10)
+    b.failure()
+    time.return_value = 110
+    b.allow()
+    b.success()
+
+    assert b.state == breaker.CLOSED
+
+
+@patch('auth.breaker.time.time')
+def test_trial_failure_opens(time):
+    time.return_value = 100
+    b = CircuitBreaker('test', threshold=3, reset_timeout=10)
+    for _ in range(3):
+        b.failure()
+    time.return_value = 110
+    b.allow()
+    b.failure()
+
+    assert b.state == breaker.OPEN
+
+
+@patch('auth.breaker.time.time')
+def test_abandoned_trial(time):
+    time.return_value = 100
+    b = CircuitBreaker('test', threshold=1, reset_timeout=10)
+    b.failure()
+    time.return_value = 110
+    b.allow()
+
+    time.return_value = 119
+    assert not b.allow()
+    time.return_value = 120
+    assert b.allow()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+
+import pytest
+from mock import patch
+
+from auth import cache
+
+
+@pytest.fixture(params=['local', 'shared'])
+def instance(request):
+    if request.param == 'local':
+        return cache.LocalCache(30, 64)
+    else:
+        return cache.SharedCache(30, 64, slot_size=128, stripes=4)
+
+
+def test_get_missing(instance):
+    assert instance.get('missing') is None
+
+
+def test_set_and_get(instance):
+    assert instance.set('key', {'a': [1, 2]}) is True
+
+    assert instance.get('key') == {'a': [1, 2]}
+
+
+def test_get_returns_copy(instance):
+    instance.set('key', {'a': 1})
+    instance.get('key')['a'] = 2
+
+    assert instance.get('key') == {'a': 1}
+
+
+def test_overwrite(instance):
+    instance.set('key', 1)
+    instance.set('key', 2)
+
+    assert instance.get('key') == 2
+
+
+def test_false_value(instance):
+    instance.set('key', False)
+
+    assert instance.get('key') is False
+
+
+def test_delete(instance):
+    instance.set('key', 1)
+    instance.delete('key')
+
+    assert instance.get('key') is None
+
+
+def test_expired(instance):
+    instance.set('key', 1)
+
+    with patch('auth.cache.time.time', return_value=1e12):
+        assert instance.get('key') is None
+
+
+def test_ttl_is_capped(instance):
+    instance.set('key', 1, ttl=1e9)
+
+    with patch('auth.cache.time.time', return_value=1e12):
+        assert instance.get('key') is None
+
+
+def test_do_not_set_non_positive_ttl(instance):
+    assert instance.set('key', 1, ttl=-1) is False
+    assert instance.get('key') is None
+
+
+def test_evicts_when_full(instance):
+    for i in range(1000):
+        instance.set(str(i), i)
+
+    assert instance.get('999') == 999
+
+
+def test_shared_value_too_large():
+    instance = cache.SharedCache(30, 64, slot_size=64)
+
+    assert instance.set('key', 'x' * 64) is False
+    assert instance.get('key') is None
+
+
+def test_shared_slot_size_too_small():
+    with pytest.raises(ValueError):
+        cache.SharedCache(30, 64, slot_size=10)
+
+
+def test_shared_between_processes():
+    instance = cache.SharedCache(30, 64)
+
+    pid = os.fork()
+    if pid == 0:
+        instance.set('key', 'from child')
+        os._exit(0)
+
+    os.waitpid(pid, 0)
+    assert instance.get('key') == 'from child'
+
+
+@patch('auth.cache.options')
+def test_configure_disabled(options):
+    options.cache_ttl = 0
+    cache.configure()
+
+    assert cache.get_cache('tokens').enabled is False
+
+
+@patch('auth.cache.options')
+def test_configure_single_process(options):
+    options.cache_ttl = 10
+    options.cache_slots = 100
+    options.cache_shared = True
+    cache.configure(1)
+
+    try:
+        for name in cache.CACHES:
+            assert isinstance(cache.get_cache(name), cache.LocalCache)
+    finally:
+        cache._caches.clear()
+
+
+@patch('auth.cache.options')
+def test_configure_shared(options):
+    options.cache_ttl = 10
+    options.cache_slots = 100
+    options.cache_slot_size = 256
+    options.cache_shared = True
+    cache.configure(0)
+
+    try:
+        for name in cache.CACHES:
+            assert isinstance(cache.get_cache(name), cache.SharedCache)
+    finally:
+        cache._caches.clear()
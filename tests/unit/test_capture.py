@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+import random
+
+import jwt
+from mock import MagicMock, patch
+
+from auth import capture
+from auth.capture import Capture
+
+
+def request(**arguments):
+    r = MagicMock()
+    r.client_id = 'client1'
+    r.body_arguments = {k: [v] for k, v in arguments.items()}
+    return r
+
+
+def read(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_pseudonym_is_stable():
+    recorder = Capture('capture.jsonl', 'key1')
+
+    assert recorder.pseudonym('client1') == recorder.pseudonym(u'client1')
+    assert recorder.pseudonym('client1') != recorder.pseudonym('client2')
+    assert 'client1' not in recorder.pseudonym('client1')
+
+
+def test_pseudonym_depends_on_key():
+    first = Capture('capture.jsonl', 'key1')
+    second = Capture('capture.jsonl', 'key2')
+
+    assert first.pseudonym('client1') != second.pseudonym('client1')
+
+
+def test_scope():
+    recorder = Capture('capture.jsonl', 'key1')
+
+    scope = recorder.scope('read delegate[client1]:write[repo1]')
+
+    assert scope == 'read delegate[{}]:write[{}]'.format(
+        recorder.pseudonym('client1'), recorder.pseudonym('repo1'))
+
+
+def test_token():
+    recorder = Capture('capture.jsonl', 'key1')
+    token = jwt.encode({'grant_type': 'client_credentials',
+                        'client': {'id': 'client1'},
+                        'sub': 'client1',
+                        'scope': 'read[repo1]'}, 'secret')
+
+    shape = recorder.token(token)
+
+    assert shape == {'grant_type': 'client_credentials',
+                     'client': recorder.pseudonym('client1'),
+                     'sub': recorder.pseudonym('client1'),
+                     'scope': recorder.scope('read[repo1]')}
+
+
+def test_invalid_token():
+    recorder = Capture('capture.jsonl', 'key1')
+
+    assert recorder.token('not a token') is None
+
+
+def test_record(tmpdir):
+    path = str(tmpdir.join('capture.jsonl'))
+    recorder = Capture(path, 'key1')
+
+    recorder.record('verify', request(token='not a token',
+                                      requested_access='r',
+                                      resource_id='repo1'), 200, 0.005)
+    recorder.flush()
+
+    record, = read(path)
+    assert record['endpoint'] == 'verify'
+    assert record['client'] == recorder.pseudonym('client1')
+    assert record['resource_id'] == recorder.pseudonym('repo1')
+    assert record['requested_access'] == 'r'
+    assert record['token'] is None
+    assert record['status'] == 200
+    assert record['ms'] == 5
+
+
+def test_record_does_not_include_secrets(tmpdir):
+    path = str(tmpdir.join('capture.jsonl'))
+    recorder = Capture(path, 'key1')
+
+    recorder.record('token', request(grant_type='client_credentials',
+                                     client_secret='secret1',
+                                     scope='read[repo1]'), 200, 0.005)
+    recorder.flush()
+
+    with open(path) as f:
+        data = f.read()
+    assert 'secret1' not in data
+    assert 'repo1' not in data
+    assert 'client1' not in data
+
+
+def test_record_sample(tmpdir):
+    recorder = Capture(str(tmpdir.join('capture.jsonl')), 'key1',
+                       sample=0.25, rand=random.Random(1))
+
+    for _ in range(1000):
+        recorder.record('token', request(), 200, 0.005)
+
+    assert 150 < len(recorder.records) < 350
+
+
+def test_record_flushes_when_full(tmpdir):
+    path = str(tmpdir.join('capture.jsonl'))
+    recorder = Capture(path, 'key1')
+
+    with patch('auth.capture.FLUSH_SIZE', 2):
+        for _ in range(3):
+            recorder.record('token', request(), 200, 0.005)
+
+    assert len(read(path)) == 2
+    assert len(recorder.records) == 1
+
+
+def test_flush_appends(tmpdir):
+    path = str(tmpdir.join('capture.jsonl'))
+    recorder = Capture(path, 'key1')
+
+    for _ in range(2):
+        recorder.record('token', request(), 200, 0.005)
+        recorder.flush()
+
+    assert len(read(path)) == 2
+
+
+@patch('auth.capture.options')
+def test_configure_disabled(options):
+    options.capture_file = ''
+
+    capture.configure()
+
+    assert capture.get_capture() is None
+
+
+@patch('auth.capture.secrets.read', return_value='key1')
+@patch('auth.capture.options')
+def test_configure(options, read):
+    options.capture_file = 'capture.jsonl'
+    options.capture_sample = 0.5
+
+    capture.configure()
+    recorder = capture.get_capture()
+    capture._capture = None
+
+    assert recorder.path == 'capture.jsonl'
+    assert recorder.key == 'key1'
+    assert recorder.sample == 0.5
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import pytest
+from koi.test_helpers import make_future
+from mock import MagicMock, patch
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import deadline
+from auth.deadline import Deadline, DeadlineExceeded
+
+
+def request(**headers):
+    return MagicMock(headers=headers)
+
+
+def test_no_deadline():
+    d = Deadline()
+
+    assert d.remaining() is None
+    d.check()
+
+
+@patch('auth.deadline.time.time')
+def test_remaining(time):
+    time.return_value = 100
+    d = Deadline(0.5)
+    time.return_value = 100.2
+
+    assert round(d.remaining(), 3) == 0.3
+
+
+@patch('auth.deadline.time.time')
+def test_check_exceeded(time):
+    time.return_value = 100
+    d = Deadline(0.5)
+    d.timings.append(('service', 0.25))
+    time.return_value = 100.6
+
+    with pytest.raises(DeadlineExceeded) as exc:
+        d.check()
+
+    assert exc.value.status_code == 504
+    assert exc.value.timings == [{'lookup': 'service', 'ms': 250.0}]
+
+
+def test_from_request_endpoint_timeout():
+    assert deadline.from_request(request(), 2).timeout == 2
+
+
+def test_from_request_header():
+    d = deadline.from_request(request(**{'X-Deadline': '300'}), 2)
+
+    assert d.timeout == 0.3
+
+
+def test_from_request_header_longer_than_endpoint():
+    d = deadline.from_request(request(**{'X-Deadline': '3000'}), 2)
+
+    assert d.timeout == 2
+
+
+def test_from_request_header_without_endpoint_timeout():
+    d = deadline.from_request(request(**{'X-Deadline': '300'}), 0)
+
+    assert d.timeout == 0.3
+
+
+def test_from_request_invalid_header():
+    d = deadline.from_request(request(**{'X-Deadline': 'soon'}))
+
+    assert d.timeout is None
+
+
+class TestWait(AsyncTestCase):
+    @gen_test
+    def test_wait(self):
+        d = Deadline(1)
+
+        result = yield d.wait('service', make_future('result'))
+
+        assert result == 'result'
+        assert [x[0] for x in d.timings] == ['service']
+
+    @gen_test
+    def test_wait_exceeded(self):
+        d = Deadline(0.01)
+
+        with pytest.raises(DeadlineExceeded) as exc:
+            yield d.wait('service', Future())
+
+        assert exc.value.timings[0]['lookup'] == 'service'
+
+    @gen_test
+    def test_not_started_after_deadline(self):
+        d = Deadline(0)
+
+        with pytest.raises(DeadlineExceeded):
+            yield d.wait('service', make_future('result'))
+
+        assert d.timings == []
+
+    @gen_test
+    def test_wait_without_deadline(self):
+        future = make_future('result')
+
+        assert deadline.wait(None, 'service', future) is future
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from mock import patch
+
+from auth import fairqueue, metrics
+from auth.fairqueue import FairScheduler, OrganisationGauges
+
+
+def setup_function(function):
+    metrics.reset()
+    fairqueue._scheduler = None
+    fairqueue._gauges = None
+
+
+def started(turns):
+    return [x for x in turns if x.future.done()]
+
+
+def test_starts_immediately_with_capacity():
+    scheduler = FairScheduler(2)
+    turn = scheduler.acquire('org1')
+
+    assert turn.future.done()
+    assert scheduler.running == 1
+    assert scheduler.in_progress['org1'] == 1
+    assert metrics.get('fair_queue.started') == 1
+
+
+def test_queues_when_busy():
+    scheduler = FairScheduler(1)
+    first = scheduler.acquire('org1')
+    second = scheduler.acquire('org1')
+
+    assert not second.future.done()
+    assert scheduler.depth == 1
+    assert scheduler.queued['org1'] == 1
+
+    scheduler.release(first)
+
+    assert second.future.done()
+    assert scheduler.depth == 0
+    assert scheduler.queued['org1'] == 0
+
+
+def test_busy_organisation_does_not_starve_others():
+    scheduler = FairScheduler(1)
+    running = scheduler.acquire('bulk')
+    bulk = [scheduler.acquire('bulk') for _ in range(10)]
+    other = scheduler.acquire('other')
+
+    scheduler.release(running)
+    scheduler.release(bulk[0])
+
+    assert other.future.done()
+    assert len(started(bulk)) == 1
+
+
+def test_weights():
+    scheduler = FairScheduler(1, weights={'heavy': 3})
+    running = scheduler.acquire('light')
+    heavy = [scheduler.acquire('heavy') for _ in range(6)]
+    light = [scheduler.acquire('light') for _ in range(6)]
+
+    order = []
+    turn = running
+    for _ in range(8):
+        scheduler.release(turn)
+        turn = next(x for x in heavy + light
+                    if x.future.done() and x not in order)
+        order.append(turn)
+
+    assert len([x for x in order if x in heavy]) == 6
+    assert len([x for x in order if x in light]) == 2
+
+
+def test_organisation_limit():
+    scheduler = FairScheduler(4, default_limit=2)
+    turns = [scheduler.acquire('org1') for _ in range(3)]
+    other = scheduler.acquire('org2')
+
+    assert len(started(turns)) == 2
+    assert other.future.done()
+
+    scheduler.release(turns[0])
+
+    assert len(started(turns)) == 3
+
+
+def test_organisation_limit_override():
+    scheduler = FairScheduler(4, limits={'org1': 1}, default_limit=2)
+    turns = [scheduler.acquire('org1') for _ in range(2)]
+
+    assert len(started(turns)) == 1
+
+
+def test_abandoned_turn_is_skipped():
+    scheduler = FairScheduler(1)
+    running = scheduler.acquire('org1')
+    abandoned = scheduler.acquire('org1')
+    waiting = scheduler.acquire('org2')
+
+    scheduler.release(abandoned)
+    scheduler.release(running)
+
+    assert not abandoned.future.done()
+    assert waiting.future.done()
+    assert scheduler.running == 1
+    assert scheduler.depth == 0
+
+
+def test_gauges():
+    scheduler = FairScheduler(1)
+    first = scheduler.acquire('org1')
+    scheduler.acquire('org2')
+    scheduler.acquire('org2')
+
+    shared = metrics.get_shared()
+    assert shared.read('fair_queue.queued') == 2
+    assert shared.read('fair_queue.running') == 1
+
+    scheduler.release(first)
+
+    assert shared.read('fair_queue.queued') == 1
+
+
+def test_wait_time_recorded():
+    scheduler = FairScheduler(1)
+    running = scheduler.acquire('org1')
+
+    with patch('auth.fairqueue.time.time', return_value=1000):
+        turn = scheduler.acquire('org2')
+    with patch('auth.fairqueue.time.time', return_value=1000.5):
+        scheduler.release(running)
+
+    assert turn.future.done()
+    # includes org1's wait, which started straight away
+    assert round(metrics.get('fair_queue.wait_ms')) == 500
+
+
+def test_idle_organisation_pruned():
+    scheduler = FairScheduler(1)
+    running = scheduler.acquire('org1')
+    queued = scheduler.acquire('org2')
+    abandoned = scheduler.acquire('org3')
+
+    scheduler.release(abandoned)
+    scheduler.release(running)
+
+    assert set(scheduler.queued) == {'org2'}
+    assert set(scheduler.in_progress) == {'org2'}
+    assert set(scheduler._tags) == {'org2'}
+
+    scheduler.release(queued)
+
+    assert not scheduler.queued
+    assert not scheduler.in_progress
+    assert not scheduler._tags
+
+
+def test_organisations():
+    scheduler = FairScheduler(1)
+    scheduler.acquire('org1')
+    with patch('auth.fairqueue.time.time', return_value=1000):
+        scheduler.acquire('org2')
+    with patch('auth.fairqueue.time.time', return_value=1002):
+        scheduler.acquire('org2')
+        organisations = scheduler.organisations()
+
+    assert organisations == [('org2', 2, 0, 2), ('org1', 0, 1, 0)]
+
+
+@patch('auth.fairqueue.slots.row')
+def test_organisation_gauges(row):
+    gauges = OrganisationGauges(2, size=2)
+    row.return_value = 0
+    gauges.update([('org1', 3, 1, 0.5), ('org2', 1, 0, 0.2),
+                   ('org3', 1, 0, 0.1)])
+    row.return_value = 1
+    gauges.update([('org1', 1, 2, 1.5)])
+
+    assert gauges.read() == {'org1': [4, 3, 1.5], 'org2': [1, 0, 0.2]}
+
+    gauges.clear(1)
+
+    assert gauges.read() == {'org1': [3, 1, 0.5], 'org2': [1, 0, 0.2]}
+
+
+@patch('auth.fairqueue.slots.row', return_value=0)
+def test_organisation_gauges_emptied(row):
+    gauges = OrganisationGauges(1, size=2)
+    gauges.update([('org1', 3, 1, 0.5), ('org2', 1, 0, 0.2)])
+    gauges.update([('org2', 1, 1, 0)])
+
+    assert gauges.read() == {'org2': [1, 1, 0]}
+
+
+@patch('auth.fairqueue.slots.row', return_value=0)
+def test_exposition(row):
+    fairqueue.get_gauges().update([('org"1', 3, 1, 0.5)])
+
+    result = fairqueue.exposition()
+
+    label = '{organisation_id="org\\"1"}'
+    assert 'auth_fair_queue_organisation_queued' + label + ' 3' in result
+    assert 'auth_fair_queue_organisation_running' + label + ' 1' in result
+    assert ('auth_fair_queue_organisation_wait_seconds' + label +
+            ' 0.5') in result
+
+
+@patch('auth.fairqueue.options')
+def test_get_scheduler(options):
+    options.fair_queue_concurrency = 5
+    options.fair_queue_weights = {'org1': 2}
+    options.fair_queue_org_limits = {}
+    options.fair_queue_org_limit = 3
+
+    scheduler = fairqueue.get_scheduler()
+
+    assert scheduler.concurrency == 5
+    assert scheduler.weights == {'org1': 2}
+    assert scheduler.default_limit == 3
+    assert fairqueue.get_scheduler() is scheduler
+
+
+@patch('auth.fairqueue.options')
+def test_get_scheduler_disabled(options):
+    options.fair_queue_concurrency = 0
+
+    assert fairqueue.get_scheduler() is None
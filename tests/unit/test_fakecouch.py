@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.testing import AsyncTestCase, bind_unused_port, gen_test
+
+from auth.fakecouch import FakeCouch
+
+ORGANISATION = {
+    '_id': 'org1',
+    'type': 'organisation',
+    'state': 'approved',
+    'repositories': {'repo1': {'state': 'approved'},
+                     'repo2': {'state': 'deactivated'}}
+}
+
+
+def fake():
+    couch = FakeCouch()
+    couch.add('registry', ORGANISATION)
+    return couch
+
+
+def test_view_key():
+    result = fake().view('registry', 'active_repositories', key='repo1')
+
+    assert [x['key'] for x in result['rows']] == ['repo1']
+    assert result['rows'][0]['value']['organisation_id'] == 'org1'
+    assert 'doc' not in result['rows'][0]
+
+
+def test_view_does_not_modify_docs():
+    fake().view('registry', 'active_repositories', include_docs=True)
+
+    assert 'id' not in ORGANISATION['repositories']['repo1']
+
+
+def test_view_keys_and_limit():
+    result = fake().view('registry', 'repositories',
+                         keys=['repo2', 'repo1'], limit=1)
+
+    assert [x['key'] for x in result['rows']] == ['repo2']
+
+
+def test_changes():
+    result = fake().changes('registry')
+
+    assert result['last_seq'] == 1
+    assert result['results'][0]['doc'] is ORGANISATION
+
+
+class TestServer(AsyncTestCase):
+    def setUp(self):
+        super(TestServer, self).setUp()
+        self.fake = fake()
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        super(TestServer, self).tearDown()
+
+    @gen_test
+    def test_get_document(self):
+        response = yield AsyncHTTPClient().fetch(
+            self.fake.url + '/registry/org1')
+
+        assert json.loads(response.body)['_id'] == 'org1'
+        assert self.fake.requests == 1
+
+    @gen_test
+    def test_inject_status(self):
+        self.fake.status = 500
+
+        response = yield AsyncHTTPClient().fetch(
+            self.fake.url + '/registry/org1', raise_error=False)
+
+        assert response.code == 500
+
+    @gen_test
+    def test_start_with_sockets(self):
+        sock, port = bind_unused_port()
+        other = fake()
+
+        url = other.start(sockets=[sock])
+        response = yield AsyncHTTPClient().fetch(url + '/registry/org1')
+        other.stop()
+
+        assert url == 'http://127.0.0.1:{}'.format(port)
+        assert response.code == 200
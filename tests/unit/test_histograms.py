@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+
+import pytest
+from mock import patch
+
+from auth import histograms
+from auth.histograms import Histograms, BUCKETS
+
+
+def setup_function(function):
+    histograms._histograms = None
+
+
+def test_observe():
+    h = Histograms()
+    h.observe('authenticate', 0.003)
+    h.observe('authenticate', 0.005)
+    h.observe('authenticate', 10)
+
+    counts, total = h.read('authenticate')
+
+    assert counts[BUCKETS.index(0.005)] == 2
+    assert counts[-1] == 1
+    assert sum(counts) == 3
+    assert round(total, 6) == 10.008
+
+
+def test_stages_are_separate():
+    h = Histograms()
+    h.observe('authenticate', 0.01)
+
+    counts, total = h.read('decode_token')
+
+    assert sum(counts) == 0
+    assert total == 0
+
+
+def test_unknown_stage():
+    with pytest.raises(KeyError):
+        Histograms().observe('unknown', 1)
+
+
+@patch('auth.slots.process.task_id')
+def test_workers_added_together(task_id):
+    h = Histograms(workers=2)
+    task_id.return_value = 0
+    h.observe('authenticate', 0.01)
+    task_id.return_value = 1
+    h.observe('authenticate', 0.02)
+
+    counts, total = h.read('authenticate')
+
+    assert sum(counts) == 2
+    assert round(total, 6) == 0.03
+
+
+def test_shared_with_forked_workers():
+    histograms.configure(2)
+
+    pid = os.fork()
+    if pid == 0:
+        with patch('auth.slots.process.task_id', return_value=1):
+            histograms.observe('authenticate', 0.01)
+        os._exit(0)
+
+    os.waitpid(pid, 0)
+    histograms.observe('authenticate', 0.01)
+
+    counts, _ = histograms.get_histograms().read('authenticate')
+    assert sum(counts) == 2
+
+
+def test_timed():
+    with pytest.raises(ValueError):
+        with histograms.timed('scope_parse'):
+            raise ValueError()
+
+    counts, _ = histograms.get_histograms().read('scope_parse')
+    assert sum(counts) == 1
+
+
+def test_exposition():
+    histograms.observe('authenticate', 0.003)
+    histograms.observe('authenticate', 3)
+
+    lines = histograms.exposition().splitlines()
+
+    name = histograms.NAME
+    assert lines[1] == '# TYPE {} histogram'.format(name)
+    assert '{}_bucket{{stage="authenticate",le="0.001"}} 0'.format(
+        name) in lines
+    assert '{}_bucket{{stage="authenticate",le="0.005"}} 1'.format(
+        name) in lines
+    assert '{}_bucket{{stage="authenticate",le="2.5"}} 1'.format(
+        name) in lines
+    assert '{}_bucket{{stage="authenticate",le="+Inf"}} 2'.format(
+        name) in lines
+    assert '{}_sum{{stage="authenticate"}} 3.003'.format(name) in lines
+    assert '{}_count{{stage="authenticate"}} 2'.format(name) in lines
+    assert '{}_count{{stage="decode_token"}} 0'.format(name) in lines
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from mock import patch
+
+from auth import memory
+from auth.memory import RSSGauge, Tracker
+
+
+class Growing(object):
+    pass
+
+
+def setup_function(function):
+    memory.stop()
+    memory._gauge = None
+
+
+def test_rss():
+    assert memory.rss() > 0
+
+
+@patch('auth.memory.tracemalloc', None)
+def test_tracker_gc():
+    tracker = Tracker(limit=5)
+    tracker.start()
+    objects = [Growing() for _ in range(1000)]
+
+    tracker.update()
+
+    assert tracker.method == 'gc'
+    assert {'site': 'Growing', 'count_diff': 1000} in tracker.top
+    assert len(tracker.top) <= 5
+    del objects
+
+
+def test_start_and_stop():
+    assert memory.start(60)
+    assert not memory.start(60)
+    assert memory.report()['tracking']
+
+    memory.stop()
+
+    assert not memory.report()['tracking']
+
+
+@patch('auth.slots.process.task_id', return_value=1)
+@patch('auth.memory.rss', return_value=2048)
+def test_gauge(rss, task_id):
+    gauge = RSSGauge(workers=2)
+
+    gauge.update()
+
+    assert gauge.read() == [0, 2048]
+
+
+@patch('auth.memory.rss', return_value=2048)
+def test_exposition(rss):
+    memory.get_gauge().update()
+
+    lines = memory.exposition().splitlines()
+
+    assert lines[1] == '# TYPE auth_worker_rss_bytes gauge'
+    assert lines[2] == 'auth_worker_rss_bytes{worker="0"} 2048'
+
+
+@patch('auth.slots.process.task_id', return_value=1)
+@patch('auth.memory.rss', return_value=2048)
+def test_exposition_skips_cleared_rows(rss, task_id):
+    memory.configure(2)
+    memory.get_gauge().update()
+
+    assert memory.exposition().splitlines()[2:] == [
+        'auth_worker_rss_bytes{worker="1"} 2048']
+
+    memory.get_gauge().clear(1)
+
+    assert memory.exposition().splitlines()[2:] == []
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+
+from mock import patch
+
+from auth import metrics
+from auth.metrics import SharedMetrics
+
+
+def setup_function(function):
+    metrics.reset()
+
+
+def test_increment():
+    metrics.increment('a')
+    metrics.increment('a', 2)
+
+    assert metrics.get('a') == 3
+
+
+def test_get_missing():
+    assert metrics.get('missing') == 0
+
+
+def test_counters_is_a_copy():
+    metrics.increment('a')
+    counters = metrics.counters()
+    counters['a'] = 10
+
+    assert metrics.counters() == {'a': 1}
+
+
+def test_shared():
+    metrics.increment('registry.lookups', 2)
+
+    assert metrics.get_shared().read('registry.lookups') == 2
+
+
+def test_unknown_counter_not_shared():
+    metrics.increment('a')
+
+    assert metrics.get('a') == 1
+    assert 'auth_a_total' not in metrics.exposition()
+
+
+@patch('auth.slots.process.task_id')
+def test_workers_added_together(task_id):
+    counters = SharedMetrics(workers=2)
+    task_id.return_value = 0
+    counters.add('responses.slow', 1)
+    task_id.return_value = 1
+    counters.add('responses.slow', 2)
+
+    assert counters.read('responses.slow') == 3
+
+
+def test_shared_with_forked_workers():
+    metrics.configure(2)
+
+    pid = os.fork()
+    if pid == 0:
+        with patch('auth.slots.process.task_id', return_value=1):
+            metrics.increment('responses.degraded')
+        os._exit(0)
+
+    os.waitpid(pid, 0)
+    metrics.increment('responses.degraded')
+
+    assert metrics.get_shared().read('responses.degraded') == 2
+
+
+def test_exposition():
+    metrics.increment('couch_pool.queue_wait_ms', 2.5)
+
+    lines = metrics.exposition().splitlines()
+
+    assert '# TYPE auth_couch_pool_queue_wait_ms_total counter' in lines
+    assert 'auth_couch_pool_queue_wait_ms_total 2.5' in lines
+    assert 'auth_responses_slow_total 0.0' in lines
+
+
+def test_gauge():
+    metrics.set_gauge('fair_queue.queued', 3)
+    metrics.set_gauge('fair_queue.queued', 2)
+
+    lines = metrics.exposition().splitlines()
+
+    assert '# TYPE auth_fair_queue_queued gauge' in lines
+    assert 'auth_fair_queue_queued 2.0' in lines
+
+
+@patch('auth.slots.process.task_id')
+def test_clear_gauges(task_id):
+    shared = SharedMetrics(workers=2)
+    task_id.return_value = 1
+    shared.set('fair_queue.queued', 3)
+    shared.add('responses.slow', 1)
+
+    shared.clear_gauges(1)
+
+    assert shared.read('fair_queue.queued') == 0
+    assert shared.read('responses.slow') == 1
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from mock import patch
+from tornado.httpclient import HTTPRequest
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import metrics, pool, request_context
+from auth.fakecouch import FakeCouch
+
+
+class TestPooledHTTPClient(AsyncTestCase):
+    def setUp(self):
+        super(TestPooledHTTPClient, self).setUp()
+        metrics.reset()
+        self.fake = FakeCouch()
+        self.fake.add('registry', {'_id': 'doc1'})
+        self.fake.start()
+
+    def tearDown(self):
+        self.fake.stop()
+        super(TestPooledHTTPClient, self).tearDown()
+
+    def client(self, **kwargs):
+        return pool.PooledHTTPClient(io_loop=self.io_loop,
+                                     force_instance=True, **kwargs)
+
+    @gen_test
+    def test_fetch(self):
+        client = self.client()
+
+        response = yield client.fetch(self.fake.url + '/registry/doc1')
+
+        assert response.code == 200
+        assert metrics.get('couch_pool.requests') == 1
+
+    @gen_test
+    def test_request_context(self):
+        client = self.client()
+        context = request_context.RequestContext()
+
+        with request_context.activate(context):
+            doc = client.fetch(self.fake.url + '/registry/doc1')
+            view = client.fetch(self.fake.url + '/registry/_design/views'
+                                '/_view/missing', raise_error=False)
+        yield [doc, view]
+
+        assert context.counters['couch.requests'] == 2
+        assert context.counters['couch.view_queries'] == 1
+        assert context.counters['couch.ms'] > 0
+
+    @gen_test
+    def test_limit_per_host(self):
+        self.fake.delay = 0.05
+        client = self.client(max_per_host=1)
+        url = self.fake.url + '/registry/doc1'
+
+        yield [client.fetch(url), client.fetch(url)]
+
+        assert metrics.get('couch_pool.queued') == 1
+        assert metrics.get('couch_pool.queue_wait_ms') >= 40
+
+    @gen_test
+    def test_queue_timeout(self):
+        self.fake.delay = 0.2
+        client = self.client(max_per_host=1)
+        url = self.fake.url + '/registry/doc1'
+
+        first = client.fetch(url)
+        second = yield client.fetch(HTTPRequest(url, request_timeout=0.05),
+                                    raise_error=False)
+
+        assert second.code == 599
+        assert metrics.get('couch_pool.queue_timeout') == 1
+        yield first
+
+    @gen_test
+    def test_error_response(self):
+        client = self.client()
+
+        response = yield client.fetch(self.fake.url + '/registry/missing',
+                                      raise_error=False)
+
+        assert response.code == 404
+
+    def warm_up_options(self, options):
+        options.couch_pool = True
+        options.couch_warm_connections = 2
+        options.url_registry_db = 'http://127.0.0.1'
+        options.db_port = self.fake.url.rsplit(':', 1)[1]
+        options.registry_replicas = []
+
+    @patch('auth.pool.CurlAsyncHTTPClient')
+    @patch('auth.pool.options')
+    @gen_test
+    def test_warm_up(self, options, curl):
+        self.warm_up_options(options)
+
+        yield pool.warm_up()
+
+        assert self.fake.requests == 2
+
+    @patch('auth.pool.logging')
+    @patch('auth.pool.CurlAsyncHTTPClient', None)
+    @patch('auth.pool.options')
+    @gen_test
+    def test_warm_up_without_curl(self, options, logging):
+        self.warm_up_options(options)
+
+        yield pool.warm_up()
+
+        assert self.fake.requests == 0
+        assert logging.warning.called
+
+
+@patch('auth.pool.logging')
+@patch('auth.pool.CurlAsyncHTTPClient')
+@patch('auth.pool.AsyncHTTPClient.configure')
+@patch('auth.pool.options')
+def test_configure(options, configure, curl, logging):
+    options.couch_pool = True
+    options.couch_max_clients = 50
+    options.couch_max_per_host = 20
+
+    pool.configure()
+
+    configure.assert_called_once_with(pool.PooledHTTPClient, max_clients=50,
+                                      max_per_host=20)
+    assert not logging.warning.called
+
+
+@patch('auth.pool.logging')
+@patch('auth.pool.CurlAsyncHTTPClient', None)
+@patch('auth.pool.AsyncHTTPClient.configure')
+@patch('auth.pool.options')
+def test_configure_without_curl(options, configure, logging):
+    options.couch_pool = True
+
+    pool.configure()
+
+    assert configure.called
+    assert logging.warning.called
+
+
+@patch('auth.pool.AsyncHTTPClient.configure')
+@patch('auth.pool.options')
+def test_configure_disabled(options, configure):
+    options.couch_pool = False
+
+    pool.configure()
+
+    assert not configure.called
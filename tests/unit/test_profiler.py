@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from mock import patch
+from tornado.gen import sleep
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import profiler
+from auth.profiler import Sampler
+
+
+def busy(seconds):
+    stop_at = time.time() + seconds
+    while time.time() < stop_at:
+        pass
+
+
+def test_sampler():
+    sampler = Sampler(0.001)
+    sampler.start()
+    try:
+        busy(0.1)
+    finally:
+        sampler.stop()
+
+    assert sum(sampler.stacks.values()) > 0
+    assert any('busy (' in stack for stack in sampler.stacks)
+    assert signal.getsignal(signal.SIGPROF) in (signal.SIG_DFL, None)
+
+
+@patch('auth.profiler.signal.siginterrupt')
+def test_sampler_restarts_system_calls(siginterrupt):
+    sampler = Sampler()
+    sampler.start()
+    siginterrupt.assert_called_once_with(signal.SIGPROF, False)
+
+    sampler.stop()
+    siginterrupt.assert_called_with(signal.SIGPROF, True)
+
+
+def test_collapsed():
+    sampler = Sampler()
+    sampler.stacks['main;handler;encode'] = 3
+    sampler.stacks['main;handler'] = 1
+
+    assert sampler.collapsed() == 'main;handler 1\nmain;handler;encode 3\n'
+
+
+class TestProfile(AsyncTestCase):
+    def setUp(self):
+        super(TestProfile, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        patcher = patch('auth.profiler.options')
+        options = patcher.start()
+        self.addCleanup(patcher.stop)
+        options.profile_dir = os.path.join(self.directory, 'profiles')
+        options.profile_interval = 0.001
+
+    def tearDown(self):
+        if profiler._sampler is not None:
+            profiler._sampler.stop()
+            profiler._sampler = None
+        shutil.rmtree(self.directory)
+        super(TestProfile, self).tearDown()
+
+    @gen_test
+    def test_profile(self):
+        path = profiler.start(0.1)
+
+        assert profiler.is_running()
+        assert profiler.start(0.1) is None
+
+        busy(0.05)
+        yield sleep(0.1)
+
+        assert not profiler.is_running()
+        with open(path) as f:
+            assert 'busy (' in f.read()
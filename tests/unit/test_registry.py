@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import couch
+import perch
+import pytest
+from koi.test_helpers import make_future
+from mock import patch
+from perch import exceptions
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import (breaker, cache, metrics, registry, request_context,
+                  singleflight, snapshot, tracing)
+from auth.deadline import Deadline, DeadlineExceeded
+
+ORGANISATION = perch.Organisation(id='org1', state=perch.State.approved)
+SERVICE = perch.Service(id='service1', parent=ORGANISATION,
+                        state=perch.State.approved)
+
+
+class TestRegistry(AsyncTestCase):
+    def setUp(self):
+        super(TestRegistry, self).setUp()
+        self.snapshot = snapshot.Snapshot()
+        self.snapshot.add_document({
+            '_id': 'org1',
+            'type': 'organisation',
+            'state': 'approved',
+            'services': {'service1': {'location': 'http://service1.test'}},
+            'repositories': {'repo1': {}}
+        })
+
+    def tearDown(self):
+        super(TestRegistry, self).tearDown()
+        snapshot._snapshot = None
+
+    @patch.object(perch.Service, 'get', return_value=make_future(SERVICE))
+    @gen_test
+    def test_get_service_without_snapshot(self, get):
+        service = yield registry.get_service('service1')
+
+        assert service is SERVICE
+
+    @patch.object(perch.Service, 'get', return_value=make_future(SERVICE))
+    @gen_test
+    def test_get_service_from_snapshot(self, get):
+        snapshot._snapshot = self.snapshot
+
+        service = yield registry.get_service('service1')
+
+        assert isinstance(service, snapshot.Service)
+        assert not get.called
+
+    @patch.object(perch.Service, 'get', return_value=make_future(SERVICE))
+    @gen_test
+    def test_get_service_not_in_snapshot(self, get):
+        snapshot._snapshot = self.snapshot
+
+        service = yield registry.get_service('service2')
+
+        assert service is SERVICE
+
+    @patch.object(perch.Repository, 'get')
+    @gen_test
+    def test_get_repository_from_snapshot(self, get):
+        snapshot._snapshot = self.snapshot
+
+        repository = yield registry.get_repository('repo1')
+
+        assert repository.id == 'repo1'
+        assert not get.called
+
+    @patch('auth.registry.views.service_and_repository.first')
+    @gen_test
+    def test_get_resource(self, first):
+        first.return_value = make_future({'value': {
+            'type': 'repository', 'id': 'repo2', 'organisation_id': 'org1'}})
+
+        resource = yield registry.get_resource('repo2')
+
+        assert isinstance(resource, perch.Repository)
+        first.assert_called_once_with(key='repo2')
+
+    @patch.object(perch.Organisation, 'get')
+    @gen_test
+    def test_get_parent_populated(self, get):
+        parent = yield registry.get_parent(SERVICE)
+
+        assert parent is ORGANISATION
+        assert not get.called
+
+    @patch('auth.registry.views.service_and_repository.first')
+    @gen_test
+    def test_get_resource_does_not_exist(self, first):
+        first.side_effect = exceptions.NotFound()
+
+        with pytest.raises(exceptions.NotFound):
+            yield registry.get_resource('repo2')
+
+    @patch.object(perch.Service, 'get_by_location')
+    @gen_test
+    def test_get_service_by_location_from_snapshot(self, get_by_location):
+        snapshot._snapshot = self.snapshot
+
+        service = yield registry.get_service_by_location('http://service1.test')
+
+        assert service.id == 'service1'
+        assert not get_by_location.called
+
+    @patch.object(perch.Service, 'authenticate',
+                  return_value=make_future(SERVICE))
+    @gen_test
+    def test_authenticate(self, authenticate):
+        service = yield registry.authenticate('service1', 'secret')
+
+        assert service is SERVICE
+
+    @patch.object(perch.Service, 'authenticate', return_value=make_future(None))
+    @gen_test
+    def test_authenticate_invalid(self, authenticate):
+        service = yield registry.authenticate('service1', 'secret')
+
+        assert service is None
+
+    @patch.object(perch.Service, 'get', return_value=make_future(SERVICE))
+    @patch.object(perch.Service, 'authenticate',
+                  return_value=make_future(SERVICE))
+    @gen_test
+    def test_authenticate_cached(self, authenticate, get):
+        credentials = cache.LocalCache(30, 10)
+
+        with patch.dict(cache._caches, {'credentials': credentials}):
+            yield registry.authenticate('service1', 'secret')
+            service = yield registry.authenticate('service1', 'secret')
+
+        assert service is SERVICE
+        assert authenticate.call_count == 1
+
+    @patch.object(perch.Service, 'authenticate', return_value=make_future(None))
+    @gen_test
+    def test_authenticate_invalid_not_cached(self, authenticate):
+        credentials = cache.LocalCache(30, 10)
+
+        with patch.dict(cache._caches, {'credentials': credentials}):
+            yield registry.authenticate('service1', 'secret')
+            yield registry.authenticate('service1', 'secret')
+
+        assert authenticate.call_count == 2
+
+
+VIEW_ROWS = [
+    {'key': ['resource', None, 'repo2'], 'value': {
+        'type': 'repository',
+        'organisation_id': 'org2',
+        'organisation_state': 'approved',
+        'state': 'approved',
+        'service_type': None,
+        'location': None,
+        'service_id': 'service2'}},
+    {'key': ['organisation_id', 'org1', 'repo2'], 'value': 'rw'},
+    {'key': ['all', None, 'repo2'], 'value': 'r'},
+]
+
+
+class TestRegistryView(AsyncTestCase):
+    def setUp(self):
+        super(TestRegistryView, self).setUp()
+        self.client = perch.Service(id='service1', parent=ORGANISATION,
+                                    organisation_id='org1',
+                                    service_type='external',
+                                    state=perch.State.approved)
+
+    @patch('auth.registry.auth_resource_access.get')
+    @gen_test
+    def test_get_with_view(self, get):
+        get.return_value = make_future({'rows': VIEW_ROWS})
+
+        resource = yield registry.get_with_view(self.client, 'repo2')
+
+        assert isinstance(resource, snapshot.Repository)
+        assert resource.organisation_id == 'org2'
+        assert resource.service_id == 'service2'
+        get.assert_called_once_with(keys=[
+            ['resource', None, 'repo2'],
+            ['organisation_id', 'org1', 'repo2'],
+            ['service_type', 'external', 'repo2'],
+            ['all', None, 'repo2'],
+        ])
+
+    @patch('auth.registry.auth_resource_access.get')
+    @gen_test
+    def test_get_with_view_permissions(self, get):
+        get.return_value = make_future({'rows': VIEW_ROWS})
+
+        resource = yield registry.get_with_view(self.client, 'repo2')
+
+        assert self.client.authorized('rw', resource) is True
+
+    @patch('auth.registry.auth_resource_access.get')
+    @gen_test
+    def test_get_with_view_not_found(self, get):
+        get.return_value = make_future({'rows': []})
+
+        with pytest.raises(exceptions.NotFound):
+            yield registry.get_with_view(self.client, 'repo2')
+
+    @patch('auth.registry.auth_resource_access.get')
+    @gen_test
+    def test_get_with_view_wrong_type(self, get):
+        get.return_value = make_future({'rows': VIEW_ROWS})
+
+        with pytest.raises(exceptions.NotFound):
+            yield registry.get_with_view(self.client, 'repo2', 'service')
+
+    @patch('auth.registry.options')
+    @patch('auth.registry.auth_resource_access.get')
+    @patch.object(perch.Repository, 'get')
+    @gen_test
+    def test_get_repository_with_client(self, repository_get, get, options):
+        options.authorization_view = True
+        get.return_value = make_future({'rows': VIEW_ROWS})
+
+        repository = yield registry.get_repository('repo2', client=self.client)
+
+        assert repository.id == 'repo2'
+        assert not repository_get.called
+
+    @patch('auth.registry.options')
+    @patch('auth.registry.auth_resource_access.get')
+    @patch.object(perch.Repository, 'get')
+    @gen_test
+    def test_get_repository_view_disabled(self, repository_get, get, options):
+        options.authorization_view = False
+        repository_get.return_value = make_future(SERVICE)
+
+        yield registry.get_repository('repo2', client=self.client)
+
+        assert not get.called
+
+
+class TestReadView(AsyncTestCase):
+    def setUp(self):
+        super(TestReadView, self).setUp()
+        metrics.reset()
+
+    @patch('auth.registry.options')
+    @patch('auth.registry.views.service_and_repository.first')
+    @gen_test
+    def test_consistent(self, first, options):
+        options.view_stale = ''
+        first.return_value = make_future({'value': {}})
+
+        yield registry.read_view(first, key='repo1')
+
+        first.assert_called_once_with(key='repo1')
+        assert metrics.get('view_reads.consistent') == 1
+
+    @patch('auth.registry.options')
+    @patch('auth.registry.views.service_and_repository.first')
+    @gen_test
+    def test_stale(self, first, options):
+        options.view_stale = 'update_after'
+        first.return_value = make_future({'value': {}})
+
+        yield registry.read_view(first, key='repo1')
+
+        first.assert_called_once_with(key='repo1', stale='update_after')
+        assert metrics.get('view_reads.stale') == 1
+        assert metrics.get('view_reads.consistent') == 0
+
+    @patch('auth.registry.options')
+    @patch('auth.registry.views.service_and_repository.first')
+    @gen_test
+    def test_stale_not_found(self, first, options):
+        options.view_stale = 'ok'
+        row = {'value': {}}
+        first.side_effect = [exceptions.NotFound(),
+                             make_future(row)]
+
+        result = yield registry.read_view(first, key='repo1')
+
+        assert result is row
+        assert first.call_args_list[-1] == ((), {'key': 'repo1'})
+        assert metrics.get('view_reads.stale_not_found') == 1
+        assert metrics.get('view_reads.consistent') == 1
+
+    @patch('auth.registry.options')
+    @patch('auth.registry.auth_resource_access.get')
+    @gen_test
+    def test_get_with_view_stale_not_found(self, get, options):
+        options.view_stale = 'ok'
+        get.side_effect = [make_future({'rows': []}),
+                           make_future({'rows': VIEW_ROWS})]
+        client = perch.Service(id='service1', organisation_id='org1',
+                               service_type='external')
+
+        resource = yield registry.get_with_view(client, 'repo2')
+
+        assert resource.id == 'repo2'
+        assert get.call_count == 2
+        assert metrics.get('view_reads.stale_not_found') == 1
+
+
+class TestRegistryCoalescing(AsyncTestCase):
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_get_service_coalesced(self, get):
+        future = Future()
+        get.return_value = future
+
+        first = registry.get_service('service1')
+        second = registry.get_service('service1')
+        future.set_result(SERVICE)
+
+        results = yield [first, second]
+
+        assert results == [SERVICE, SERVICE]
+        get.assert_called_once_with('service1')
+
+
+class TestRegistryUnavailable(AsyncTestCase):
+    def setUp(self):
+        super(TestRegistryUnavailable, self).setUp()
+        metrics.reset()
+        registry._breaker = breaker.CircuitBreaker('registry', threshold=2)
+        registry._last_known_good = registry.LastKnownGood(300, 10)
+        registry._last_fallback = 0
+
+    def tearDown(self):
+        super(TestRegistryUnavailable, self).tearDown()
+        registry._lookups = singleflight.Group('registry')
+        registry._breaker = None
+        registry._last_known_good = None
+        registry._last_fallback = 0
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_last_known_good(self, get):
+        get.side_effect = [make_future(SERVICE), couch.CouchException()]
+
+        yield registry.get_service('service1')
+        service = yield registry.get_service('service1')
+
+        assert service is SERVICE
+        assert registry.degraded()
+        assert metrics.get('registry.last_known_good') == 1
+
+    @patch.object(perch.Organisation, 'get')
+    @gen_test
+    def test_parent_last_known_good(self, get):
+        get.side_effect = [make_future(ORGANISATION), couch.CouchException()]
+        services = [perch.Service(id='service1', organisation_id='org1')
+                    for _ in range(2)]
+
+        for service in services:
+            parent = yield registry.get_parent(service)
+
+            assert parent is ORGANISATION
+            assert service.parent is ORGANISATION
+
+        assert get.call_count == 2
+        assert registry.degraded()
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_unavailable_without_last_known_good(self, get):
+        get.side_effect = couch.CouchException()
+
+        with pytest.raises(registry.Unavailable):
+            yield registry.get_service('service1')
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_not_found_is_not_a_failure(self, get):
+        get.side_effect = exceptions.NotFound()
+
+        for _ in range(3):
+            with pytest.raises(couch.NotFound):
+                yield registry.get_service('service1')
+
+        assert registry.get_breaker().state == breaker.CLOSED
+        assert not registry.degraded()
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_circuit_open(self, get):
+        get.side_effect = [make_future(SERVICE), couch.CouchException(),
+                           couch.CouchException()]
+
+        for _ in range(3):
+            service = yield registry.get_service('service1')
+
+        assert service is SERVICE
+        assert get.call_count == 3
+        assert registry.get_breaker().state == breaker.OPEN
+
+        service = yield registry.get_service('service1')
+
+        assert service is SERVICE
+        assert get.call_count == 3
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_coalesced_failure_recorded_once(self, get):
+        future = Future()
+        get.return_value = future
+
+        lookups = [registry.get_service('service1') for _ in range(3)]
+        future.set_exception(couch.CouchException())
+
+        for lookup in lookups:
+            with pytest.raises(registry.Unavailable):
+                yield lookup
+
+        get.assert_called_once_with('service1')
+        assert registry.get_breaker().failures == 1
+        assert registry.get_breaker().state == breaker.CLOSED
+
+    @patch('auth.registry.options')
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_timeout(self, get, options):
+        options.registry_timeout = 0.01
+        get.return_value = Future()
+
+        with pytest.raises(registry.Unavailable):
+            yield registry.get_service('service1')
+
+        assert registry.get_breaker().failures == 1
+
+    @patch('auth.registry.time.time')
+    def test_last_known_good_max_age(self, time):
+        last_known_good = registry.LastKnownGood(10, 10)
+        time.return_value = 100
+        last_known_good.set('key', 'value')
+
+        time.return_value = 110
+        assert last_known_good.get('key') == 'value'
+        time.return_value = 111
+        assert last_known_good.get('key') is None
+
+    def test_last_known_good_max_size(self):
+        last_known_good = registry.LastKnownGood(10, 2)
+        for key in ['a', 'b', 'c']:
+            last_known_good.set(key, key)
+
+        assert len(last_known_good) == 2
+        assert last_known_good.get('a') is None
+
+
+class TestRegistryDeadline(AsyncTestCase):
+    def setUp(self):
+        super(TestRegistryDeadline, self).setUp()
+        registry._breaker = breaker.CircuitBreaker('registry', threshold=1)
+
+    def tearDown(self):
+        super(TestRegistryDeadline, self).tearDown()
+        registry._lookups = singleflight.Group('registry')
+        registry._breaker = None
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_deadline_exceeded(self, get):
+        get.return_value = Future()
+
+        with pytest.raises(DeadlineExceeded):
+            yield registry.get_service('service1',
+                                       request_deadline=Deadline(0.01))
+
+        assert registry.get_breaker().state == breaker.CLOSED
+
+    @patch.object(perch.Service, 'get')
+    @gen_test
+    def test_lookup_not_started_after_deadline(self, get):
+        with pytest.raises(DeadlineExceeded):
+            yield registry.get_service('service1',
+                                       request_deadline=Deadline(0))
+
+        assert not get.called
+
+    @patch.object(perch.Service, 'get', return_value=make_future(SERVICE))
+    @gen_test
+    def test_lookup_timed(self, get):
+        d = Deadline(1)
+
+        yield registry.get_service('service1', request_deadline=d)
+
+        assert [x[0] for x in d.timings] == ['service']
+
+    @patch.object(perch.Service, 'get', return_value=make_future(SERVICE))
+    @gen_test
+    def test_lookup_traced(self, get):
+        context = request_context.RequestContext()
+        context.trace = tracing.Trace('request')
+        request_context._local.context = context
+        try:
+            yield registry.get_service('service1')
+        finally:
+            request_context._local.context = None
+
+        span = context.trace.spans[-1]
+        assert span.name == 'registry.service'
+        assert span.parent_id == context.trace.root.span_id
+        assert span.duration is not None
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import perch
+import pytest
+from mock import patch
+from perch import exceptions, views
+from tornado.httpclient import HTTPError
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import metrics, registry, replicas
+from auth.fakecouch import FakeCouch
+
+ORGANISATION = {
+    '_id': 'org1',
+    'type': 'organisation',
+    'state': 'approved',
+    'services': {
+        'service1': {'type': 'service', 'state': 'approved',
+                     'service_type': 'external',
+                     'location': 'http://service1.test'}
+    },
+    'repositories': {
+        'repo1': {'type': 'repository', 'state': 'approved',
+                  'service_id': 'service1'}
+    }
+}
+
+
+class ReplicasTestCase(AsyncTestCase):
+    def setUp(self):
+        super(ReplicasTestCase, self).setUp()
+        metrics.reset()
+        self.fakes = [FakeCouch(), FakeCouch()]
+        for fake in self.fakes:
+            fake.add('registry', ORGANISATION)
+            fake.start()
+
+    def tearDown(self):
+        for fake in self.fakes:
+            fake.stop()
+        super(ReplicasTestCase, self).tearDown()
+
+    def replicas(self, **kwargs):
+        return replicas.Replicas([x.url for x in self.fakes], **kwargs)
+
+
+class TestReplicas(ReplicasTestCase):
+    @gen_test
+    def test_first(self):
+        row = yield self.replicas().first(views.active_repositories,
+                                          key='repo1', include_docs=True)
+
+        assert row['value']['organisation_id'] == 'org1'
+        assert row['doc']['_id'] == 'org1'
+
+    @gen_test
+    def test_first_not_found(self):
+        with pytest.raises(exceptions.NotFound):
+            yield self.replicas().first(views.active_repositories,
+                                        key='missing')
+
+    @gen_test
+    def test_get_keys(self):
+        result = yield self.replicas().get(
+            views.active_repositories, keys=['missing', 'repo1'])
+
+        assert [x['key'] for x in result['rows']] == ['repo1']
+
+    @gen_test
+    def test_routes_to_fastest(self):
+        pool = self.replicas(hedge_delay=1)
+        pool.latency[self.fakes[0].url] = 0.5
+
+        yield pool.first(views.active_repositories, key='repo1')
+
+        assert self.fakes[0].requests == 0
+        assert self.fakes[1].requests == 1
+
+    @gen_test
+    def test_hedged(self):
+        self.fakes[0].delay = 0.5
+        pool = self.replicas(hedge_delay=0.01)
+        pool.latency[self.fakes[1].url] = 0.1
+
+        row = yield pool.first(views.active_repositories, key='repo1')
+
+        assert row['id'] == 'org1'
+        assert self.fakes[1].requests == 1
+        assert metrics.get('replicas.hedged') == 1
+
+    @gen_test
+    def test_not_hedged_when_fast(self):
+        pool = self.replicas(hedge_delay=1)
+
+        yield pool.first(views.active_repositories, key='repo1')
+
+        assert metrics.get('replicas.hedged') == 0
+        assert sum(x.requests for x in self.fakes) == 1
+
+    @gen_test
+    def test_failover(self):
+        self.fakes[0].status = 503
+        pool = self.replicas(hedge_delay=1)
+        pool.latency[self.fakes[1].url] = 0.1
+
+        row = yield pool.first(views.active_repositories, key='repo1')
+
+        assert row['id'] == 'org1'
+        assert metrics.get('replicas.failed') == 1
+        assert pool.ordered()[0] == self.fakes[1].url
+
+    @gen_test
+    def test_all_fail(self):
+        for fake in self.fakes:
+            fake.status = 503
+
+        with pytest.raises(HTTPError):
+            yield self.replicas().first(views.active_repositories,
+                                        key='repo1')
+
+    @gen_test
+    def test_trace_headers(self):
+        headers = {'X-B3-TraceId': 'trace1', 'X-B3-SpanId': 'span1',
+                   'X-B3-Sampled': '1'}
+        with patch('auth.replicas.tracing.headers', return_value=headers), \
+                patch('auth.replicas.HTTPRequest',
+                      wraps=replicas.HTTPRequest) as request:
+            yield self.replicas().get(views.active_repositories,
+                                      keys=['repo1'])
+
+        sent = request.call_args[1]['headers']
+        assert sent == dict(headers, **{'Content-Type': 'application/json'})
+
+    def test_hedge_delay_percentile(self):
+        pool = replicas.Replicas(['http://a', 'http://b'], percentile=90,
+                                 hedge_delay=1)
+        assert pool.hedge_delay() == 1
+
+        for i in range(100):
+            pool.record('http://a', i / 1000.0)
+
+        assert pool.hedge_delay() == 0.09
+
+
+class TestRegistryReplicas(ReplicasTestCase):
+    def setUp(self):
+        super(TestRegistryReplicas, self).setUp()
+        replicas._replicas = self.replicas(hedge_delay=1)
+
+    def tearDown(self):
+        replicas._replicas = None
+        registry._last_known_good = None
+        super(TestRegistryReplicas, self).tearDown()
+
+    @patch('auth.replicas.options')
+    @patch.object(perch.Repository, 'get')
+    @gen_test
+    def test_get_repository(self, get, options):
+        repository = yield registry.get_repository('repo1')
+
+        assert isinstance(repository, perch.Repository)
+        assert repository.parent.id == 'org1'
+        assert not get.called
+
+    @patch('auth.replicas.options')
+    @gen_test
+    def test_get_resource(self, options):
+        resource = yield registry.get_resource('service1')
+
+        assert isinstance(resource, perch.Service)
+        parent = yield resource.get_parent()
+        assert parent.id == 'org1'
+
+    @patch('auth.replicas.options')
+    @gen_test
+    def test_get_service_by_location(self, options):
+        service = yield registry.get_service_by_location(
+            'http://service1.test')
+
+        assert service.id == 'service1'
+
+    @patch('auth.replicas.options')
+    @gen_test
+    def test_authenticate(self, options):
+        for fake in self.fakes:
+            fake.add('registry', {'_id': 'secret',
+                                  'type': 'oauth_client_credentials',
+                                  'client_id': 'service1'})
+
+        service = yield registry.authenticate('service1', 'secret')
+        invalid = yield registry.authenticate('service1', 'wrong')
+
+        assert service.id == 'service1'
+        assert invalid is None
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from mock import patch
+from tornado.gen import coroutine, sleep
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import request_context
+from auth.request_context import RequestContext
+
+
+@coroutine
+def count(times):
+    for _ in range(times):
+        yield sleep(0.001)
+        request_context.increment('couch.requests')
+
+
+class TestRequestContext(AsyncTestCase):
+    @gen_test
+    def test_carried_across_coroutines(self):
+        first = RequestContext()
+        second = RequestContext()
+
+        with request_context.activate(first):
+            a = count(3)
+        with request_context.activate(second):
+            b = count(1)
+        yield [a, b]
+
+        assert first.counters == {'couch.requests': 3}
+        assert second.counters == {'couch.requests': 1}
+        assert request_context.current() is None
+
+
+def test_increment_without_context():
+    request_context.increment('couch.requests')
+
+    assert request_context.current() is None
+
+
+@patch('auth.request_context.time.time', side_effect=[1000, 1000.25])
+def test_timed(time):
+    context = RequestContext()
+
+    with request_context.activate(context):
+        with request_context.timed('crypto_ms'):
+            pass
+
+    assert context.counters['crypto_ms'] == 250
+
+
+def test_redact():
+    values = {'token': 'abc', 'Authorization': 'Basic xyz',
+              'client_secret': 'secret', 'scope': 'read'}
+
+    assert request_context.redact(values) == {
+        'token': request_context.REDACTED,
+        'Authorization': request_context.REDACTED,
+        'client_secret': request_context.REDACTED,
+        'scope': 'read'
+    }
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+
+from koi import configure
+from mock import patch
+from tornado.options import OptionParser
+
+from auth import app, secrets
+
+
+def test_read(tmpdir):
+    path = tmpdir.join('secret')
+    path.write('secret1\n')
+
+    with patch('auth.secrets.options') as options:
+        options.admin_token_file = str(path)
+        assert secrets.read('admin_token') == 'secret1'
+
+
+@patch('auth.secrets.options')
+def test_read_not_set(options):
+    options.admin_token_file = ''
+
+    assert secrets.read('admin_token') == ''
+
+
+def test_read_missing_file(tmpdir):
+    with patch('auth.secrets.options') as options:
+        options.admin_token_file = str(tmpdir.join('missing'))
+        assert secrets.read('admin_token') == ''
+
+
+def test_secrets_not_logged(tmpdir):
+    conf_dir = tmpdir.mkdir('config')
+    conf_dir.join('default.conf').write(
+        open(os.path.join(app.CONF_DIR, 'default.conf')).read())
+    local_conf = []
+    for name in secrets.SECRETS:
+        path = tmpdir.join(name)
+        path.write('secret-' + name)
+        local_conf.append('{}_file = {!r}'.format(name, str(path)))
+    conf_dir.join('local.conf').write('\n'.join(local_conf))
+
+    parser = OptionParser()
+    with patch('koi.configure.options', parser), \
+            patch('koi.configure.define', parser.define), \
+            patch('auth.secrets.options', parser), \
+            patch('koi.configure.logging') as logging:
+        configure.load_config_file(str(conf_dir))
+        configure.log_config()
+        values = [secrets.read(name) for name in secrets.SECRETS]
+
+    logged = logging.info.call_args[0][0]
+    assert values == ['secret-' + name for name in secrets.SECRETS]
+    for name in secrets.SECRETS:
+        assert '{}_file='.format(name) in logged
+        assert 'secret-' + name not in logged
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import pytest
+from koi.test_helpers import make_future
+from mock import MagicMock
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import metrics
+from auth.singleflight import Group
+
+
+class TestGroup(AsyncTestCase):
+    def setUp(self):
+        super(TestGroup, self).setUp()
+        metrics.reset()
+        self.group = Group('test')
+
+    @gen_test
+    def test_concurrent_calls_collapsed(self):
+        future = Future()
+        func = MagicMock(return_value=future)
+
+        first = self.group.do('key', func, 'a')
+        second = self.group.do('key', func, 'a')
+        future.set_result('result')
+
+        results = yield [first, second]
+
+        assert results == ['result', 'result']
+        func.assert_called_once_with('a')
+        assert metrics.get('test.lookups') == 2
+        assert metrics.get('test.collapsed') == 1
+
+    @gen_test
+    def test_different_keys(self):
+        func = MagicMock(side_effect=lambda: Future())
+
+        self.group.do('key1', func)
+        self.group.do('key2', func)
+
+        assert func.call_count == 2
+        assert len(self.group) == 2
+
+    @gen_test
+    def test_error_shared(self):
+        future = Future()
+        func = MagicMock(return_value=future)
+
+        first = self.group.do('key', func)
+        second = self.group.do('key', func)
+        future.set_exception(KeyError())
+
+        with pytest.raises(KeyError):
+            yield first
+        with pytest.raises(KeyError):
+            yield second
+
+    @gen_test
+    def test_forgets_finished_calls(self):
+        future = Future()
+        func = MagicMock(return_value=future)
+
+        call = self.group.do('key', func)
+        future.set_result('result')
+        yield call
+        # the done callback is scheduled on the IOLoop
+        yield gen.moment
+
+        assert len(self.group) == 0
+
+    def test_done_future_not_stored(self):
+        func = MagicMock(return_value=make_future('result'))
+
+        self.group.do('key', func)
+        self.group.do('key', func)
+
+        assert func.call_count == 2
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from mock import patch
+
+from auth import slots
+
+
+def teardown_function(function):
+    slots._slot = slots._row = None
+
+
+@patch('auth.slots.process.task_id', return_value=None)
+def test_not_forked(task_id):
+    assert slots.slot() is None
+    assert slots.row(4) == 0
+
+
+@patch('auth.slots.process.task_id', return_value=3)
+def test_forked_by_tornado(task_id):
+    assert slots.slot() == 3
+    assert slots.row(4) == 3
+
+
+@patch('auth.slots.process.task_id', return_value=None)
+def test_supervised(task_id):
+    slots.configure(1, 5)
+
+    assert slots.slot() == 1
+    assert slots.row(8) == 5
+
+
+@patch('auth.slots.process.cpu_count', return_value=4)
+def test_rows(cpu_count):
+    assert slots.rows(2) == 2
+    assert slots.rows(0) == 4
+    assert slots.rows(2, supervised=True) == 4
+    assert slots.rows(None, supervised=True) == 8
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+import os
+import tempfile
+
+import perch
+import pytest
+from koi.test_helpers import make_future
+from mock import MagicMock, patch
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import snapshot
+
+
+def organisation(org_id='org1', state='approved', **kwargs):
+    doc = {
+        '_id': org_id,
+        'type': 'organisation',
+        'state': state,
+        'services': {
+            'service1': {
+                'service_type': 'external',
+                'location': 'http://service1.test',
+                'state': 'approved',
+                'permissions': [
+                    {'type': 'organisation_id', 'value': org_id,
+                     'permission': 'rw'}
+                ]
+            },
+        },
+        'repositories': {
+            'repo1': {
+                'service_id': 'service1',
+                'state': 'approved',
+                'permissions': [
+                    {'type': 'organisation_id', 'value': 'org2',
+                     'permission': '-'},
+                    {'type': 'service_type', 'value': 'external',
+                     'permission': 'r'},
+                ]
+            }
+        }
+    }
+    doc.update(kwargs)
+    return doc
+
+
+@pytest.fixture
+def registry():
+    result = snapshot.Snapshot()
+    result.add_document(organisation())
+    result.add_document(organisation('org2', services={
+        'service2': {'service_type': 'external', 'state': 'approved'}
+    }, repositories={}))
+
+    return result
+
+
+def test_add_document(registry):
+    service = registry.get('service1')
+    repository = registry.get('repo1')
+
+    assert len(registry) == 3
+    assert service.type == 'service'
+    assert service.organisation_id == 'org1'
+    assert service.location == 'http://service1.test'
+    assert service.state == perch.State.approved
+    assert repository.type == 'repository'
+    assert repository.service_id == 'service1'
+
+
+def test_records_are_compact(registry):
+    with pytest.raises(AttributeError):
+        registry.get('service1').__dict__
+
+
+def test_ignore_other_documents(registry):
+    registry.add_document({'_id': 'user1', 'type': 'user'})
+
+    assert len(registry) == 3
+
+
+def test_get_by_type(registry):
+    assert registry.get('service1', 'service') is not None
+    assert registry.get('service1', 'repository') is None
+
+
+def test_get_by_location(registry):
+    assert registry.get_by_location('http://service1.test').id == 'service1'
+    assert registry.get_by_location('http://unknown.test') is None
+
+
+def test_deactivated_parent(registry):
+    registry.add_document(organisation(state='deactivated'))
+
+    assert registry.get('service1') is None
+    assert registry.get('repo1') is None
+    assert registry.get_by_location('http://service1.test') is None
+
+
+def test_replace_document(registry):
+    registry.add_document(organisation(repositories={}))
+
+    assert registry.get('repo1') is None
+    assert registry.get('service1') is not None
+
+
+def test_apply_changes(registry):
+    applied = registry.apply_changes({
+        'results': [
+            {'id': 'org2', 'deleted': True},
+            {'id': 'org3', 'doc': organisation('org3', services={},
+                                               repositories={'repo3': {}})},
+        ],
+        'last_seq': 10
+    })
+
+    assert applied == 2
+    assert registry.sequence == 10
+    assert registry.get('service2') is None
+    assert registry.get('repo3').organisation_id == 'org3'
+
+
+def test_permissions_format(registry):
+    permissions = registry.get('repo1').permissions
+
+    assert sorted(permissions) == sorted([
+        {'type': 'organisation_id', 'value': 'org2', 'permission': '-'},
+        {'type': 'service_type', 'value': 'external', 'permission': 'r'},
+    ])
+
+
+@pytest.mark.parametrize('client_id,access,resource_id,expected', [
+    ('service1', 'rw', 'service1', True),
+    ('service1', 'r', 'repo1', True),
+    ('service1', 'w', 'repo1', False),
+    ('service2', 'r', 'repo1', False),
+    ('service2', 'r', 'service1', False),
+])
+def test_authorized(registry, client_id, access, resource_id, expected):
+    client = registry.get(client_id)
+    resource = registry.get(resource_id)
+
+    assert client.authorized(access, resource) is expected
+
+
+def test_authorized_perch_resource(registry):
+    client = registry.get('service1')
+    resource = perch.Repository(
+        parent=perch.Organisation(id='org1', state=perch.State.approved),
+        state=perch.State.approved,
+        permissions=[{'type': 'all', 'permission': 'r'}])
+
+    assert client.authorized('r', resource) is True
+    assert client.authorized('w', resource) is False
+
+
+def test_authorized_not_approved(registry):
+    registry.add_document(organisation('org2', state='pending', services={
+        'service2': {'service_type': 'external', 'state': 'approved'}
+    }, repositories={}))
+    client = registry.get('service2')
+
+    assert client.authorized('r', registry.get('service1')) is False
+
+
+def test_dump_and_load(registry):
+    registry.sequence = 5
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        registry.dump(path)
+        loaded = snapshot.Snapshot.load(path)
+    finally:
+        os.remove(path)
+
+    assert loaded.sequence == 5
+    assert len(loaded) == 3
+    assert loaded.get('repo1').parent is loaded.get('service1').parent
+
+
+def test_load_invalid_file():
+    with tempfile.NamedTemporaryFile() as f:
+        f.write('invalid')
+        f.flush()
+
+        with pytest.raises(ValueError):
+            snapshot.Snapshot.load(f.name)
+
+
+@patch('auth.snapshot.options')
+@patch('auth.snapshot.load_registry')
+def test_preload_from_file(load_registry, options, registry):
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    registry.dump(path)
+    options.snapshot = True
+    options.snapshot_file = path
+
+    try:
+        snapshot.preload()
+        assert len(snapshot.current()) == 3
+        assert not load_registry.called
+    finally:
+        snapshot._snapshot = None
+        os.remove(path)
+
+
+@patch('auth.snapshot.options')
+@patch('auth.snapshot.load_registry')
+def test_preload_from_registry(load_registry, options, registry):
+    path = os.path.join(tempfile.mkdtemp(), 'snapshot')
+    options.snapshot = True
+    options.snapshot_file = path
+    load_registry.return_value = registry
+
+    try:
+        snapshot.preload()
+        assert snapshot.current() is registry
+        assert os.path.exists(path)
+    finally:
+        snapshot._snapshot = None
+        os.remove(path)
+
+
+class TestCatchUp(AsyncTestCase):
+    def tearDown(self):
+        super(TestCatchUp, self).tearDown()
+        snapshot._snapshot = None
+
+    @patch('auth.snapshot.options')
+    @patch('auth.snapshot.AsyncHTTPClient')
+    @gen_test
+    def test_catch_up(self, client, options):
+        options.url_registry_db = 'http://localhost'
+        options.db_port = 5984
+        options.snapshot_file = os.path.join(tempfile.mkdtemp(), 'snapshot')
+        snapshot._snapshot = snapshot.Snapshot()
+        snapshot._snapshot.sequence = 3
+        response = MagicMock(body=json.dumps({
+            'results': [{'id': 'org1', 'doc': organisation()}],
+            'last_seq': 4
+        }))
+        client.return_value.fetch.return_value = make_future(response)
+
+        applied = yield snapshot.catch_up()
+
+        assert applied == 1
+        assert snapshot._snapshot.sequence == 4
+        assert 'since=3' in client.return_value.fetch.call_args[0][0]
+        assert os.path.exists(options.snapshot_file)
+
+    @gen_test
+    def test_catch_up_disabled(self):
+        applied = yield snapshot.catch_up()
+
+        assert applied == 0
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import os
+import time
+
+from mock import MagicMock, patch
+
+from auth import supervisor
+from auth.supervisor import Supervisor
+
+
+def ready_worker(slot, row, ready_fd):
+    os.write(ready_fd, '1')
+    time.sleep(30)
+
+
+def failing_worker(slot, row, ready_fd):
+    raise Exception('failed')
+
+
+def wait_for_reload(s):
+    for _ in range(250):
+        s.continue_reload()
+        s.reap()
+        if not s.reloading:
+            return
+        time.sleep(0.02)
+
+
+def wait_for_exit(s, pid):
+    for _ in range(100):
+        s.reap()
+        if pid not in s.workers:
+            return
+        time.sleep(0.02)
+
+
+class TestSupervisor(object):
+    def setup_method(self, method):
+        self.supervisor = None
+
+    def teardown_method(self, method):
+        if self.supervisor is not None:
+            self.supervisor.stop()
+            for _ in range(100):
+                self.supervisor.reap()
+                if not self.supervisor.workers:
+                    break
+                time.sleep(0.02)
+
+    def make(self, target, processes=1):
+        self.supervisor = Supervisor(target, processes, ready_timeout=5,
+                                     respawn_delay=0)
+        self.supervisor.running = True
+        return self.supervisor
+
+    def wait_ready(self, s, pid):
+        for _ in range(250):
+            ready = s.ready(pid)
+            if ready is not None:
+                return ready
+            time.sleep(0.02)
+
+    def test_ready(self):
+        s = self.make(ready_worker)
+        pid = s.spawn(0)
+
+        assert self.wait_ready(s, pid) is True
+
+    def test_ready_worker_exited(self):
+        s = self.make(failing_worker)
+        pid = s.spawn(0)
+
+        assert self.wait_ready(s, pid) is False
+
+    @patch('auth.supervisor.select.select', return_value=([], [], []))
+    def test_not_ready(self, select):
+        s = self.make(ready_worker)
+        pid = s.spawn(0)
+
+        assert s.ready(pid) is None
+
+    def test_respawn(self):
+        s = self.make(ready_worker)
+        pid = s.spawn(0)
+        os.kill(pid, 9)
+
+        wait_for_exit(s, pid)
+
+        assert len(s.workers) == 1
+        assert s.workers.values()[0].slot == 0
+        assert pid not in s.workers
+
+    def test_terminated_worker_not_respawned(self):
+        s = self.make(ready_worker)
+        pid = s.spawn(0)
+        s.terminate(pid)
+
+        wait_for_exit(s, pid)
+
+        assert s.workers == {}
+
+    def test_reload(self):
+        s = self.make(ready_worker, processes=2)
+        old = [s.spawn(0), s.spawn(1)]
+
+        s.reload()
+        wait_for_reload(s)
+        for pid in old:
+            wait_for_exit(s, pid)
+
+        assert sorted(x.slot for x in s.workers.values()) == [0, 1]
+        assert not set(old) & set(s.workers)
+
+    @patch('auth.supervisor.select.select', return_value=([], [], []))
+    def test_reload_does_not_wait(self, select):
+        s = self.make(ready_worker, processes=2)
+        s.spawn(0)
+        s.spawn(1)
+
+        s.reload()
+        s.continue_reload()
+
+        assert len(s.workers) == 3
+        assert s.reloading
+        assert not s.stopping
+
+    @patch('auth.supervisor.select.select', return_value=([], [], []))
+    def test_reload_stops_when_worker_not_ready_in_time(self, select):
+        s = self.make(ready_worker)
+        s.ready_timeout = 0
+        old = s.spawn(0)
+
+        s.reload()
+        s.continue_reload()
+
+        assert not s.reloading
+        assert old not in s.stopping
+        assert len(s.stopping) == 1
+
+    def test_replacement_has_another_row(self):
+        s = self.make(ready_worker, processes=2)
+        old = [s.spawn(0), s.spawn(1)]
+        rows = [s.workers[pid].row for pid in old]
+
+        s.reload()
+        wait_for_reload(s)
+        replacements = [x for x in s.workers.values() if x.pid not in old]
+
+        assert rows == [0, 1]
+        assert len(replacements) == 2
+        assert not set(x.row for x in replacements) & set(rows)
+        assert all(x.row < s.rows for x in replacements)
+
+    @patch('auth.supervisor.fairqueue')
+    @patch('auth.supervisor.metrics')
+    @patch('auth.supervisor.memory')
+    def test_exited_worker_row_cleared(self, memory, metrics, fairqueue):
+        s = self.make(ready_worker)
+        pid = s.spawn(0)
+        s.terminate(pid)
+
+        wait_for_exit(s, pid)
+
+        memory.get_gauge.return_value.clear.assert_called_once_with(0)
+        metrics.get_shared.return_value.clear_gauges.assert_called_once_with(
+            0)
+        fairqueue.get_gauges.return_value.clear.assert_called_once_with(0)
+
+    def test_reload_stops_when_worker_not_ready(self):
+        s = self.make(ready_worker)
+        old = s.spawn(0)
+        s.target = failing_worker
+
+        s.reload()
+        wait_for_reload(s)
+
+        assert old in s.workers
+        assert old not in s.stopping
+        assert len(s.workers) == 1
+
+
+@patch('auth.supervisor.PeriodicCallback')
+@patch('auth.supervisor.IOLoop')
+@patch('auth.supervisor.admission')
+def test_drain(admission, IOLoop, PeriodicCallback):
+    server = MagicMock()
+    admission.get_controller.return_value.total = 1
+
+    supervisor.drain(server, 10)
+    check = PeriodicCallback.call_args[0][0]
+    check()
+
+    server.stop.assert_called_once_with()
+    assert not IOLoop.current.return_value.stop.called
+
+    admission.get_controller.return_value.total = 0
+    check()
+
+    IOLoop.current.return_value.stop.assert_called_once_with()
+
+
+@patch('auth.supervisor.PeriodicCallback')
+@patch('auth.supervisor.IOLoop')
+@patch('auth.supervisor.admission')
+def test_drain_timeout(admission, IOLoop, PeriodicCallback):
+    admission.get_controller.return_value.total = 1
+
+    supervisor.drain(MagicMock(), 0)
+    PeriodicCallback.call_args[0][0]()
+
+    IOLoop.current.return_value.stop.assert_called_once_with()
+
+
+@patch('auth.supervisor.psutil')
+@patch('auth.supervisor.process.cpu_count', return_value=2)
+def test_pin_to_cpu(cpu_count, psutil):
+    with patch.object(supervisor.os, 'sched_setaffinity', create=True) as s:
+        supervisor.pin_to_cpu(3)
+
+    s.assert_called_once_with(0, [1])
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import json
+
+import pytest
+from mock import MagicMock, patch
+
+from auth import request_context, tracing
+
+
+class RecordingExporter(object):
+    def __init__(self):
+        self.spans = []
+
+    @classmethod
+    def from_options(cls):
+        return cls()
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exporter(request):
+    def reset():
+        tracing._exporter = None
+        tracing._sample_rate = 0
+        tracing._forced = tracing.RateLimit(tracing.DEFAULT_FORCED_RATE)
+        del tracing._spans[:]
+
+    request.addfinalizer(reset)
+    tracing._exporter = RecordingExporter()
+
+    return tracing._exporter
+
+
+def http_request(**headers):
+    r = MagicMock()
+    r.method = 'POST'
+    r.path = '/v1/auth/token'
+    r.headers = headers
+    return r
+
+
+def traced(trace):
+    context = request_context.RequestContext()
+    context.trace = trace
+    return request_context.activate(context)
+
+
+def test_trace_nesting():
+    trace = tracing.Trace('request')
+
+    outer = trace.start('outer')
+    leaf = trace.start('leaf', leaf=True)
+    inner = trace.start('inner')
+    trace.finish(inner)
+    trace.finish(leaf)
+    trace.finish(outer)
+    after = trace.start('after')
+
+    assert outer.parent_id == trace.root.span_id
+    assert leaf.parent_id == outer.span_id
+    assert inner.parent_id == outer.span_id
+    assert after.parent_id == trace.root.span_id
+    assert all(x.trace_id == trace.trace_id for x in trace.spans)
+
+
+def test_trace_finished_out_of_order():
+    trace = tracing.Trace('request')
+
+    first = trace.start('first')
+    second = trace.start('second')
+    trace.finish(first)
+
+    assert trace.current is second
+
+
+def test_span_outside_trace():
+    with tracing.span('stage') as span:
+        span.tag(key='value')
+
+    assert span is tracing.NULL_SPAN
+
+
+def test_span():
+    trace = tracing.Trace('request')
+
+    with traced(trace):
+        with tracing.span('stage') as span:
+            span.tag(key='value')
+
+    assert trace.spans[1] is span
+    assert span.parent_id == trace.root.span_id
+    assert span.tags == {'key': 'value'}
+    assert span.duration >= 0
+
+
+def test_span_error():
+    trace = tracing.Trace('request')
+
+    with pytest.raises(ValueError):
+        with traced(trace):
+            with tracing.span('stage'):
+                raise ValueError()
+
+    assert trace.spans[1].tags == {'error': 'ValueError'}
+    assert trace.spans[1].duration is not None
+
+
+def test_headers():
+    trace = tracing.Trace('request')
+
+    with traced(trace):
+        with tracing.span('stage') as span:
+            headers = tracing.headers()
+
+    assert headers == {'X-B3-TraceId': trace.trace_id,
+                       'X-B3-SpanId': span.span_id,
+                       'X-B3-Sampled': '1'}
+
+
+def test_headers_outside_trace():
+    assert tracing.headers() == {}
+
+
+def test_start_trace_disabled():
+    assert tracing.start_trace(http_request(**{'X-B3-Sampled': '1'})) is None
+
+
+def test_start_trace_not_sampled(exporter):
+    assert tracing.start_trace(http_request()) is None
+
+
+def test_start_trace_sampled(exporter):
+    tracing._sample_rate = 1
+
+    trace = tracing.start_trace(http_request())
+
+    assert trace.root.name == 'POST /v1/auth/token'
+    assert trace.root.parent_id is None
+
+
+def test_start_trace_sampled_by_caller(exporter):
+    trace = tracing.start_trace(http_request(**{'X-B3-TraceId': 'trace1',
+                                           'X-B3-SpanId': 'span1',
+                                           'X-B3-Sampled': '1'}))
+
+    assert trace.trace_id == 'trace1'
+    assert trace.root.parent_id == 'span1'
+
+
+def test_start_trace_sampled_by_caller_limited(exporter):
+    request = http_request(**{'X-B3-Sampled': '1'})
+
+    with patch('auth.tracing.time.time', return_value=100):
+        tracing._forced = tracing.RateLimit(2)
+        traces = [tracing.start_trace(request) for _ in range(3)]
+
+    assert [x is not None for x in traces] == [True, True, False]
+
+
+def test_start_trace_sampled_by_caller_over_limit_uses_rate(exporter):
+    tracing._forced = tracing.RateLimit(0)
+    tracing._sample_rate = 1
+
+    assert tracing.start_trace(http_request(**{'X-B3-Sampled': '1'}))
+
+
+@patch('auth.tracing.time.time')
+def test_rate_limit(time):
+    time.return_value = 100
+    limit = tracing.RateLimit(2)
+
+    assert [limit.allow() for _ in range(3)] == [True, True, False]
+
+    time.return_value = 100.5
+    assert limit.allow()
+    assert not limit.allow()
+
+    time.return_value = 110
+    assert [limit.allow() for _ in range(3)] == [True, True, False]
+
+
+def test_start_trace_not_sampled_by_caller(exporter):
+    tracing._sample_rate = 1
+
+    assert tracing.start_trace(http_request(**{'X-B3-Sampled': '0'})) is None
+
+
+def test_finish_trace(exporter):
+    trace = tracing.Trace('request')
+    trace.start('unfinished')
+
+    tracing.finish_trace(trace, status=200)
+    tracing.flush()
+
+    span, = exporter.spans
+    assert span['name'] == 'request'
+    assert span['tags'] == {'status': 200}
+    assert span['trace_id'] == trace.trace_id
+
+
+def test_finish_trace_exports_full_batch(exporter):
+    with patch('auth.tracing.BATCH_SIZE', 2):
+        for _ in range(2):
+            tracing.finish_trace(tracing.Trace('request'))
+
+    assert len(exporter.spans) == 2
+
+
+@patch('auth.tracing.logging')
+def test_flush_export_fails(logging, exporter):
+    exporter.export = MagicMock(side_effect=IOError())
+    tracing.finish_trace(tracing.Trace('request'))
+
+    tracing.flush()
+
+    assert logging.exception.called
+    assert tracing._spans == []
+
+
+def test_file_exporter(tmpdir):
+    path = tmpdir.join('traces.jsonl')
+    file_exporter = tracing.FileExporter(str(path))
+    spans = [{'name': 'request'}, {'name': 'prepare'}]
+
+    file_exporter.export(spans[:1])
+    file_exporter.export(spans[1:])
+
+    assert [json.loads(x) for x in path.readlines()] == spans
+
+
+@patch('auth.tracing.options')
+def test_configure_disabled(options):
+    options.tracing = False
+
+    tracing.configure()
+
+    assert tracing._exporter is None
+
+
+@patch('auth.tracing.options')
+def test_configure_file(options):
+    options.tracing = True
+    options.tracing_sample_rate = 0.5
+    options.tracing_forced_rate = 5
+    options.tracing_exporter = 'file'
+    options.tracing_file = 'traces.jsonl'
+
+    tracing.configure()
+
+    try:
+        assert isinstance(tracing._exporter, tracing.FileExporter)
+        assert tracing._exporter.path == 'traces.jsonl'
+        assert tracing._sample_rate == 0.5
+        assert tracing._forced.rate == 5
+    finally:
+        tracing._exporter = None
+        tracing._sample_rate = 0
+        tracing._forced = tracing.RateLimit(tracing.DEFAULT_FORCED_RATE)
+
+
+@patch('auth.tracing.options')
+def test_configure_dotted_path(options):
+    options.tracing = True
+    options.tracing_sample_rate = 0.5
+    options.tracing_forced_rate = 5
+    options.tracing_exporter = 'test_tracing.RecordingExporter'
+
+    tracing.configure()
+
+    try:
+        assert isinstance(tracing._exporter, RecordingExporter)
+    finally:
+        tracing._exporter = None
+        tracing._sample_rate = 0
+        tracing._forced = tracing.RateLimit(tracing.DEFAULT_FORCED_RATE)
+
+
+@patch('auth.tracing.options')
+def test_configure_unknown_exporter(options):
+    options.tracing = True
+    options.tracing_sample_rate = 0.5
+    options.tracing_exporter = 'zipkin'
+
+    with pytest.raises(ValueError):
+        tracing.configure()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+from perch.views import _views
+
+from auth.views import auth_resource_access
+
+
+def organisation(state='approved'):
+    return {
+        '_id': 'org1',
+        'type': 'organisation',
+        'state': state,
+        'services': {
+            'service1': {
+                'state': 'approved',
+                'service_type': 'external',
+                'location': 'http://service1.test',
+                'permissions': [
+                    {'type': 'all', 'permission': 'r'}
+                ]
+            },
+            'service2': {'state': 'deactivated'}
+        },
+        'repositories': {
+            'repo1': {
+                'state': 'pending',
+                'service_id': 'service1',
+                'permissions': [
+                    {'type': 'organisation_id', 'value': 'org2',
+                     'permission': 'rw'},
+                    {'type': 'service_type', 'value': 'index',
+                     'permission': '-'},
+                ]
+            }
+        }
+    }
+
+
+def test_view_is_registered():
+    ids = [x['_id'] for x in _views['registry']]
+
+    assert '_design/auth_resource_access' in ids
+
+
+def test_emits_resources_and_permissions():
+    rows = dict((tuple(k), v)
+                for k, v in auth_resource_access(organisation()))
+
+    assert rows == {
+        ('resource', None, 'service1'): {
+            'type': 'service',
+            'organisation_id': 'org1',
+            'organisation_state': 'approved',
+            'state': 'approved',
+            'service_type': 'external',
+            'location': 'http://service1.test',
+            'service_id': None,
+        },
+        ('all', None, 'service1'): 'r',
+        ('resource', None, 'repo1'): {
+            'type': 'repository',
+            'organisation_id': 'org1',
+            'organisation_state': 'approved',
+            'state': 'pending',
+            'service_type': None,
+            'location': None,
+            'service_id': 'service1',
+        },
+        ('organisation_id', 'org2', 'repo1'): 'rw',
+        ('service_type', 'index', 'repo1'): '-',
+    }
+
+
+def test_parent_state_overrides_resource_state():
+    rows = dict((tuple(k), v)
+                for k, v in auth_resource_access(organisation('rejected')))
+
+    assert rows[('resource', None, 'service1')]['state'] == 'rejected'
+    assert rows[('resource', None, 'repo1')]['state'] == 'rejected'
+
+
+def test_ignores_deactivated_organisations():
+    assert list(auth_resource_access(organisation('deactivated'))) == []
+
+
+def test_ignores_other_documents():
+    assert list(auth_resource_access({'_id': 'user1', 'type': 'user'})) == []
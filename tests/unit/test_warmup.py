@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 Open Permissions Platform Coalition
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software distributed under the License is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and limitations under the License.
+
+import couch
+import perch
+from koi.test_helpers import make_future
+from mock import MagicMock, patch
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from auth import metrics, warmup
+
+CLIENT = perch.Service(id='client1', service_type='external',
+                       organisation_id='org1')
+
+
+class TestWarmUp(AsyncTestCase):
+    def setUp(self):
+        super(TestWarmUp, self).setUp()
+        metrics.reset()
+        warmup._ready = False
+        warmup._duration = None
+
+        patches = {
+            'options': patch('auth.warmup.options'),
+            'pool': patch('auth.warmup.pool'),
+            'registry': patch('auth.warmup.registry'),
+            'secrets': patch('auth.warmup.secrets'),
+            'token': patch('auth.warmup.token'),
+        }
+        self.mocks = {k: v.start() for k, v in patches.items()}
+        for p in patches.values():
+            self.addCleanup(p.stop)
+
+        options = self.mocks['options']
+        options.warm_up_timeout = 0
+        options.warm_up_client_id = 'client1'
+        self.mocks['secrets'].read.return_value = 'secret'
+        options.warm_up_resources = ['repo1']
+        self.mocks['pool'].warm_up.return_value = make_future(None)
+        self.mocks['registry'].authenticate.return_value = make_future(CLIENT)
+        self.mocks['registry'].get_resource.return_value = make_future(None)
+        self.mocks['token'].generate_token.return_value = ('token', 0)
+
+    @gen_test
+    def test_warm_up(self):
+        yield warmup.warm_up()
+
+        token = self.mocks['token']
+        registry = self.mocks['registry']
+        assert warmup.is_ready()
+        assert warmup.duration() is not None
+        assert token.signing_key.call_count == 1
+        assert token.verification_key.call_count == 1
+        assert self.mocks['pool'].warm_up.call_count == 1
+        registry.authenticate.assert_called_once_with(
+            'client1', 'secret', registry.authenticate.call_args[0][2])
+        registry.get_resource.assert_called_once_with(
+            'repo1', CLIENT, registry.get_resource.call_args[0][2])
+        token.generate_token.assert_called_once_with(
+            CLIENT, 'read', 'client_credentials')
+        token.decode_token.assert_called_once_with('token')
+        assert metrics.get('warm_up.failed') == 0
+
+    @gen_test
+    def test_synthetic_client(self):
+        self.mocks['options'].warm_up_client_id = ''
+
+        yield warmup.warm_up()
+
+        client = self.mocks['token'].generate_token.call_args[0][0]
+        assert client.id == warmup.SYNTHETIC_CLIENT['id']
+        assert not self.mocks['registry'].authenticate.called
+
+    @gen_test
+    def test_missing_resource(self):
+        self.mocks['registry'].get_resource.side_effect = couch.NotFound()
+
+        yield warmup.warm_up()
+
+        assert warmup.is_ready()
+        assert metrics.get('warm_up.failed') == 0
+
+    @gen_test
+    def test_failed_step(self):
+        self.mocks['pool'].warm_up.side_effect = [Exception('down')]
+
+        yield warmup.warm_up()
+
+        assert warmup.is_ready()
+        assert metrics.get('warm_up.failed') == 1
+        assert self.mocks['token'].decode_token.call_count == 1
+
+    @gen_test
+    def test_timeout(self):
+        self.mocks['options'].warm_up_timeout = 0.01
+        self.mocks['pool'].warm_up.return_value = Future()
+
+        yield warmup.warm_up()
+
+        assert warmup.is_ready()
+        assert metrics.get('warm_up.failed') == 3
+        assert not self.mocks['registry'].authenticate.called
+
+
+@patch('auth.warmup.IOLoop')
+@patch('auth.warmup.options')
+def test_start(options, IOLoop):
+    warmup._ready = False
+    options.warm_up = True
+
+    warmup.start()
+
+    IOLoop.current.return_value.add_callback.assert_called_once_with(
+        warmup.warm_up)
+    assert not warmup.is_ready()
+
+
+@patch('auth.warmup.options')
+def test_start_disabled(options):
+    warmup._ready = False
+    options.warm_up = False
+
+    warmup.start()
+
+    assert warmup.is_ready()
+
+
+@patch('auth.warmup.options')
+def test_listeners_notified_when_ready(options):
+    warmup._ready = False
+    options.warm_up = False
+    listener = MagicMock()
+
+    with patch.object(warmup, '_listeners', [listener]):
+        warmup.start()
+
+    listener.assert_called_once_with()